@@ -0,0 +1,289 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import logging
+import paramiko
+
+from ClusterBuilder import BatchCreate
+from ClusterBuilder import GCEDriver
+from ClusterBuilder import SSHSessions
+from ClusterBuilder import Trace
+from ClusterDestroyer import ClusterDestroyer
+
+import FakeGCE
+import FakeSSHServer
+
+# Offline orchestration benchmark.
+# Runs the `cape create --type gpdb` flow (buildServers, downloadSoftware,
+# installGPDB) and then `cape destroy` against a simulated cluster: FakeGCE stands in for the libcloud
+# driver, FakeSSHServer plays every node's sshd on a loopback address and
+# FakePivnet serves the release metadata.  Each cluster size runs in its own
+# controller process (the simulator in another one) so wall time, peak thread
+# count, peak RSS and SSH handshakes are the controller's alone.  With
+# --clusters K every size is K clusters built at once by one controller, the
+# way `cape create --count K` does.
+#
+#   python -m Benchmark.Benchmark --nodes 4,16,64,256
+#   python -m Benchmark.Benchmark --nodes 4 --clusters 10
+#   python -m Benchmark.Benchmark --nodes 4 --fail-step installBits
+#
+# --fail-step fails one batched command of that install step on the last
+# node; the run passes when the build stops and the journal does not record
+# the step for that node, so `cape create --resume` would run it again.
+#
+# Loopback aliases beyond 127.0.0.1 work out of the box on Linux only.
+
+DEFAULT_SIZES = "4,16,64,256"
+DEFAULT_PORT = 2222
+# Install step -> the batched command of it the simulator fails
+FAIL_STEPS = {"prepFiles": "agreed", "installBits": "install", "makeDirectories": "mkdir", "setPaths": "greenplumPath"}
+CAPE_HOME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def nodeAddress(nodeNum):
+    return "127.0." + str(nodeNum // 250 + 1) + "." + str(nodeNum % 250 + 2)
+
+
+def prepareWorkdir(workdir):
+    # cape reads templates and scripts under CAPE_HOME
+    for name in ["templates", "scripts"]:
+        os.symlink(CAPE_HOME + "/" + name, workdir + "/" + name)
+    os.makedirs(workdir + "/configs")
+    paramiko.RSAKey.generate(2048).write_private_key_file(workdir + "/configs/bench_key")
+    os.chdir(workdir)
+
+
+def benchEnvironment(workdir, args, pivnetURL):
+    return {
+        "CAPE_HOME": workdir,
+        "CONFIGS_PATH": workdir + "/configs/",
+        "SSH_KEY": "bench_key",
+        "SSH_USERNAME": "cape",
+        "SSH_PORT": str(args.port),
+        "SVC_ACCOUNT": "bench@cape-bench.iam.gserviceaccount.com",
+        "SVC_ACCOUNT_KEY": "none.json",
+        "PROJECT": "cape-bench",
+        "ZONE": "us-central1-f",
+        "SERVER_TYPE": "n1-standard-8",
+        "IMAGE": "centos-6-v20160526",
+        "DISK_TYPE": "pd-standard",
+        "DISK_SIZE": "100",
+        "DISK_QTY": "4",
+        "GPADMIN_PW": "p1v0tal",
+        "ROOT_PW": "p1v0tal",
+        "INSTRUCTOR_PW": "p1v0tal",
+        "PIVNET_APIKEY": "bench",
+        "PIVNET_URL": pivnetURL,
+        "BASE_HOME": "/data",
+        "SEGMENTDBS": "2",
+        "MIRRORS": "yes",
+        "RAID0": "no",
+        "STANDBY": "no",
+        "ACCESS": "no",
+        "SET_GUCS": "no",
+        "GUC_PROFILE": "tpcds",
+        "REBOOT": args.reboot,
+        "VALIDATE": "yes",
+        "GPDB_BUILD": "",
+    }
+
+
+def sampleThreads(samples, stop):
+    while not stop.is_set():
+        samples.append(threading.active_count())
+        stop.wait(0.1)
+
+
+def runSize(nodeQty, args):
+    # One create against a fresh simulator, returns the measurements
+    workdir = tempfile.mkdtemp(prefix="cape-bench-" + str(nodeQty) + "-")
+    prepareWorkdir(workdir)
+    logging.basicConfig(filename=workdir + "/cape.log", level=args.loglevel, filemode='w',
+                        format='[%(asctime)s] {%(module)s:%(funcName)s:%(lineno)d} %(levelname)s %(threadName)s - %(message)s')
+    if args.clusters > 1:
+        clusterNames = BatchCreate.batchNames("bench" + str(nodeQty), args.clusters)
+    else:
+        clusterNames = ["bench" + str(nodeQty)]
+    nodes = []
+    segmentHosts = []
+    for clusterName in clusterNames:
+        nodeNames = [clusterName + "-" + str(nodeNum).zfill(3) for nodeNum in range(nodeQty)]
+        nodes.extend([(nodeAddress(len(nodes) + nodeNum), nodeName) for nodeNum, nodeName in enumerate(nodeNames)])
+        segmentHosts.extend(nodeNames[1:])
+
+    failNode = nodes[-1][1]
+    (connection, simulatorEnd) = multiprocessing.Pipe()
+    simulator = multiprocessing.Process(target=FakeSSHServer.serve,
+                                        args=(simulatorEnd, nodes, args.port, args.scale, segmentHosts, 2, True,
+                                              workdir + "/simulator.log", FAIL_STEPS.get(args.fail_step), failNode))
+    simulator.start()
+    pivnetURL = connection.recv()
+    os.environ.update(benchEnvironment(workdir, args, pivnetURL))
+
+    driver = FakeGCE.FakeGCEDriver(dict([(name, address) for (address, name) in nodes]), latency=args.latency,
+                                   failureRate=args.failure_rate, bootTime=args.boot_time)
+    # Every thread gets its own copy of the fake, wrapped like a real driver
+    GCEDriver.connectDriver = lambda: driver
+
+    clusterDictionaries = [{"clusterName": clusterName, "nodeQty": nodeQty, "clusterType": "pivotal-gpdb",
+                            "segmentDBs": "2", "masterCount": 0, "accessCount": 0, "segmentCount": 0}
+                           for clusterName in clusterNames]
+    samples = []
+    stop = threading.Event()
+    sampler = threading.Thread(target=sampleThreads, args=(samples, stop))
+    sampler.daemon = True
+    sampler.start()
+    error = None
+    startTime = time.time()
+    try:
+        if args.clusters > 1:
+            failures = BatchCreate.buildClusters(clusterDictionaries, "gpdb")
+            if failures:
+                error = str(len(failures)) + " of " + str(args.clusters) + " clusters failed"
+        else:
+            BatchCreate.buildCluster(clusterDictionaries[0], "gpdb")
+    except SystemExit as e:
+        error = str(e) or "exit"
+    except Exception as e:
+        logging.exception('Benchmark run failed')
+        error = str(e)
+    wallTime = time.time() - startTime
+    if args.fail_step:
+        error = checkFailedStep(workdir, failNode, args.fail_step, error)
+    destroyStart = time.time()
+    try:
+        with Trace.span("destroyServers"):
+            ClusterDestroyer.destroyServers({"clusterName": ",".join(clusterNames)})
+        if driver.nodes or driver.disks:
+            raise Exception("destroy left " + str(len(driver.nodes)) + " instances and " +
+                            str(len(driver.disks)) + " disks")
+    except SystemExit as e:
+        error = error or str(e) or "exit"
+    except Exception as e:
+        logging.exception('Benchmark destroy failed')
+        error = error or str(e)
+    destroyTime = time.time() - destroyStart
+    stop.set()
+    sampler.join()
+
+    result = {"nodes": nodeQty,
+              "clusters": args.clusters,
+              "wallTime": round(wallTime, 1),
+              "destroyTime": round(destroyTime, 1),
+              "peakThreads": max(samples),
+              "peakRSSMB": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+              "handshakes": SSHSessions.handshakeCount(),
+              "gceRequests": driver.stats["requests"],
+              "gceFailures": driver.stats["failures"],
+              "gceAPI": GCEDriver.summary(),
+              "error": error,
+              "workdir": workdir}
+    Trace.write(clusterNames[0], "bench")
+    if args.clusters > 1:
+        for clusterName in clusterNames:
+            Trace.write(clusterName, "create", clusterName)
+            Trace.summary(clusterName, clusterName)
+    else:
+        Trace.summary(clusterNames[0])
+    SSHSessions.closeAll()
+    connection.send("stop")
+    result["simulator"] = connection.recv()
+    simulator.join()
+    return result
+
+
+def checkFailedStep(workdir, failNode, stepName, error):
+    # None when the build stopped and the failed step is not in the journal
+    if error is None:
+        return "build did not stop at the failed " + stepName
+    clusterName = failNode.rsplit("-", 1)[0]
+    with open(workdir + "/clusterConfigs/" + clusterName + "/journal.jsonl", "r") as journalFile:
+        for line in journalFile:
+            entry = json.loads(line)
+            if entry["node"] == failNode and entry["step"] == stepName:
+                return "failed " + stepName + " on " + failNode + " was journaled"
+    logging.info('Build stopped at the failed ' + stepName + ' (' + error + '), not journaled')
+    return None
+
+
+def printResults(results):
+    print "Nodes  Wall(s)  Destroy(s)  Threads  RSS(MB)  Handshakes  Commands  GCE calls  Result"
+    for result in results:
+        simulator = result.get("simulator", {})
+        nodes = str(result["nodes"])
+        if result.get("clusters", 1) > 1:
+            nodes = str(result["clusters"]) + "x" + nodes
+        print nodes.rjust(5) + str(result["wallTime"]).rjust(9) + str(result.get("destroyTime", "-")).rjust(12) + \
+            str(result["peakThreads"]).rjust(9) + str(result["peakRSSMB"]).rjust(9) + \
+            str(result["handshakes"]).rjust(12) + str(simulator.get("commands", "-")).rjust(10) + \
+            str(result["gceRequests"]).rjust(11) + "  " + ("ok" if result["error"] is None else "FAILED: " + result["error"])
+        if result.get("gceAPI"):
+            print "       " + result["gceAPI"]
+        print "       trace and logs: " + result["workdir"]
+
+
+def cliParse():
+    parser = argparse.ArgumentParser(description="Benchmark cape create against a simulated cluster")
+    parser.add_argument("--nodes", dest="nodes", default=DEFAULT_SIZES, action="store",
+                        help="Comma separated cluster sizes (default " + DEFAULT_SIZES + ")")
+    parser.add_argument("--scale", dest="scale", default=0.05, type=float, action="store",
+                        help="Simulated remote command time as a fraction of the real time")
+    parser.add_argument("--latency", dest="latency", default=0.1, type=float, action="store",
+                        help="Seconds per simulated GCE API request")
+    parser.add_argument("--failure-rate", dest="failure_rate", default=0.0, type=float, action="store",
+                        help="Probability a simulated GCE API request fails")
+    parser.add_argument("--boot-time", dest="boot_time", default=2.0, type=float, action="store",
+                        help="Seconds simulated instances take to boot after the create requests")
+    parser.add_argument("--port", dest="port", default=DEFAULT_PORT, type=int, action="store",
+                        help="Port the simulated sshd listens on")
+    parser.add_argument("--clusters", dest="clusters", default=1, type=int, action="store",
+                        help="Clusters of each size built at once from one controller")
+    parser.add_argument("--fail-step", dest="fail_step", choices=sorted(FAIL_STEPS), action="store",
+                        help="Install step to fail on the last node, checks that it is not journaled")
+    parser.add_argument("--reboot", dest="reboot", default="auto", choices=["auto", "always"], action="store",
+                        help="REBOOT setting for the runs, always brings back the post preparation reboot")
+    parser.add_argument("--output", dest="output", action="store", help="Write the results as JSON to this file")
+    parser.add_argument("--loglevel", dest="loglevel", default="DEBUG", action="store",
+                        help="Logging level of each run's cape.log")
+    parser.add_argument("--run", dest="run", type=int, action="store", help=argparse.SUPPRESS)
+    parser.add_argument("--result", dest="result", action="store", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        result = runSize(args.run, args)
+        with open(args.result, "w") as resultFile:
+            json.dump(result, resultFile)
+        return
+
+    results = []
+    for nodeQty in [int(size) for size in args.nodes.split(",")]:
+        print "Benchmarking " + str(nodeQty) + " Nodes"
+        (handle, resultPath) = tempfile.mkstemp(prefix="cape-bench-", suffix=".json")
+        os.close(handle)
+        command = [sys.executable, "-m", "Benchmark.Benchmark", "--run", str(nodeQty), "--result", resultPath] + \
+            [argument for argument in sys.argv[1:]]
+        with open(resultPath + ".out", "w") as outputFile:
+            returnCode = subprocess.call(command, cwd=CAPE_HOME, stdout=outputFile, stderr=subprocess.STDOUT)
+        try:
+            with open(resultPath, "r") as resultFile:
+                results.append(json.load(resultFile))
+        except ValueError:
+            results.append({"nodes": nodeQty, "wallTime": 0, "peakThreads": 0, "peakRSSMB": 0, "handshakes": 0,
+                            "gceRequests": 0, "error": "run exited with " + str(returnCode),
+                            "workdir": resultPath + ".out"})
+        os.remove(resultPath)
+    printResults(results)
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            json.dump(results, outputFile, indent=2)
+
+
+if __name__ == '__main__':
+    cliParse()
@@ -0,0 +1,203 @@
+import itertools
+import random
+import re
+import threading
+import time
+import logging
+from libcloud.common.google import GoogleBaseError, ResourceNotFoundError
+from libcloud.compute.base import Node, StorageVolume
+from libcloud.compute.types import NodeState
+
+# Stand-in for the libcloud GCE driver.
+# Implements the calls the build path makes (multi node create, volume create
+# and attach) against an in-memory zone.  Every API request costs `latency`
+# seconds (+/- jitter) and fails with probability `failureRate`, the way a
+# throttled or flaky GCE API would.  Instances are handed the loopback
+# address the simulated sshd listens on for their name.  The raw
+# connection requests cape makes itself (labels, deletes, operation polls)
+# are served by FakeConnection from the same zone; a delete finishes
+# `deleteTime` seconds after it was issued and takes auto delete disks along.
+
+
+class FakeAPIError(Exception):
+    pass
+
+
+class FakeGCEDriver(object):
+    name = "Fake Google Compute Engine"
+    type = "gce"
+
+    def __init__(self, addresses, latency=0.2, jitter=0.5, failureRate=0.0, bootTime=2.0, deleteTime=2.0):
+        # {instance name: address}
+        self.addresses = dict(addresses)
+        self.latency = latency
+        self.jitter = jitter
+        self.failureRate = failureRate
+        self.bootTime = bootTime
+        self.deleteTime = deleteTime
+        self.nodes = {}
+        self.volumes = {}
+        # name -> {"labels": {}, "users": [instance names]} for every disk, boot disks included
+        self.disks = {}
+        self.labels = {}
+        self.operations = {}
+        self.stats = {"requests": 0, "failures": 0}
+        self._lock = threading.Lock()
+        self._nodeCount = itertools.count()
+        self.connection = FakeConnection(self)
+
+    def _request(self, what):
+        # One simulated API round trip
+        with self._lock:
+            self.stats["requests"] += 1
+        time.sleep(max(0.0, self.latency * (1 + random.uniform(-self.jitter, self.jitter))))
+        if random.random() < self.failureRate:
+            with self._lock:
+                self.stats["failures"] += 1
+            raise FakeAPIError('Simulated GCE API failure: ' + what)
+
+    def _newNode(self, name, disks):
+        with self._lock:
+            index = next(self._nodeCount)
+            externalIP = self.addresses[name]
+            node = Node(id=str(index + 1000), name=name, state=NodeState.RUNNING,
+                        public_ips=[externalIP], private_ips=["10.128." + str(index // 250) + "." + str(index % 250 + 2)],
+                        driver=self, extra={"disks": disks})
+            self.nodes[name] = node
+        return node
+
+    def ex_create_multiple_nodes(self, base_name, size, image, number, location=None, ex_network='default',
+                                 ex_tags=None, ex_metadata=None, ignore_errors=True, use_existing_disk=False,
+                                 poll_interval=2, external_ip='ephemeral', ex_service_accounts=None, timeout=180,
+                                 description=None, ex_can_ip_forward=None, ex_disks_gce_struct=None,
+                                 ex_nic_gce_struct=None, ex_on_host_maintenance=None, ex_automatic_restart=None):
+        # libcloud inserts the instances one request at a time, then polls until they are all running
+        nodes = []
+        for nodeNum in range(number):
+            name = base_name + "-" + str(nodeNum).zfill(3)
+            try:
+                self._request("insert " + name)
+            except FakeAPIError as e:
+                if not ignore_errors:
+                    raise
+                logging.debug(str(e))
+                continue
+            disks = []
+            for diskNum, disk in enumerate(ex_disks_gce_struct or []):
+                diskName = name if disk.get("boot") else name + "-" + str(diskNum)
+                self._addDisk(diskName, disk.get("initializeParams", {}).get("labels", {}), name)
+                if not disk.get("boot"):
+                    disks.append({"boot": False, "source": "zones/fake/disks/" + diskName})
+            nodes.append(self._newNode(name, disks))
+        time.sleep(self.bootTime)
+        self._request("list instances")
+        return nodes
+
+    def create_volume(self, size, name, location=None, snapshot=None, image=None, use_existing=True,
+                      ex_disk_type='pd-standard', ex_image_family=None):
+        self._request("insert disk " + name)
+        volume = StorageVolume(id=name, name=name, size=size, driver=self)
+        with self._lock:
+            self.volumes[name] = volume
+        self._addDisk(name, {}, None)
+        return volume
+
+    def attach_volume(self, node, volume, device=None, ex_mode=None, ex_boot=False, ex_type=None, ex_source=None,
+                      ex_auto_delete=None, ex_initialize_params=None, ex_licenses=None, ex_interface=None):
+        self._request("attach disk " + volume.name + " to " + node.name)
+        with self._lock:
+            self.disks[volume.name]["users"].append(node.name)
+        return True
+
+    def _addDisk(self, name, labels, user):
+        with self._lock:
+            self.disks[name] = {"labels": dict(labels), "users": [user] if user else []}
+
+    def ex_get_node(self, name, zone=None):
+        self._request("get " + name)
+        if name not in self.nodes:
+            raise ResourceNotFoundError({"message": "The resource '" + name + "' was not found"}, 404, "notFound")
+        return self.nodes[name]
+
+    def list_nodes(self, ex_zone=None):
+        self._request("list instances")
+        return list(self.nodes.values())
+
+
+class FakeResponse(object):
+    def __init__(self, responseObject):
+        self.object = responseObject
+
+
+class FakeConnection(object):
+    # The subset of GCEConnection.request cape uses directly
+
+    def __init__(self, driver):
+        self.driver = driver
+        self._operationCount = itertools.count()
+
+    def _notFound(self, name):
+        raise ResourceNotFoundError({"message": "The resource '" + name + "' was not found"}, 404, "notFound")
+
+    def _resource(self, kind, name):
+        # Caller holds the driver lock
+        driver = self.driver
+        if kind == "instances":
+            if name not in driver.nodes:
+                self._notFound(name)
+            return {"name": name, "id": driver.nodes[name].id, "status": "RUNNING",
+                    "labels": dict(driver.labels.get(name, {})), "labelFingerprint": "fake"}
+        if name not in driver.disks:
+            self._notFound(name)
+        return {"name": name, "labels": dict(driver.disks[name]["labels"]), "labelFingerprint": "fake",
+                "users": ["zones/fake/instances/" + user for user in driver.disks[name]["users"]]}
+
+    def _completeOperations(self):
+        # Caller holds the driver lock
+        driver = self.driver
+        for operation in driver.operations.values():
+            if operation["status"] == "DONE" or time.time() < operation["doneAt"]:
+                continue
+            operation["status"] = "DONE"
+            (kind, name) = operation["target"]
+            if kind == "instances":
+                driver.nodes.pop(name, None)
+                driver.labels.pop(name, None)
+                for diskName in [diskName for diskName, disk in driver.disks.items() if name in disk["users"]]:
+                    del driver.disks[diskName]
+            else:
+                driver.disks.pop(name, None)
+                driver.volumes.pop(name, None)
+
+    def request(self, action, params=None, data=None, headers=None, method="GET"):
+        driver = self.driver
+        try:
+            driver._request(method + " " + action)
+        except FakeAPIError as e:
+            # Raw requests see the failure the way GCE reports throttling
+            raise GoogleBaseError(str(e), 403, "rateLimitExceeded")
+        with driver._lock:
+            self._completeOperations()
+            if action.startswith("https://fake/operations/"):
+                operation = driver.operations[action]
+                return FakeResponse({"selfLink": action, "status": operation["status"]})
+            match = re.match(r"^/zones/[^/]+/(instances|disks)(?:/([^/]+))?(?:/(setLabels))?$", action)
+            (kind, name, verb) = match.groups()
+            if name is None:
+                (key, value) = re.match(r"^labels\.(\S+) eq (\S+)$", params["filter"]).groups()
+                names = driver.nodes.keys() if kind == "instances" else driver.disks.keys()
+                items = [self._resource(kind, itemName) for itemName in sorted(names)]
+                return FakeResponse({"items": [item for item in items if item["labels"].get(key) == value]})
+            resource = self._resource(kind, name)
+            if verb == "setLabels":
+                if kind == "instances":
+                    driver.labels[name] = dict(data["labels"])
+                else:
+                    driver.disks[name]["labels"] = dict(data["labels"])
+                return FakeResponse({"status": "DONE"})
+            if method == "DELETE":
+                selfLink = "https://fake/operations/" + str(next(self._operationCount))
+                driver.operations[selfLink] = {"target": (kind, name), "status": "RUNNING",
+                                               "doneAt": time.time() + driver.deleteTime}
+                return FakeResponse({"selfLink": selfLink, "status": "RUNNING"})
+            return FakeResponse(resource)
@@ -0,0 +1,122 @@
+import json
+import threading
+import logging
+import BaseHTTPServer
+import SocketServer
+
+# Stand-in for the PivNet API.
+# Serves the product, release and release detail documents a create walks
+# through (with ETags, so the metadata cache revalidates like it would against
+# the real server) and accepts EULA POSTs.  FILES is the product file list;
+# the simulated sshd uses the same sizes to time the downloads.
+
+PRODUCT = "pivotal-gpdb"
+RELEASE_ID = 4242
+VERSION = "4.3.10.0"
+ETAG = '"cape-bench-1"'
+
+FILES = [
+    {"id": 9001, "group": "Database Server", "size": 310 * 1048576,
+     "name": "Greenplum Database 4.3.10.0 Binary Installer for Red Hat Enterprise Linux 5, 6",
+     "key": "product-files/pivotal-gpdb/greenplum-db-4.3.10.0-rhel5-x86_64.zip", "version": VERSION},
+    {"id": 9002, "group": "Loaders", "size": 120 * 1048576,
+     "name": "Loaders for Red Hat Enterprise Linux x86_64",
+     "key": "product-files/pivotal-gpdb/greenplum-loaders-4.3.10.0-rhel5-x86_64.zip", "version": VERSION},
+    {"id": 9003, "group": "MADlib", "size": 22 * 1048576,
+     "name": "MADlib 1.9.1 for RHEL 5",
+     "key": "product-files/pivotal-gpdb/madlib-1.9.1-gp4.3-rhel5-x86_64.tar.gz", "version": "1.9.1"},
+    {"id": 9004, "group": "Language extensions", "size": 12 * 1048576,
+     "name": "PL/R Extension for RHEL 5",
+     "key": "product-files/pivotal-gpdb/plr-ossv8.3.0.15_pv2.1_gpdb4.3orca-rhel5-x86_64.gppkg", "version": "2.1"},
+    {"id": 9005, "group": "Clients", "size": 64 * 1048576,
+     "name": "Clients for Red Hat Enterprise Linux x86_64",
+     "key": "product-files/pivotal-gpdb/greenplum-clients-4.3.10.0-rhel5-x86_64.zip", "version": VERSION},
+]
+
+
+def fileName(file):
+    return file["key"].split("/")[2]
+
+
+def fileSizes():
+    # By file name and by PivNet id, the two ways a remote command refers to an artifact
+    sizes = {}
+    for file in FILES:
+        sizes[fileName(file)] = file["size"]
+        sizes[str(file["id"])] = file["size"]
+    return sizes
+
+
+def documents(baseURL):
+    releaseURL = baseURL + "/api/v2/products/" + PRODUCT + "/releases"
+    groups = {}
+    for file in FILES:
+        groups.setdefault(file["group"], []).append({
+            "id": file["id"], "name": file["name"], "aws_object_key": file["key"],
+            "file_version": file["version"], "sha256": None,
+            "_links": {"download": {"href": releaseURL + "/" + str(RELEASE_ID) + "/product_files/" +
+                                            str(file["id"]) + "/download"}}})
+    return {
+        "/api/v2/products": {"products": [
+            {"id": 1, "slug": PRODUCT, "_links": {"releases": {"href": releaseURL}}}]},
+        "/api/v2/products/" + PRODUCT + "/releases": {"releases": [
+            {"id": RELEASE_ID - 1, "version": "4.3.1.0"},
+            {"id": RELEASE_ID, "version": VERSION}]},
+        "/api/v2/products/" + PRODUCT + "/releases/" + str(RELEASE_ID): {
+            "id": RELEASE_ID, "version": VERSION,
+            "file_groups": [{"name": name, "product_files": productFiles} for name, productFiles in groups.items()]},
+    }
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self.server.count("GET")
+        document = self.server.documents.get(self.path)
+        if document is None:
+            self.send_error(404)
+            return
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps(document)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.server.count("POST")
+        body = json.dumps({"accepted_at": "2016-11-01T00:00:00Z"})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('FakePivnet: ' + format % args)
+
+
+class FakePivnetServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0)):
+        BaseHTTPServer.HTTPServer.__init__(self, address, _Handler)
+        self.url = "http://" + self.server_address[0] + ":" + str(self.server_address[1])
+        self.documents = documents(self.url)
+        self.stats = {"GET": 0, "POST": 0}
+        self._lock = threading.Lock()
+
+    def count(self, method):
+        with self._lock:
+            self.stats[method] += 1
+
+    def start(self):
+        serverThread = threading.Thread(target=self.serve_forever, name="FakePivnet")
+        serverThread.daemon = True
+        serverThread.start()
+        return self.url
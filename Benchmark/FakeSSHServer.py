@@ -0,0 +1,374 @@
+import base64
+import hashlib
+import json
+import re
+import select
+import socket
+import threading
+import time
+import uuid
+import logging
+import paramiko
+
+import FakePivnet
+
+# Simulated cluster sshd.
+# One paramiko server answers for every node of a simulated cluster, each node
+# on its own loopback address (127.0.x.y) and the SSH_PORT the controller is
+# pointed at.  Commands are not executed: each one sleeps for the time the real
+# command takes on a GCE node (COMMAND_TIMES, multiplied by `scale`) and
+# answers with the output the controller parses (host keys, FQDN, batch and
+# download results, gp_segment_configuration rows, boot ids).  `sudo reboot`
+# really takes the node's listener down for REBOOT_TIME seconds and changes its
+# boot id, so reboot detection behaves as it does against a real instance.
+# Simulated hosts always take their tuning live, prepareHost.sh never asks for
+# a reboot (REBOOT=always still forces one).  sftp uploads are counted and
+# discarded.  failStep makes that batch step fail on the failNode node.
+
+# (pattern, seconds at scale 1.0), first match wins
+COMMAND_TIMES = [
+    (r"/tmp/prepareHost\.sh \d", 90.0),
+    (r"gpinitsystem", 45.0),
+    (r"madpack", 30.0),
+    (r"gppkg", 15.0),
+    (r"yum ", 40.0),
+    (r"/tmp/greenplum-db\*\.bin\s*$", 25.0),
+    (r"unzip|tar -I|tar xf", 8.0),
+    (r"psql|createlang", 0.5),
+    (r"passwd|useradd", 0.3),
+]
+DEFAULT_TIME = 0.05
+REBOOT_TIME = 40.0
+# Long enough for the controller to see the node go away
+MIN_DOWNTIME = 3.0
+DOWNLOAD_BANDWIDTH = 60 * 1048576
+INTERNAL_BANDWIDTH = 250 * 1048576
+# What cape validate parses from its disk and network steps
+VALIDATE_OUTPUT = {
+    "diskTest": "".join(["/data/disk" + str(diskNum) + " 180 240\n" for diskNum in range(1, 5)]),
+    "iperf3Client": "1950\n",
+}
+# Per host cost of gpinitsystem on top of the fixed part
+GPINIT_HOST_TIME = 0.5
+
+BATCH_STEP = re.compile(r"\(\n(.*?)\n\) > \$CAPE_LOGS/(\w+)\.log 2>&1 < /dev/null\n", re.S)
+DOWNLOAD_JOB = re.compile(r"^(capeFetch|capeStream) '([^']*)' '([^']*)' '([^']*)' '([^']*)' '([^']*)' &$", re.M)
+DOWNLOAD_WORKERS = re.compile(r"jobs -rp \| wc -l\) -ge (\d+)")
+ARTIFACT_ID = re.compile(r"cape-artifacts/(\d+)-")
+
+
+class SimulatedNode(object):
+
+    def __init__(self, address, name):
+        self.address = address
+        self.name = name
+        self.listener = None
+        self.up = False
+        self.transports = []
+        self.files = {}
+        self.bootID = str(uuid.uuid4())
+        self.lock = threading.Lock()
+        fingerprint = base64.b64encode(hashlib.sha256(name).digest())
+        self.hostKeys = "ssh-rsa AAAAB3NzaC1yc2E" + fingerprint + " root@" + name + "\n" + \
+                        "ecdsa-sha2-nistp256 AAAAE2VjZHNh" + fingerprint + " root@" + name + "\n"
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    # Any user, any password or key
+
+    def __init__(self, simulator, node):
+        self.simulator = simulator
+        self.node = node
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OPEN_REQUEST
+
+    def check_channel_exec_request(self, channel, command):
+        commandThread = threading.Thread(target=self.simulator.execute, args=(self.node, channel, command))
+        commandThread.daemon = True
+        commandThread.start()
+        return True
+
+
+class _SinkHandle(paramiko.SFTPHandle):
+
+    def __init__(self, node, path, flags=0):
+        paramiko.SFTPHandle.__init__(self, flags)
+        self.node = node
+        self.path = path
+        self.size = 0
+
+    def write(self, offset, data):
+        self.size = max(self.size, offset + len(data))
+        return paramiko.SFTP_OK
+
+    def stat(self):
+        attributes = paramiko.SFTPAttributes()
+        attributes.st_size = self.size
+        attributes.st_mode = 0100644
+        return attributes
+
+    def close(self):
+        with self.node.lock:
+            self.node.files[self.path] = self.size
+        paramiko.SFTPHandle.close(self)
+
+
+class _SinkSFTP(paramiko.SFTPServerInterface):
+
+    def __init__(self, server, simulator, node):
+        paramiko.SFTPServerInterface.__init__(self, server)
+        self.simulator = simulator
+        self.node = node
+
+    def open(self, path, flags, attr):
+        return _SinkHandle(self.node, path, flags)
+
+    def stat(self, path):
+        with self.node.lock:
+            if path not in self.node.files:
+                return paramiko.SFTP_NO_SUCH_FILE
+            size = self.node.files[path]
+        self.simulator.count("uploadBytes", size)
+        attributes = paramiko.SFTPAttributes()
+        attributes.st_size = size
+        attributes.st_mode = 0100644
+        return attributes
+
+    lstat = stat
+
+
+class FakeSSHServer(object):
+
+    def __init__(self, nodes, port, scale=0.05, segmentHosts=None, segmentDBs=2, mirrors=True, sizes=None,
+                 failStep=None, failNode=None):
+        self.nodes = [SimulatedNode(address, name) for (address, name) in nodes]
+        self.port = port
+        self.scale = scale
+        self.segmentHosts = segmentHosts or []
+        self.segmentDBs = segmentDBs
+        self.mirrors = mirrors
+        self.sizes = sizes or {}
+        self.failStep = failStep
+        self.failNode = failNode
+        self.hostKey = paramiko.RSAKey.generate(1024)
+        self.stats = {"handshakes": 0, "commands": 0, "reboots": 0, "uploadBytes": 0, "downloadBytes": 0}
+        self._lock = threading.Lock()
+        self._running = False
+
+    def count(self, stat, amount=1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def listen(self, node):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((node.address, self.port))
+        listener.listen(128)
+        node.listener = listener
+        node.up = True
+
+    def start(self):
+        for node in self.nodes:
+            self.listen(node)
+        self._running = True
+        acceptThread = threading.Thread(target=self.acceptLoop, name="FakeSSHAccept")
+        acceptThread.daemon = True
+        acceptThread.start()
+
+    def stop(self):
+        self._running = False
+        for node in self.nodes:
+            self.down(node)
+
+    def acceptLoop(self):
+        # One thread watches every node's listener
+        while self._running:
+            listeners = dict((node.listener, node) for node in self.nodes if node.up and node.listener is not None)
+            try:
+                (readable, writable, errored) = select.select(listeners.keys(), [], [], 0.2)
+            except (select.error, socket.error, ValueError):
+                continue
+            for listener in readable:
+                node = listeners[listener]
+                try:
+                    (sock, address) = listener.accept()
+                except socket.error:
+                    continue
+                serveThread = threading.Thread(target=self.serve, args=(node, sock))
+                serveThread.daemon = True
+                serveThread.start()
+
+    def serve(self, node, sock):
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(self.hostKey)
+        transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _SinkSFTP, self, node)
+        try:
+            transport.start_server(server=_ServerInterface(self, node))
+        except (paramiko.SSHException, EOFError, socket.error) as e:
+            # Banner probes connect and hang up without negotiating
+            logging.debug(node.name + ': Probe connection: ' + str(e))
+            transport.close()
+            return
+        self.count("handshakes")
+        # Channels are served from the exec and subsystem requests, the transport thread keeps them alive
+        with node.lock:
+            node.transports.append(transport)
+
+    def down(self, node):
+        node.up = False
+        with node.lock:
+            transports = list(node.transports)
+            node.transports = []
+        for transport in transports:
+            transport.close()
+        if node.listener is not None:
+            node.listener.close()
+            node.listener = None
+
+    def reboot(self, node):
+        time.sleep(0.5 * self.scale)
+        self.down(node)
+        time.sleep(max(REBOOT_TIME * self.scale, MIN_DOWNTIME))
+        node.bootID = str(uuid.uuid4())
+        self.listen(node)
+        logging.debug(node.name + ': Rebooted')
+
+    def clusterSegments(self, node):
+        # Several clusters can share the simulator, nodes are named <cluster>-NNN
+        clusterName = re.sub(r'-\d{3}$', '', node.name)
+        return (clusterName + "-000", [hostname for hostname in self.segmentHosts
+                                       if hostname.startswith(clusterName + "-")])
+
+    def commandTime(self, command, node):
+        for (pattern, seconds) in COMMAND_TIMES:
+            if re.search(pattern, command):
+                if pattern == "gpinitsystem":
+                    seconds = seconds + GPINIT_HOST_TIME * len(self.clusterSegments(node)[1])
+                return seconds * self.scale
+        return DEFAULT_TIME * self.scale
+
+    def execute(self, node, channel, command):
+        # Runs on its own thread, give the transport time to acknowledge the exec request first
+        time.sleep(0.05)
+        self.count("commands")
+        try:
+            script = ""
+            if command.rstrip().endswith(" -s"):
+                while True:
+                    data = channel.recv(65536)
+                    if not data:
+                        break
+                    script = script + data
+            if "capeFetch()" in script:
+                returnCode = self.download(node, channel, script)
+            elif "CAPE_STEP" in script:
+                returnCode = self.batch(node, channel, script)
+            else:
+                returnCode = self.single(node, channel, command)
+            channel.send_exit_status(returnCode)
+        except (socket.error, EOFError) as e:
+            logging.debug(node.name + ': Channel lost running ' + command + ': ' + str(e))
+        finally:
+            channel.close()
+        if re.search(r"^sudo reboot\b", command):
+            self.count("reboots")
+            self.reboot(node)
+
+    def single(self, node, channel, command):
+        time.sleep(self.commandTime(command, node))
+        if "ssh_host_" in command:
+            channel.sendall(node.hostKeys)
+        elif "boot_id" in command:
+            channel.sendall(node.bootID + "\n")
+        elif command.startswith("hostname"):
+            channel.sendall(node.name + ".c.cape-bench.internal\n")
+        elif "gp_segment_configuration" in command:
+            channel.sendall(self.segmentRows(node))
+        elif command.startswith("test -f"):
+            return 1
+        return 0
+
+    def batch(self, node, channel, script):
+        for (command, stepName) in BATCH_STEP.findall(script):
+            seconds = self.commandTime(command, node)
+            artifact = ARTIFACT_ID.search(command)
+            if stepName == "send" and artifact:
+                seconds = self.sizes.get(artifact.group(1), 0) / float(INTERNAL_BANDWIDTH) * self.scale
+            time.sleep(seconds)
+            result = {"step": stepName, "rc": 0, "ms": int(seconds * 1000), "log": "/tmp/cape-logs/" + stepName + ".log"}
+            if '"output": ' in script:
+                result["output"] = base64.b64encode(VALIDATE_OUTPUT.get(stepName, ""))
+            if stepName == self.failStep and node.name == self.failNode:
+                # The compiled script stops at the first failed step, its log tail goes to stderr
+                result["rc"] = 1
+                channel.sendall("CAPE_STEP " + json.dumps(result) + "\n")
+                channel.sendall_stderr("simulated failure\n")
+                return 1
+            channel.sendall("CAPE_STEP " + json.dumps(result) + "\n")
+        return 0
+
+    def download(self, node, channel, script):
+        # The transfers share the node's bandwidth, at most `workers` at a time
+        workers = int(DOWNLOAD_WORKERS.search(script).group(1))
+        jobs = DOWNLOAD_JOB.findall(script)
+        lanes = [0.0] * max(1, min(workers, len(jobs)))
+        finished = []
+        for (function, name, url, path, sha256, extract) in jobs:
+            size = self.sizes.get(name, 0)
+            seconds = size / (float(DOWNLOAD_BANDWIDTH) / len(lanes)) * self.scale
+            lane = lanes.index(min(lanes))
+            lanes[lane] += seconds
+            finished.append((lanes[lane], name, size, seconds))
+        start = time.time()
+        for (end, name, size, seconds) in sorted(finished):
+            time.sleep(max(0.0, start + end - time.time()))
+            self.count("downloadBytes", size)
+            channel.sendall("CAPE_DOWNLOAD " + json.dumps({"name": name, "rc": 0, "tries": 1,
+                                                           "ms": int(seconds * 1000), "bytes": size,
+                                                           "verified": "none"}) + "\n")
+        return 0
+
+    def segmentRows(self, node):
+        (master, segmentHosts) = self.clusterSegments(node)
+        rows = "master|" + master + "|p|p|u|s|1\n"
+        for hostname in segmentHosts:
+            rows = rows + "segment|" + hostname + "|p|p|u|s|" + str(self.segmentDBs) + "\n"
+            if self.mirrors:
+                rows = rows + "segment|" + hostname + "|m|m|u|s|" + str(self.segmentDBs) + "\n"
+        return rows
+
+
+def serve(connection, nodes, port, scale, segmentHosts, segmentDBs, mirrors, logPath, failStep=None, failNode=None):
+    # Entry point of the simulator process: sshd for every node plus the fake PivNet.
+    # Reports the PivNet URL once listening, the counters when told to stop.
+    rootLogger = logging.getLogger()
+    for handler in list(rootLogger.handlers):
+        rootLogger.removeHandler(handler)
+    logging.basicConfig(filename=logPath, level=logging.INFO, filemode='w',
+                        format='[%(asctime)s] %(levelname)s %(threadName)s - %(message)s')
+    # Readiness probes hang up mid banner by design
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+    server = FakeSSHServer(nodes, port, scale, segmentHosts, segmentDBs, mirrors, FakePivnet.fileSizes(),
+                           failStep, failNode)
+    server.start()
+    pivnet = FakePivnet.FakePivnetServer()
+    connection.send(pivnet.start())
+    connection.recv()
+    server.stop()
+    pivnet.shutdown()
+    stats = dict(server.stats)
+    stats["pivnetGET"] = pivnet.stats["GET"]
+    stats["pivnetPOST"] = pivnet.stats["POST"]
+    connection.send(stats)
@@ -0,0 +1,207 @@
+import hashlib
+import os
+import threading
+import logging
+
+import BuildBudget
+import BuildJournal
+import DownloadEngine
+import RemoteBatch
+import SSHSessions
+import Trace
+
+# Download once, fan out inside the cluster.
+# Every artifact is cached on the nodes under its PivNet product file id and
+# sha256.  One seed node per artifact fetches it from PivNet (or receives the
+# GPDB_BUILD upload from the controller), then every node holding a copy sends
+# it to one more node over the internal network each round, so external
+# traffic per artifact is constant and the cluster is covered in O(log N)
+# rounds.  A node whose peer transfer fails falls back to a direct download.
+
+CACHE_DIR = "/var/tmp/cape-artifacts"
+
+_buildLock = threading.Lock()
+_buildArtifacts = {}
+
+
+### SHOULD ADD A FLAG TO TELL WHICH HOSTS THE SW GOES ON
+#   0 : CLUSTERWIDE
+#   1 : ACCESS
+#   2 : MASTERS
+#   3 : DATANODES OR SEGMENT DB HOST
+
+def targetNodes(clusterNodes, file):
+    if file["TARGET"] == 2:
+        return [node for node in clusterNodes if "master" in node["role"]]
+    elif file["TARGET"] == 1:
+        return [node for node in clusterNodes if "access" in node["role"]]
+    elif file["TARGET"] == 3:
+        return [node for node in clusterNodes if "worker" in node["role"]]
+    elif file["TARGET"] == 0:
+        return list(clusterNodes)
+    return []
+
+
+def cacheKey(file):
+    if file.get("SHA256"):
+        return str(file["ID"]) + "-" + file["SHA256"]
+    return str(file["ID"]) + "-" + file["NAME"]
+
+
+def cachePath(file):
+    return CACHE_DIR + "/" + cacheKey(file)
+
+
+def linkCommand(file):
+    # Install steps expect the artifact under /tmp with its PivNet name
+    return "sudo ln -f " + cachePath(file) + " /tmp/" + file["NAME"] + " 2>/dev/null || " \
+           "sudo cp " + cachePath(file) + " /tmp/" + file["NAME"]
+
+
+def buildArtifact():
+    # The pre-release build is uploaded from the controller once and fanned out like a download.
+    # Hashed once per process, however many clusters are being built from it
+    buildPath = str(os.environ["GPDB_BUILD"])
+    buildStat = os.stat(buildPath)
+    buildKey = (buildPath, buildStat.st_size, buildStat.st_mtime)
+    with _buildLock:
+        if buildKey not in _buildArtifacts:
+            sha = hashlib.sha256()
+            with open(buildPath, "rb") as buildFile:
+                for chunk in iter(lambda: buildFile.read(1024 * 1024), b""):
+                    sha.update(chunk)
+            _buildArtifacts[buildKey] = {"ID": "build", "SHA256": sha.hexdigest(), "NAME": os.path.basename(buildPath),
+                                         "TARGET": 0, "LOCAL": buildPath}
+        return dict(_buildArtifacts[buildKey])
+
+
+def distributeArtifacts(clusterDictionary, downloads):
+    logging.info('distributeArtifacts Started')
+    # The same file can be listed more than once, distribute each cache key once
+    artifacts = []
+    for file in downloads:
+        if cacheKey(file) not in [cacheKey(artifact) for artifact in artifacts]:
+            artifacts.append(file)
+    if os.environ.get("GPDB_BUILD"):
+        logging.info('Pre-release GPDB build detected')
+        artifacts.append(buildArtifact())
+
+    results = {}
+    threads = []
+    for index, file in enumerate(artifacts):
+        nodes = targetNodes(clusterDictionary["clusterNodes"], file)
+        if not nodes:
+            continue
+        if BuildJournal.done(clusterDictionary["clusterName"], "artifact " + cacheKey(file)):
+            logging.info('Skipping ' + file["NAME"] + ', already distributed')
+            continue
+        # Rotate the seed so one node does not fetch every artifact
+        seedIndex = index % len(nodes)
+        nodes = nodes[seedIndex:] + nodes[:seedIndex]
+        artifactThread = threading.Thread(target=distributeArtifact, args=(file, nodes, results))
+        threads.append(artifactThread)
+        artifactThread.start()
+    for x in threads:
+        x.join()
+
+    for file in artifacts:
+        if results.get(file["NAME"]):
+            BuildJournal.record(clusterDictionary["clusterName"], "artifact " + cacheKey(file))
+    failed = sorted([name for name, ok in results.items() if not ok])
+    if failed:
+        print clusterDictionary["clusterName"] + ": Artifacts failed to distribute: " + ",".join(failed)
+        logging.error('Artifacts failed to distribute: ' + ",".join(failed))
+        exit()
+    logging.info('distributeArtifacts Completed')
+
+
+def distributeArtifact(file, nodes, results):
+    logging.debug('Distributing ' + file["NAME"] + ' to ' + str(len(nodes)) + ' Nodes as ' + cacheKey(file))
+    seed = nodes[0]
+    if not BuildBudget.run(seedArtifact, seed, file):
+        results[file["NAME"]] = False
+        return
+    holders = [seed]
+    pending = nodes[1:]
+    fallback = []
+    rounds = 0
+    while pending:
+        rounds += 1
+        receivers = pending[:len(holders)]
+        pending = pending[len(holders):]
+        received = {}
+        threads = []
+        for (sender, receiver) in zip(holders, receivers):
+            sendThread = threading.Thread(target=BuildBudget.run, args=(sendArtifact, sender, receiver, file, received))
+            threads.append(sendThread)
+            sendThread.start()
+        for x in threads:
+            x.join()
+        for receiver in receivers:
+            if received.get(receiver["nodeName"]):
+                holders.append(receiver)
+            else:
+                fallback.append(receiver)
+    logging.debug(file["NAME"] + ': Fanned out in ' + str(rounds) + ' rounds')
+
+    ok = True
+    for node in fallback:
+        logging.info(node["nodeName"] + ': Peer transfer of ' + file["NAME"] + ' failed, downloading directly')
+        ok = BuildBudget.run(seedArtifact, node, file) and ok
+    results[file["NAME"]] = ok
+
+
+def seedArtifact(node, file):
+    logging.debug(node["nodeName"] + ': Seeding ' + file["NAME"])
+    try:
+        steps = [("cacheDir", "sudo mkdir -p " + CACHE_DIR)]
+        if "LOCAL" in file:
+            with SSHSessions.borrow(node) as ssh:
+                (stdin, stdout, stderr) = ssh.exec_command("test -f " + cachePath(file))
+                cached = stdout.channel.recv_exit_status() == 0
+                if not cached:
+                    logging.debug('Uploading File: ' + file["LOCAL"])
+                    sftp = ssh.open_sftp()
+                    Trace.put(sftp, node, file["LOCAL"], "/tmp/" + file["NAME"] + ".part")
+                    sftp.close()
+                    steps.append(("store", "sudo mv /tmp/" + file["NAME"] + ".part " + cachePath(file)))
+            if file.get("SHA256"):
+                steps.append(("verify", "echo '" + file["SHA256"] + "  " + cachePath(file) + "' | sha256sum -c - || " +
+                              "(sudo rm -f " + cachePath(file) + "; exit 1)"))
+        else:
+            # Resumes a partial copy, a complete cached copy costs one request
+            RemoteBatch.runSteps(node, steps)
+            steps = []
+            DownloadEngine.fetchFiles(node, [{"NAME": file["NAME"], "URL": file["URL"], "SHA256": file.get("SHA256"),
+                                              "PATH": cachePath(file)}], sudo=True)
+        steps.append(("link", linkCommand(file)))
+        RemoteBatch.runSteps(node, steps)
+        return True
+    except Exception as e:
+        logging.debug(node["nodeName"] + ': Seeding ' + file["NAME"] + ' Failed: ' + str(e))
+        return False
+
+
+def sendArtifact(sender, receiver, file, received):
+    # Root keys and known_hosts come from the key exchange, the copy stays on the internal network.
+    # The copy is checked like a seeded one before it enters the cache: against its sha256, or
+    # against the sender's size when PivNet gave none.  A short or corrupt .part is removed.
+    part = cachePath(file) + ".part"
+    if file.get("SHA256"):
+        check = "sha256sum " + part + " | grep -q ^" + file["SHA256"]
+    else:
+        check = "[ $(stat -c %s " + part + ") -eq '$CAPE_SIZE' ]"
+    remote = "mkdir -p " + CACHE_DIR + " && { { cat > " + part + " && " + check + " && mv " + part + " " + \
+             cachePath(file) + "; } || { rm -f " + part + "; exit 1; }; } && (" + \
+             linkCommand(file).replace("sudo ", "") + ")"
+    try:
+        RemoteBatch.runSteps(sender, [
+            ("send", "set -o pipefail && CAPE_SIZE=$(sudo stat -c %s " + cachePath(file) + ") && sudo cat " +
+             cachePath(file) + " | sudo ssh -o BatchMode=yes root@" + receiver["internalIP"] + " '" + remote + "'"),
+        ])
+        received[receiver["nodeName"]] = True
+        logging.debug(sender["nodeName"] + ': Sent ' + file["NAME"] + ' to ' + receiver["nodeName"])
+    except Exception as e:
+        logging.debug(sender["nodeName"] + ': Sending ' + file["NAME"] + ' to ' + receiver["nodeName"] +
+                      ' Failed: ' + str(e))
+        received[receiver["nodeName"]] = False
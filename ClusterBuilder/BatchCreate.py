@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+import traceback
+import logging
+
+import ClusterBuilder
+import ClusterValidate
+import InstallGPDB
+import SoftwareDownload
+import Trace
+
+# Several clusters from one cape process.
+# `cape create --count K` builds <name>-01 .. <name>-K at the same time, one
+# controller thread per cluster.  The builds share the GCE login (GCEDriver),
+# the PivNet release metadata (PivnetCache), the hashed GPDB_BUILD
+# (ArtifactCache) and one BUILD_BUDGET of concurrent work (BuildBudget).
+# Nothing in the build path changes the working directory or the
+# environment, so the builds only meet in those shared pieces.
+
+
+def batchNames(baseName, count):
+    width = max(2, len(str(count)))
+    return [baseName + "-" + str(clusterNum).zfill(width) for clusterNum in range(1, count + 1)]
+
+
+def buildCluster(clusterDictionary, clusterType):
+    # The create flow of one cluster, single creates and batch members alike
+    if clusterType == "vanilla":
+        logging.info("Creating a base Cluster:" + clusterDictionary["clusterName"])
+        with Trace.span("buildServers"):
+            ClusterBuilder.buildServers(clusterDictionary)
+    elif clusterType == "gpdb":
+        print clusterDictionary["clusterName"] + ": Creating a Greenplum Database Cluster"
+        logging.info("Creating a Greenplum Database Cluster:" + clusterDictionary["clusterName"])
+        with Trace.span("buildServers"):
+            ClusterBuilder.buildServers(clusterDictionary)
+        with Trace.span("downloadSoftware"):
+            downloads = SoftwareDownload.downloadSoftware(clusterDictionary)
+        with Trace.span("installGPDB"):
+            InstallGPDB.installGPDB(clusterDictionary, downloads)
+    elif clusterType == "hdb":
+        print "HDB Builder"
+        with Trace.span("buildServers"):
+            ClusterBuilder.buildServers(clusterDictionary)
+        with Trace.span("downloadSoftware"):
+            SoftwareDownload.downloadSoftware(clusterDictionary)
+    if os.environ.get("VALIDATE", "no") == "yes":
+        with Trace.span("validateCluster"):
+            ClusterValidate.gate(clusterDictionary)
+
+
+def buildClusters(clusterDictionaries, clusterType):
+    # Returns {clusterName: error} for every cluster that did not build
+    failures = {}
+
+    def build(clusterDictionary):
+        clusterName = clusterDictionary["clusterName"]
+        Trace.setController(clusterName)
+        buildStart = time.time()
+        try:
+            buildCluster(clusterDictionary, clusterType)
+        except SystemExit as e:
+            # The build steps still sys.exit() on failure, it only ends this cluster's thread
+            failures[clusterName] = str(e).strip() or "exit"
+        except Exception as e:
+            logging.debug(traceback.format_exc())
+            failures[clusterName] = str(e)
+        logging.info(clusterName + ': Build ended after ' + str(round(time.time() - buildStart, 1)) + 's')
+
+    print "Building " + str(len(clusterDictionaries)) + " Clusters: " + \
+        ",".join([clusterDictionary["clusterName"] for clusterDictionary in clusterDictionaries])
+    threads = []
+    for clusterDictionary in clusterDictionaries:
+        buildThread = threading.Thread(target=build, args=(clusterDictionary,), name=clusterDictionary["clusterName"])
+        threads.append(buildThread)
+        buildThread.start()
+    for x in threads:
+        x.join()
+
+    for clusterDictionary in clusterDictionaries:
+        clusterName = clusterDictionary["clusterName"]
+        if clusterName in failures:
+            print "\t" + clusterName + ": FAILED (" + failures[clusterName] + ")"
+        else:
+            print "\t" + clusterName + ": Built"
+    print str(len(clusterDictionaries) - len(failures)) + " of " + str(len(clusterDictionaries)) + " Clusters Built"
+    return failures
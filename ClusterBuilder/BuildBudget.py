@@ -0,0 +1,46 @@
+import os
+import threading
+import logging
+from contextlib import contextmanager
+
+# Process wide concurrency budget.
+# `cape create --count` runs several cluster builds in one process, and each
+# build's per node threads and GCE worker pools would multiply with the
+# number of clusters.  Every unit of leaf work (one GCE call, one node's SSH
+# step) takes a slot from a single semaphore of BUILD_BUDGET slots first.
+# Slots are never taken while holding another, so nested pools cannot
+# deadlock on the budget.
+
+DEFAULT_BUDGET = 64
+
+_lock = threading.Lock()
+_semaphore = [None]
+
+
+def budget():
+    return int(os.environ.get("BUILD_BUDGET", DEFAULT_BUDGET))
+
+
+def _slots():
+    # Created on first use, config.env is loaded after import
+    with _lock:
+        if _semaphore[0] is None:
+            logging.debug('Build budget: ' + str(budget()) + ' slots')
+            _semaphore[0] = threading.BoundedSemaphore(budget())
+        return _semaphore[0]
+
+
+@contextmanager
+def slot():
+    slots = _slots()
+    slots.acquire()
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+def run(function, *args):
+    # Thread target wrapper: function(*args) inside one slot
+    with slot():
+        return function(*args)
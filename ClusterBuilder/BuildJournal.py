@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+import logging
+
+# Build journal for resumable creates.
+# Every completed build step is appended (and fsynced) to
+# clusterConfigs/<name>/journal.jsonl as one JSON line, per node for node
+# steps and with node null for cluster wide ones.  A fresh create truncates
+# it; `cape create --resume` reloads it and skips whatever is already there,
+# so a failure late in the build only costs the steps that did not finish.
+
+_lock = threading.Lock()
+_entries = {}
+_resuming = set()
+
+
+def journalPath(clusterName):
+    return str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterName + "/journal.jsonl"
+
+
+def _load(clusterName):
+    # Caller holds _lock
+    if clusterName in _entries:
+        return _entries[clusterName]
+    entries = {}
+    path = journalPath(clusterName)
+    if os.path.isfile(path):
+        with open(path, "r") as journalFile:
+            for line in journalFile:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid write
+                    logging.debug(clusterName + ': Ignoring journal line: ' + line.strip())
+                    continue
+                entries[(entry["node"], entry["step"])] = entry
+    _entries[clusterName] = entries
+    return entries
+
+
+def start(clusterName, resume=False):
+    with _lock:
+        _entries.pop(clusterName, None)
+        if resume:
+            _resuming.add(clusterName)
+            entries = _load(clusterName)
+        else:
+            _resuming.discard(clusterName)
+            path = journalPath(clusterName)
+            if os.path.isfile(path):
+                os.remove(path)
+            entries = _load(clusterName)
+    logging.info(clusterName + ': Journal started, ' + str(len(entries)) + ' completed steps recorded')
+    return len(entries)
+
+
+def resuming(clusterName):
+    return clusterName in _resuming
+
+
+def done(clusterName, step, nodeName=None):
+    with _lock:
+        return (nodeName, step) in _load(clusterName)
+
+
+def record(clusterName, step, nodeName=None):
+    entry = {"node": nodeName, "step": step, "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    path = journalPath(clusterName)
+    with _lock:
+        _load(clusterName)[(nodeName, step)] = entry
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "a") as journalFile:
+            journalFile.write(json.dumps(entry) + "\n")
+            journalFile.flush()
+            os.fsync(journalFile.fileno())
+
+
+def once(clusterName, step, function, *args):
+    # Runs a cluster wide step unless the journal already has it
+    if done(clusterName, step):
+        print clusterName + ": " + step + " Already Done, Skipping"
+        logging.info(clusterName + ': Skipping ' + step + ', journaled')
+        return None
+    result = function(*args)
+    record(clusterName, step)
+    return result
+
+
+def pending(clusterName, step, clusterNodes):
+    return [clusterNode for clusterNode in clusterNodes if not done(clusterName, step, clusterNode["nodeName"])]
@@ -4,13 +4,25 @@ import threading
 import time
 import warnings
 import traceback
-import paramiko
 import logging
 import json
-from libcloud.compute.providers import get_driver
-from libcloud.compute.types import Provider
-from paramiko import WarningPolicy
-from paramiko import AutoAddPolicy
+from multiprocessing.pool import ThreadPool
+from libcloud.compute.base import Node
+
+import BuildBudget
+import BuildJournal
+import ClusterInventory
+import ClusterLabels
+import ClusterValidate
+import DiskBench
+import GCEDriver
+import ImageBaker
+import KeyExchange
+import NodeReadiness
+import RemoteOutput
+import SegmentLayout
+import SSHSessions
+import Trace
 
 
 def buildServers(clusterDictionary):
@@ -37,10 +49,12 @@ def buildServers(clusterDictionary):
             print "Testing Mode"
             timestamp = str(time.time()).split('.')[0]
             clusterDictionary["clusterName"] = clusterDictionary["clusterName"] + timestamp
-            os.makedirs("./clusterConfigs/" + clusterDictionary["clusterName"])
+            os.makedirs(str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterDictionary["clusterName"])
         else:
             print "Cluster Name already exists."
             logging.error("Cluster Name already exists. Exiting!")
+    clusterName = clusterDictionary["clusterName"]
+    resume = BuildJournal.resuming(clusterName)
     try:
         clusterPath = str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterDictionary["clusterName"]
         logging.debug("ClusterPath: " + str(clusterPath))
@@ -56,8 +70,7 @@ def buildServers(clusterDictionary):
         logging.debug('DISK_TYPE: ' + str(os.environ["DISK_TYPE"]))
         logging.debug('SERVER_TYPE: ' + str(os.environ["SERVER_TYPE"]))
 
-        ComputeEngine = get_driver(Provider.GCE)
-        driver = ComputeEngine(os.environ["SVC_ACCOUNT"], str(os.environ["CONFIGS_PATH"]) + str(os.environ["SVC_ACCOUNT_KEY"]), project=str(os.environ["PROJECT"]), datacenter=str(os.environ["ZONE"]))
+        driver = GCEDriver.newDriver()
         gce_disk_struct = [
             {
                 "kind": "compute#attachedDisk",
@@ -65,8 +78,9 @@ def buildServers(clusterDictionary):
                 "autoDelete": True,
 
                 'initializeParams': {
-                    "sourceImage": "/projects/centos-cloud/global/images/" + str(os.environ["IMAGE"]),
+                    "sourceImage": ImageBaker.sourceImage(),
                     "diskSizeGb": 100,
+                    "labels": ClusterLabels.labels(clusterName),
                     "diskStorageType": str(os.environ["DISK_TYPE"]),
                     "diskType": "/compute/v1/projects/" + str(os.environ["PROJECT"]) + "/zones/" + str(
                         os.environ["ZONE"]) + "/diskTypes/" + str(os.environ["DISK_TYPE"])
@@ -74,66 +88,132 @@ def buildServers(clusterDictionary):
             }
 
         ]
+        if os.environ.get("DATA_DISKS_AT_CREATE", "no") == "yes":
+            # Declare the data disks with the instance so they come up in one operation
+            logging.info('Creating ' + str(os.environ["DISK_QTY"]) + ' data disks with each node')
+            for diskNum in range(1, int(os.environ["DISK_QTY"]) + 1):
+                gce_disk_struct.append({
+                    "kind": "compute#attachedDisk",
+                    "boot": False,
+                    "autoDelete": True,
+                    "type": "PERSISTENT",
+                    'initializeParams': {
+                        "diskSizeGb": int(os.environ["DISK_SIZE"]),
+                        "labels": ClusterLabels.labels(clusterName),
+                        "diskType": "/compute/v1/projects/" + str(os.environ["PROJECT"]) + "/zones/" + str(
+                            os.environ["ZONE"]) + "/diskTypes/pd-standard"
+                    },
+                })
         sa_scopes = [{'scopes': ['compute', 'storage-full']}]
-        print clusterDictionary["clusterName"] + ": Creating " + str(clusterDictionary["nodeQty"]) + " Nodes"
-        nodes = driver.ex_create_multiple_nodes(base_name=clusterDictionary["clusterName"],
-                                                size=str(os.environ["SERVER_TYPE"]), image=None,
-                                                number=int(clusterDictionary["nodeQty"]),
-                                                location=str(os.environ["ZONE"]),
-                                                ex_network='default', ex_tags=None, ex_metadata=None, ignore_errors=True,
-                                                use_existing_disk=False, poll_interval=2, external_ip='ephemeral',
-                                                ex_service_accounts=sa_scopes, timeout=180, description=None,
-                                                ex_can_ip_forward=None, ex_disks_gce_struct=gce_disk_struct,
-                                                ex_nic_gce_struct=None, ex_on_host_maintenance=None,
-                                                ex_automatic_restart=None)
-
+        nodeNames = [clusterName + "-" + str(nodeCnt).zfill(3) for nodeCnt in range(int(clusterDictionary["nodeQty"]))]
+        if BuildJournal.done(clusterName, "createNodes"):
+            print clusterName + ": Nodes Already Created, Verifying"
+            nodes = fetchNodes(nodeNames)
+        else:
+            print clusterDictionary["clusterName"] + ": Creating " + str(clusterDictionary["nodeQty"]) + " Nodes"
+            createStart = time.time()
+            nodes = driver.ex_create_multiple_nodes(base_name=clusterDictionary["clusterName"],
+                                                    size=str(os.environ["SERVER_TYPE"]), image=None,
+                                                    number=int(clusterDictionary["nodeQty"]),
+                                                    location=str(os.environ["ZONE"]),
+                                                    ex_network='default', ex_tags=None, ex_metadata=None, ignore_errors=True,
+                                                    use_existing_disk=False, poll_interval=2, external_ip='ephemeral',
+                                                    ex_service_accounts=sa_scopes, timeout=180, description=None,
+                                                    ex_can_ip_forward=None, ex_disks_gce_struct=gce_disk_struct,
+                                                    ex_nic_gce_struct=None, ex_on_host_maintenance=None,
+                                                    ex_automatic_restart=None)
+            Trace.record("createNodes", "phase", createStart, time.time() - createStart)
+            # ignore_errors hands back a GCEFailedNode for every insert that failed, quota errors included
+            failedNodes = [node for node in nodes if not isinstance(node, Node)]
+            for failedNode in failedNodes:
+                print clusterName + ": " + str(getattr(failedNode, "name", "")) + " Create Failed: " + \
+                    str(getattr(failedNode, "error", failedNode))
+                logging.error(str(getattr(failedNode, "name", "")) + ' create failed: ' +
+                              str(getattr(failedNode, "error", failedNode)))
+            nodes = [node for node in nodes if isinstance(node, Node)]
+            if resume:
+                # An interrupted create leaves instances behind that now fail to insert
+                createdNames = [node.name for node in nodes]
+                nodes = nodes + fetchNodes([name for name in nodeNames if name not in createdNames])
+            BuildJournal.record(clusterName, "createNodes")
+        # Disks get the cluster label at create, instances only once they exist
+        with Trace.span("labelNodes"):
+            BuildJournal.once(clusterName, "labelNodes", ClusterLabels.labelResources,
+                              clusterName, "instances", nodeNames)
         print clusterDictionary["clusterName"] + ": Cluster Nodes Created in Google Cloud"
         logging.info(clusterDictionary["clusterName"] + ": Cluster Nodes Created in Google Cloud")
         print clusterDictionary["clusterName"] + ": Cluster Configuration Started"
         logging.info(clusterDictionary["clusterName"] + ": Cluster Configuration Started")
 
-        threads = []
-        buildFSTAB(clusterDictionary, int(os.environ["DISK_QTY"]))
-        for nodeCnt in range(int(clusterDictionary["nodeQty"])):
-            nodeName = clusterDictionary["clusterName"] + "-" + str(nodeCnt).zfill(3)
-            clusterNode = {}
-
-        #### THIS SECTION CAN BE MODIFIED TO TAKE A VARIABLE AND MOUNT MULTIPLE DISKS INSTEAD OF 1
-        ####  MOUNTS SHOULD GO UNDER /DATA AND BE DATA1,DATA2,DATAN
-        ####  THIS MEANS THE 1 DISK USE CASE SHOULD BE MOUNTED THE SAME WAY.
-            for diskNum in range(1,int(os.environ["DISK_QTY"])+1):
-                volume = driver.create_volume(os.environ["DISK_SIZE"], nodeName + "-data-disk-"+str(diskNum), None, None,
-                                              None, False, "pd-standard")
-
-                clusterNode["nodeName"] = nodeName
-                clusterNode["dataVolume"] = str(volume)
-
-                node = driver.ex_get_node(nodeName)
-                driver.attach_volume(node, volume, device=None, ex_mode=None, ex_boot=False, ex_type=None, ex_source=None,
-                                     ex_auto_delete=True, ex_initialize_params=None, ex_licenses=None, ex_interface=None)
+        nodesByName = {}
+        for node in nodes:
+            nodesByName[node.name] = node
+        # On resume the inventory already knows roles, volumes and FQDNs, IPs are refreshed
+        knownNodes = dict([(clusterNode["nodeName"], clusterNode) for clusterNode in clusterDictionary.get("clusterNodes", [])])
+        clusterDictionary["masterCount"] = 0
+        clusterDictionary["accessCount"] = 0
+        clusterDictionary["segmentCount"] = 0
+        for nodeCnt, nodeName in enumerate(nodeNames):
+            clusterNode = knownNodes.get(nodeName, {})
+            node = nodesByName[nodeName]
+            clusterNode["nodeName"] = nodeName
+            clusterNode["nodeId"] = node.id
             clusterNode["externalIP"] = str(node).split(",")[3].split("'")[1]
             clusterNode["internalIP"] = str(node).split(",")[4].split("'")[1]
+            setRole(clusterDictionary, clusterNode, nodeCnt)
             print "     " + nodeName + ": External IP: " + clusterNode["externalIP"]
             print "     " + nodeName + ": Internal IP: " + clusterNode["internalIP"]
             if is_master(nodeName):
                 with open('/tmp/gpdb-master-host-ip.txt', 'w') as fh:
                     fh.write(clusterNode["externalIP"])
             logging.debug('Created Node: ' + str(clusterNode))
-
-            prepThread = threading.Thread(target=prepServer, args=(clusterDictionary,clusterNode, nodeCnt))
             clusterNodes.append(clusterNode)
+        clusterDictionary["clusterNodes"] = clusterNodes
+        ClusterInventory.save(clusterDictionary, "created")
+
+        if not BuildJournal.done(clusterName, "volumes"):
+            with Trace.span("volumes"):
+                if os.environ.get("DATA_DISKS_AT_CREATE", "no") == "yes":
+                    volumesByNode = attachedVolumes(nodes)
+                else:
+                    volumesByNode = provisionVolumes(nodes, int(os.environ["DISK_QTY"]), clusterName, resume)
+            for clusterNode in clusterNodes:
+                clusterNode["dataVolumes"] = volumesByNode.get(clusterNode["nodeName"], [])
+            ClusterInventory.save(clusterDictionary, "volumes")
+            BuildJournal.record(clusterName, "volumes")
+
+        threads = []
+        prepStart = time.time()
+        DiskBench.resolveRaid(clusterDictionary)
+        buildFSTAB(clusterDictionary, int(os.environ["DISK_QTY"]))
+        for clusterNode in BuildJournal.pending(clusterName, "prepServer", clusterNodes):
+            prepThread = threading.Thread(target=prepServer, args=(clusterDictionary, clusterNode))
             threads.append(prepThread)
             prepThread.start()
         for x in threads:
             x.join()
+        notPrepared = BuildJournal.pending(clusterName, "prepServer", clusterNodes)
+        if notPrepared:
+            raise Exception("prepServer failed on " + ",".join([clusterNode["nodeName"] for clusterNode in notPrepared]))
+        Trace.record("prepServer", "phase", prepStart, time.time() - prepStart)
         print clusterDictionary["clusterName"] + ": Cluster Configuration Complete"
         logging.info(clusterDictionary["clusterName"] + ": Cluster Configuration Complete")
-        clusterDictionary["clusterNodes"] = clusterNodes
         logging.debug('ClusterNodes: ' + json.dumps(clusterDictionary["clusterNodes"]))
+        ClusterInventory.save(clusterDictionary, "prepared")
+        with Trace.span("waitForCluster"):
+            readyTimes = NodeReadiness.waitForCluster(clusterDictionary["clusterName"], clusterNodes, "gpadmin")
+        if not NodeReadiness.allReady(readyTimes):
+            raise Exception("Nodes did not come back after reboot")
         getNodeFQDN(clusterDictionary)
         logging.debug(json.dumps(clusterDictionary))
-        hostsFiles(clusterDictionary)
-        keyShare(clusterDictionary)
+        with Trace.span("hostsFiles"):
+            BuildJournal.once(clusterName, "hostsFiles", hostsFiles, clusterDictionary)
+        with Trace.span("keyShare"):
+            if os.environ.get("KEY_SHARE", "controller") == "legacy":
+                BuildJournal.once(clusterName, "keyShare", keyShare, clusterDictionary)
+            else:
+                BuildJournal.once(clusterName, "keyShare", KeyExchange.distributeKeys, clusterDictionary)
+        ClusterInventory.save(clusterDictionary, "built")
         logging.debug('buildServers Completed')
     except Exception as e:
         logging.debug('Exception: ' + str(e.__class__))
@@ -145,8 +225,82 @@ def buildServers(clusterDictionary):
         logging.debug(traceback.print_exc())
         logging.debug('Failed')
         print "Failing Process"
+        print "Fix the cause and continue with: cape create --resume --name " + clusterName + " --type <type>"
         sys.exit('\n\nBuildServers Failed')
 
+def fetchNodes(nodeNames):
+    # One GET per node, fails if any of them is gone
+    if not nodeNames:
+        return []
+    pool = ThreadPool(min(16, len(nodeNames)))
+    try:
+        return pool.map(lambda nodeName: BuildBudget.run(GCEDriver.threadDriver().ex_get_node, nodeName,
+                                                         str(os.environ["ZONE"])), nodeNames)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def provisionVolumes(nodes, diskCNT, clusterName, useExisting=False):
+    # Data disks are created by a bounded pool of workers. Attaches to one node
+    # stay serial because GCE rejects concurrent operations on an instance.
+    logging.debug('provisionVolumes Started for ' + str(len(nodes)) + ' Nodes with ' + str(diskCNT) + ' Drives')
+    volumesByNode = {}
+    if diskCNT < 1:
+        return volumesByNode
+    volumeRequests = []
+    for node in nodes:
+        for diskNum in range(1, diskCNT + 1):
+            volumeRequests.append(node.name + "-data-disk-" + str(diskNum))
+    workers = min(int(os.environ.get("VOLUME_WORKERS", 16)), len(volumeRequests))
+    pool = ThreadPool(workers)
+    try:
+        volumes = pool.map(lambda volumeName: BuildBudget.run(createVolume, volumeName, clusterName, useExisting),
+                           volumeRequests)
+        for node in nodes:
+            volumesByNode[node.name] = [volume for volume in volumes if volume.name.startswith(node.name + "-data-disk-")]
+        pool.map(lambda nodeVolumes: BuildBudget.run(attachVolumes, nodeVolumes),
+                 [(node, volumesByNode[node.name]) for node in nodes])
+    finally:
+        pool.close()
+        pool.join()
+    for nodeName in volumesByNode:
+        volumesByNode[nodeName] = [volume.name for volume in volumesByNode[nodeName]]
+    logging.debug('provisionVolumes Completed')
+    return volumesByNode
+
+
+def createVolume(volumeName, clusterName, useExisting=False):
+    driver = GCEDriver.threadDriver()
+    volume = driver.create_volume(os.environ["DISK_SIZE"], volumeName, None, None,
+                                  None, useExisting, "pd-standard")
+    ClusterLabels.setLabels(driver, "disks", volumeName, clusterName)
+    logging.debug('Created Volume: ' + str(volume))
+    return volume
+
+
+def attachVolumes(nodeVolumes):
+    (node, volumes) = nodeVolumes
+    driver = GCEDriver.threadDriver()
+    attached = [disk.get("source", "").split("/")[-1] for disk in node.extra.get("disks", [])]
+    for volume in volumes:
+        if volume.name in attached:
+            logging.debug('Volume already attached: ' + volume.name + ' to ' + node.name)
+            continue
+        driver.attach_volume(node, volume, device=None, ex_mode=None, ex_boot=False, ex_type=None, ex_source=None,
+                             ex_auto_delete=True, ex_initialize_params=None, ex_licenses=None, ex_interface=None)
+        logging.debug('Attached Volume: ' + volume.name + ' to ' + node.name)
+
+
+def attachedVolumes(nodes):
+    # Names of the non boot disks GCE created along with each node
+    volumesByNode = {}
+    for node in nodes:
+        volumesByNode[node.name] = [disk["source"].split("/")[-1] for disk in node.extra.get("disks", [])
+                                    if not disk.get("boot")]
+    return volumesByNode
+
+
 def is_master(nodeName):
     return nodeName.endswith('-000')
 
@@ -154,41 +308,26 @@ def is_master(nodeName):
 def buildFSTAB(clusterDictionary,diskCNT):
     logging.debug('buildFSTAB Started with ' + str(diskCNT) + ' Drives')
     clusterPath = str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterDictionary["clusterName"]
-    currentPath = os.getcwd()
-    logging.debug('Current Dir: ' + currentPath)
-    os.chdir(clusterPath)
-    logging.debug('Changed Dir to: ' + clusterPath)
-    with open("fstab.cape", "w") as fstabFile:
+    with open(clusterPath + "/fstab.cape", "w") as fstabFile:
         fstabFile.write("######  CAPE ENTRIES #######\n")
         fstabFile.write("/swapfile    swap     swap    defaults     0 0\n")
-        if os.environ["RAID0"] == "no":
-            logging.info('Configuring with no RAID as RAID0=' + str(os.environ["RAID0"]))
+        if clusterDictionary["raid0"] == "no":
+            logging.info('Configuring with no RAID as RAID0=' + str(clusterDictionary["raid0"]))
             for disk in range(1,diskCNT+1):
                 fstabFile.write("LABEL=data"+str(disk)+ "   /data/disk"+str(disk) + "   xfs rw,noatime,nodiratime,nobarrier,inode64,allocsize=16m 0 0\n")
         else:
-            logging.info('Configuring with RAID0 as RAID0=' + str(os.environ["RAID0"]))
-            if diskCNT < 8:
-                logging.debug('Creating fstab for 1 volume')
-                fstabFile.write("/dev/md1" + " /data1" + "   xfs rw,noatime,nodiratime,nobarrier,inode64,allocsize=16m 0 0\n")
-            else:
-                logging.debug('Creating fstab for 2 volumes')
-                fstabFile.write("/dev/md1" + " /data1" + "   xfs rw,noatime,nodiratime,nobarrier,inode64,allocsize=16m 0 0\n")
-                fstabFile.write("/dev/md2" + " /data2" + "   xfs rw,noatime,nodiratime,nobarrier,inode64,allocsize=16m 0 0\n")
+            logging.info('Configuring with RAID0 as RAID0=' + str(clusterDictionary["raid0"]))
+            volumeQty = SegmentLayout.raidVolumes(diskCNT)
+            logging.debug('Creating fstab for ' + str(volumeQty) + ' volumes')
+            for volume in range(1, volumeQty + 1):
+                fstabFile.write("/dev/md" + str(volume) + " /data" + str(volume) + "   xfs rw,noatime,nodiratime,nobarrier,inode64,allocsize=16m 0 0\n")
     logging.info('Wrote fstab file')
-    os.chdir(currentPath)
-    logging.debug('Changed Dir to: ' + currentPath)
     logging.debug('buildFSTAB Completed')
 
 
 
 
-def prepServer(clusterDictionary,clusterNode, nodeCnt):
-    logging.debug('prepServer Started on '+clusterNode["nodeName"])
-    warnings.simplefilter("ignore")
-    logging.debug('SimpleFilter for Warnings: ignore')
-    paramiko.util.log_to_file("/tmp/paramiko.log")
-    nodeName = clusterNode["nodeName"]
-
+def setRole(clusterDictionary, clusterNode, nodeCnt):
     # Set Server Role
     if os.environ["STANDBY"] == "yes" and os.environ["ACCESS"] == "yes":
         logging.debug('STANDBY and ACCESS are yes')
@@ -214,62 +353,107 @@ def prepServer(clusterDictionary,clusterNode, nodeCnt):
             clusterDictionary["segmentCount"] += 1
     logging.debug('Role set')
 
+
+def prepServer(clusterDictionary, clusterNode):
+    logging.debug('prepServer Started on '+clusterNode["nodeName"])
+    warnings.simplefilter("ignore")
+    logging.debug('SimpleFilter for Warnings: ignore')
+    nodeName = clusterNode["nodeName"]
+
+    # Wait until the node takes key auth and sudo instead of burning handshakes
+    with Trace.span("waitForNode", "step", nodeName):
+        readyTime = NodeReadiness.waitForNode(clusterNode)
+    if readyTime is None:
+        print "     " + nodeName + ": Not Reachable, CLUSTER CREATION FAILED"
+        exit()
+
+    # Only the SSH work holds a build budget slot, the readiness and reboot waits do not
+    oldBootID = BuildBudget.run(runPrepareHost, clusterDictionary, clusterNode)
+
+    # Nothing from here on runs prepareHost.sh again.  Later logins must start fresh
+    # sessions to pick up limits.conf, and the reboot kills the transport anyway
+    SSHSessions.invalidate(clusterNode)
+    if oldBootID is not None:
+        with Trace.span("reboot", "step", nodeName):
+            rebootTime = NodeReadiness.waitForReboot(clusterNode, oldBootID)
+        if rebootTime is None:
+            print "     " + nodeName + ": Did Not Come Back After Reboot, CLUSTER CREATION FAILED"
+            exit()
+    BuildJournal.record(clusterDictionary["clusterName"], "prepServer", nodeName)
+    return
+
+
+def runPrepareHost(clusterDictionary, clusterNode):
+    # Uploads and runs prepareHost.sh, returns the boot id before the reboot it issued, None without one
+    nodeName = clusterNode["nodeName"]
+    capeHome = str(os.environ["CAPE_HOME"])
     connected = False
     attemptCount = 0
+    oldBootID = None
     while not connected:
         try:
-            logging.debug('Current Dir: ' + str(os.getcwd()))
             attemptCount += 1
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + clusterNode["nodeName"])
             logging.debug('SSH IP: ' + clusterNode["externalIP"] + ' User: ' +
                           os.environ["SSH_USERNAME"] + ' Key: ' +
                           str(os.environ["CONFIGS_PATH"]) +
                           str(os.environ["SSH_KEY"]))
-            ssh.connect(clusterNode["externalIP"], 22, os.environ["SSH_USERNAME"], None, pkey=None,
-                        key_filename=(str(os.environ["CONFIGS_PATH"]) + str(os.environ["SSH_KEY"])), timeout=120)
-            sftp = ssh.open_sftp()
-            sftp.put('./templates/sysctl.conf.cape', '/tmp/sysctl.conf.cape', confirm=True)
-            logging.debug('Put: ./templates/sysctl.conf.cape')
-            sftp.put('./clusterConfigs/' + clusterDictionary["clusterName"]+ '/fstab.cape', '/tmp/fstab.cape', confirm=True)
-            logging.debug('Put: ./clusterConfigs/' +
-                          clusterDictionary["clusterName"] + '/fstab.cape')
-            sftp.put('./templates/limits.conf.cape', '/tmp/limits.conf.cape', confirm=True)
-            logging.debug('Put: ./templates/limits.conf.cape')
-            sftp.put('./scripts/prepareHost.sh', '/tmp/prepareHost.sh', confirm=True)
-            logging.debug('Put: ./scripts/prepareHost.sh')
-
-            time.sleep(10)
-
-            logging.debug('Creating user root')
-            (stdin, stdout, stderr) = ssh.exec_command("sudo echo " + os.environ["ROOT_PW"] + " | sudo passwd --stdin root")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            logging.debug('Making prepareHost executable and running it')
-            ssh.exec_command("sudo chmod +x /tmp/prepareHost.sh")
-            (stdin, stdout, stderr) = ssh.exec_command("/tmp/prepareHost.sh " + str(os.environ["DISK_QTY"]) + " " + str(os.environ["RAID0"]) +" &> /tmp/prepareHost.log")
-            logging.debug('Starting prepareHost script on ' + clusterNode["nodeName"])
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            homeDir = os.environ["BASE_HOME"] + "/home"
-            logging.debug('Adding user gpadmin with homdir path: ' + homeDir)
-            (stdin, stdout, stderr) = ssh.exec_command("sudo mkdir -p " + homeDir + ";sudo useradd -b " + homeDir + " -s " + "/bin/bash -m gpadmin")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            logging.debug('Setting gpadmin password')
-            (stdin, stdout, stderr) = ssh.exec_command("sudo echo " + os.environ["GPADMIN_PW"] + " | sudo passwd --stdin gpadmin")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
-            # could change to node.reboot
-            print clusterNode["nodeName"]+": Rebooting"
-            logging.debug(clusterNode["nodeName"] + ': Rebooting')
-            (stdin, stdout, stderr) = ssh.exec_command("sudo reboot")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
+            with SSHSessions.borrow(clusterNode) as ssh:
+                sftp = ssh.open_sftp()
+                Trace.put(sftp, clusterNode, capeHome + '/templates/sysctl.conf.cape', '/tmp/sysctl.conf.cape')
+                logging.debug('Put: ./templates/sysctl.conf.cape')
+                Trace.put(sftp, clusterNode, capeHome + '/clusterConfigs/' + clusterDictionary["clusterName"] + '/fstab.cape',
+                          '/tmp/fstab.cape')
+                logging.debug('Put: ./clusterConfigs/' +
+                              clusterDictionary["clusterName"] + '/fstab.cape')
+                Trace.put(sftp, clusterNode, capeHome + '/templates/limits.conf.cape', '/tmp/limits.conf.cape')
+                logging.debug('Put: ./templates/limits.conf.cape')
+                Trace.put(sftp, clusterNode, capeHome + '/scripts/prepareHost.sh', '/tmp/prepareHost.sh')
+                logging.debug('Put: ./scripts/prepareHost.sh')
+                sftp.close()
+
+                logging.debug('Creating user root')
+                (stdin, stdout, stderr) = ssh.exec_command("sudo echo " + os.environ["ROOT_PW"] + " | sudo passwd --stdin root")
+                RemoteOutput.capture(clusterNode, "prepServer", stdout, stderr)
+                logging.debug('Making prepareHost executable and running it')
+                # pipefail, or tee's exit status would hide a failed prepareHost.sh
+                (stdin, stdout, stderr) = ssh.exec_command("sudo chmod +x /tmp/prepareHost.sh && set -o pipefail && " +
+                                                           "/tmp/prepareHost.sh " + str(os.environ["DISK_QTY"]) + " " + str(clusterDictionary["raid0"]) +" 2>&1 | tee /tmp/prepareHost.log")
+                logging.debug('Starting prepareHost script on ' + clusterNode["nodeName"])
+                if RemoteOutput.capture(clusterNode, "prepServer", stdout, stderr).returnCode != 0:
+                    # Not an SSH problem, running it again would not help
+                    logging.error(nodeName + ': prepareHost.sh failed, see /tmp/prepareHost.log on the node')
+                    print "     " + nodeName + ": prepareHost.sh Failed, CLUSTER CREATION FAILED"
+                    exit()
+                homeDir = os.environ["BASE_HOME"] + "/home"
+                logging.debug('Adding user gpadmin with homdir path: ' + homeDir)
+                (stdin, stdout, stderr) = ssh.exec_command("sudo mkdir -p " + homeDir + ";sudo useradd -b " + homeDir + " -s " + "/bin/bash -m gpadmin")
+                RemoteOutput.capture(clusterNode, "prepServer", stdout, stderr)
+                logging.debug('Setting gpadmin password')
+                (stdin, stdout, stderr) = ssh.exec_command("sudo echo " + os.environ["GPADMIN_PW"] + " | sudo passwd --stdin gpadmin")
+                RemoteOutput.capture(clusterNode, "prepServer", stdout, stderr)
+
+                # prepareHost.sh applied the tuning live and listed whatever only a reboot fixes
+                (stdin, stdout, stderr) = ssh.exec_command("cat /tmp/prepareHost.reboot 2>/dev/null")
+                rebootReasons = stdout.read().strip()
+                if os.environ.get("REBOOT", "auto") == "always":
+                    rebootReasons = (rebootReasons + " REBOOT=always").strip()
+                if rebootReasons:
+                    (stdin, stdout, stderr) = ssh.exec_command("cat /proc/sys/kernel/random/boot_id")
+                    oldBootID = stdout.read().strip()
+                    print clusterNode["nodeName"] + ": Rebooting (" + rebootReasons + ")"
+                    logging.debug(clusterNode["nodeName"] + ': Rebooting for ' + rebootReasons)
+                    (stdin, stdout, stderr) = ssh.exec_command("sudo reboot")
+                    RemoteOutput.capture(clusterNode, "prepServer", stdout, stderr)
+                else:
+                    print clusterNode["nodeName"] + ": Tuning Applied Live, No Reboot Needed"
+                    logging.debug(clusterNode["nodeName"] + ': No reboot needed')
             connected = True
         except Exception as e:
+            if oldBootID is not None:
+                # sudo reboot went out, the session dying with it is expected
+                logging.debug(nodeName + ': Session ended by the reboot: ' + str(e))
+                break
             print "     " + nodeName + ": Attempting SSH Connection"
             time.sleep(3)
 
@@ -280,24 +464,21 @@ def prepServer(clusterDictionary,clusterNode, nodeCnt):
                 print "CLUSTER CREATION FAILED:   Cleanup and Retry"
                 exit()
         finally:
-            ssh.close()
             logging.debug('prepServer Completed on '+clusterNode["nodeName"])
-    return
+    return oldBootID
 
 
 def hostsFiles(clusterDictionary):
     logging.debug('hostFiles Started')
     clusterPath = str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterDictionary["clusterName"]
-    os.chdir(clusterPath)
-    logging.debug('Changed Dir to: ' + os.getcwd())
-    with open("hosts", "w") as hostsFile:
+    with open(clusterPath + "/hosts", "w") as hostsFile:
         hostsFile.write("######  CAPE ENTRIES #######\n")
         for node in clusterDictionary["clusterNodes"]:
             hostsFile.write(node["internalIP"] + "  " + node["nodeName"] + "  " + node["FQDN"] + "\n")
     logging.debug('Wrote hosts file')
 
-    with open("workers", "w") as workersFile:
-        with open("allhosts", "w") as allhostsFile:
+    with open(clusterPath + "/workers", "w") as workersFile:
+        with open(clusterPath + "/allhosts", "w") as allhostsFile:
             for node in clusterDictionary["clusterNodes"]:
                 if "master1" in node["role"]:
                     allhostsFile.write(node["nodeName"] + "\n")
@@ -312,7 +493,7 @@ def hostsFiles(clusterDictionary):
     threads = []
     for clusterNode in clusterDictionary["clusterNodes"]:
         logging.debug('Starting uploadThread for: ' + str(clusterNode["nodeName"]))
-        uploadThread = threading.Thread(target=hostFileUpload, args=(clusterNode,))
+        uploadThread = threading.Thread(target=BuildBudget.run, args=(hostFileUpload, clusterNode, clusterPath))
         threads.append(uploadThread)
         uploadThread.start()
     for x in threads:
@@ -321,10 +502,8 @@ def hostsFiles(clusterDictionary):
 
 
 def verifyCluster(clusterDictionary):
-    print "Verifying Cluster"
-    # Check /etc/hosts
-    # SSH to each host and ping 000
-    # check df -k for Data Drive
+    # Name resolution, master reachability, data volume mounts, disk and network throughput
+    return ClusterValidate.validate(clusterDictionary)
 
 
 def keyShare(clusterDictionary):
@@ -332,7 +511,6 @@ def keyShare(clusterDictionary):
     logging.debug('keyShare Started')
     warnings.simplefilter("ignore")
     logging.debug('SimpleFilter for Warnings: ignore')
-    paramiko.util.log_to_file("/tmp/paramiko.log")
 
 
     for node in clusterDictionary["clusterNodes"]:
@@ -343,75 +521,62 @@ def keyShare(clusterDictionary):
         while not connected:
             try:
                 attemptCount += 1
-                ssh = paramiko.SSHClient()
-                ssh.set_missing_host_key_policy(AutoAddPolicy())
                 logging.debug('Connecting to Node: ' + str(node["nodeName"]))
                 logging.debug('SSH IP: ' + node["externalIP"] +
                               ' User: gpadmin')
-                ssh.connect(node["externalIP"], 22, "gpadmin", password=str(os.environ["GPADMIN_PW"]), timeout=120)
-                logging.debug('Generating id_rsa')
-                (stdin, stdout, stderr) = ssh.exec_command("echo -e  'y\n'|ssh-keygen -f ~/.ssh/id_rsa -t rsa -N ''")
-                logging.debug(stdout.readlines())
-                logging.debug(stderr.readlines())
-                logging.debug('Configure SSH settings')
-                (stdin, stdout, stderr) = ssh.exec_command("echo 'Host *\nStrictHostKeyChecking no' >> ~/.ssh/config;chmod 400 ~/.ssh/config")
-                logging.debug(stdout.readlines())
-                logging.debug(stderr.readlines())
-                for node1 in clusterDictionary["clusterNodes"]:
-                    # Explicitly writing exit so ssh session does not hang
-                    logging.debug("exchange key ssh from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]) + " using internal IP")
-                    (stdin, stdout, stderr) = ssh.exec_command("sshpass -p " + os.environ["GPADMIN_PW"] + "  ssh gpadmin@" + node1["internalIP"]+ " -o StrictHostKeyChecking=no")
-                    stdin.write('exit \n')
-                    stdin.flush()
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-                    logging.debug("exchange key ssh from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]) + " using FQDN")
-                    (stdin, stdout, stderr) = ssh.exec_command("sshpass -p " + os.environ["GPADMIN_PW"] + "  ssh gpadmin@" + node1["FQDN"]+ " -o StrictHostKeyChecking=no")
-                    stdin.write('exit \n')
-                    stdin.flush()
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-                    logging.debug("exchange key ssh-copy-id from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]))
-                    (stdin, stdout, stderr) = ssh.exec_command("sshpass -p " + os.environ["GPADMIN_PW"] + "  ssh-copy-id  gpadmin@" + node1["nodeName"])
-                    stdin.write('exit \n')
-                    stdin.flush()
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-
-                ssh.close()
+                with SSHSessions.borrow(node, "gpadmin") as ssh:
+                    logging.debug('Generating id_rsa')
+                    (stdin, stdout, stderr) = ssh.exec_command("echo -e  'y\n'|ssh-keygen -f ~/.ssh/id_rsa -t rsa -N ''")
+                    RemoteOutput.capture(node, "keyShare", stdout, stderr)
+                    logging.debug('Configure SSH settings')
+                    (stdin, stdout, stderr) = ssh.exec_command("echo 'Host *\nStrictHostKeyChecking no' >> ~/.ssh/config;chmod 400 ~/.ssh/config")
+                    RemoteOutput.capture(node, "keyShare", stdout, stderr)
+                    for node1 in clusterDictionary["clusterNodes"]:
+                        # Explicitly writing exit so ssh session does not hang
+                        logging.debug("exchange key ssh from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]) + " using internal IP")
+                        (stdin, stdout, stderr) = ssh.exec_command("sshpass -p " + os.environ["GPADMIN_PW"] + "  ssh gpadmin@" + node1["internalIP"]+ " -o StrictHostKeyChecking=no")
+                        stdin.write('exit \n')
+                        stdin.flush()
+                        RemoteOutput.capture(node, "keyShare", stdout, stderr)
+                        logging.debug("exchange key ssh from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]) + " using FQDN")
+                        (stdin, stdout, stderr) = ssh.exec_command("sshpass -p " + os.environ["GPADMIN_PW"] + "  ssh gpadmin@" + node1["FQDN"]+ " -o StrictHostKeyChecking=no")
+                        stdin.write('exit \n')
+                        stdin.flush()
+                        RemoteOutput.capture(node, "keyShare", stdout, stderr)
+                        logging.debug("exchange key ssh-copy-id from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]))
+                        (stdin, stdout, stderr) = ssh.exec_command("sshpass -p " + os.environ["GPADMIN_PW"] + "  ssh-copy-id  gpadmin@" + node1["nodeName"])
+                        stdin.write('exit \n')
+                        stdin.flush()
+                        RemoteOutput.capture(node, "keyShare", stdout, stderr)
+
                 logging.debug('Connecting to Node: ' + str(node["nodeName"]))
                 logging.debug('SSH IP: ' + node["externalIP"] +
                               ' User: root')
-                ssh.connect(node["externalIP"], 22, "root", password=str(os.environ["ROOT_PW"]),
-                            timeout=120)
-                logging.debug('Generating id_rsa')
-                (stdin, stdout, stderr) = ssh.exec_command("echo -e  'y\n'|ssh-keygen -f ~/.ssh/id_rsa -t rsa -N ''")
-                logging.debug(stdout.readlines())
-                logging.debug(stderr.readlines())
-                logging.debug('Configure SSH settings')
-                ssh.exec_command("echo 'Host *\nStrictHostKeyChecking no' >> ~/.ssh/config;chmod 400 ~/.ssh/config")
-                for node1 in clusterDictionary["clusterNodes"]:
-                    # explicitly writing exit to stdin so ssh session does not hang
-                    logging.debug("exchange key ssh from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]) + " using internal IP")
-                    (stdin, stdout, stderr) = ssh.exec_command("sshpass -p " + os.environ["ROOT_PW"] + "  ssh root@" + node1["internalIP"]+ " -o StrictHostKeyChecking=no" )
-                    stdin.write('exit \n')
-                    stdin.flush()
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-                    logging.debug("exchange key ssh from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]) + " using FQDN")
-                    (stdin, stdout, stderr) = ssh.exec_command("sshpass -p " + os.environ["ROOT_PW"] + "  ssh root@" + node1["FQDN"]+ " -o StrictHostKeyChecking=no" )
-                    stdin.write('exit \n')
-                    stdin.flush()
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-                    logging.debug("exchange key ssh-copy-id from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]))
-                    (stdin, stdout, stderr) = ssh.exec_command(
-                        "sshpass -p " + os.environ["ROOT_PW"] + "  ssh-copy-id  root@" + node1[
-                            "nodeName"])
-                    stdin.write('exit \n')
-                    stdin.flush()
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
+                with SSHSessions.borrow(node, "root") as ssh:
+                    logging.debug('Generating id_rsa')
+                    (stdin, stdout, stderr) = ssh.exec_command("echo -e  'y\n'|ssh-keygen -f ~/.ssh/id_rsa -t rsa -N ''")
+                    RemoteOutput.capture(node, "keyShare", stdout, stderr)
+                    logging.debug('Configure SSH settings')
+                    ssh.exec_command("echo 'Host *\nStrictHostKeyChecking no' >> ~/.ssh/config;chmod 400 ~/.ssh/config")
+                    for node1 in clusterDictionary["clusterNodes"]:
+                        # explicitly writing exit to stdin so ssh session does not hang
+                        logging.debug("exchange key ssh from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]) + " using internal IP")
+                        (stdin, stdout, stderr) = ssh.exec_command("sshpass -p " + os.environ["ROOT_PW"] + "  ssh root@" + node1["internalIP"]+ " -o StrictHostKeyChecking=no" )
+                        stdin.write('exit \n')
+                        stdin.flush()
+                        RemoteOutput.capture(node, "keyShare", stdout, stderr)
+                        logging.debug("exchange key ssh from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]) + " using FQDN")
+                        (stdin, stdout, stderr) = ssh.exec_command("sshpass -p " + os.environ["ROOT_PW"] + "  ssh root@" + node1["FQDN"]+ " -o StrictHostKeyChecking=no" )
+                        stdin.write('exit \n')
+                        stdin.flush()
+                        RemoteOutput.capture(node, "keyShare", stdout, stderr)
+                        logging.debug("exchange key ssh-copy-id from " + str(node["nodeName"]) + " to " + str(node1["nodeName"]))
+                        (stdin, stdout, stderr) = ssh.exec_command(
+                            "sshpass -p " + os.environ["ROOT_PW"] + "  ssh-copy-id  root@" + node1[
+                                "nodeName"])
+                        stdin.write('exit \n')
+                        stdin.flush()
+                        RemoteOutput.capture(node, "keyShare", stdout, stderr)
 
                 connected = True
             except Exception as e:
@@ -427,15 +592,13 @@ def keyShare(clusterDictionary):
                     print "Failing Process"
                     exit()
             finally:
-                ssh.close()
                 logging.debug('keyShare Completed')
 
 
-def hostFileUpload(clusterNode):
+def hostFileUpload(clusterNode, clusterPath):
     logging.debug('hostFileUpload Started')
     warnings.simplefilter("ignore")
     logging.debug('SimpleFilter for Warnings: ignore')
-    paramiko.util.log_to_file("/tmp/paramiko.log")
 
     connected = False
     attemptCount = 0
@@ -443,28 +606,23 @@ def hostFileUpload(clusterNode):
     while not connected:
         try:
             attemptCount += 1
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
-            logging.debug('Current Dir: ' + os.getcwd())
             logging.debug('Connecting to Node: ' + clusterNode["nodeName"])
             logging.debug('SSH IP: ' + clusterNode["externalIP"] + ' User: ' +
                           os.environ["SSH_USERNAME"] + ' Key: ' +
                           str(os.environ["CONFIGS_PATH"]) +
                           str(os.environ["SSH_KEY"]))
-            ssh.connect(clusterNode["externalIP"], 22, os.environ["SSH_USERNAME"], None, pkey=None,
-                        key_filename=(str(os.environ["CONFIGS_PATH"]) + str(os.environ["SSH_KEY"])), timeout=120)
-
-            sftp = ssh.open_sftp()
-            sftp.put("hosts", "/tmp/hosts", confirm=True)
-            logging.debug('Put hosts file')
-            sftp.put("allhosts", "/tmp/allhosts", confirm=True)
-            logging.debug('Put allhosts file')
-            sftp.put("workers", "/tmp/workers", confirm=True)
-            logging.debug('Put Workers File')
-
-            (stdin, stdout, stderr) = ssh.exec_command("sudo sh -c 'cat /tmp/hosts >> /etc/hosts'")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
+            with SSHSessions.borrow(clusterNode) as ssh:
+                sftp = ssh.open_sftp()
+                Trace.put(sftp, clusterNode, clusterPath + "/hosts", "/tmp/hosts")
+                logging.debug('Put hosts file')
+                Trace.put(sftp, clusterNode, clusterPath + "/allhosts", "/tmp/allhosts")
+                logging.debug('Put allhosts file')
+                Trace.put(sftp, clusterNode, clusterPath + "/workers", "/tmp/workers")
+                logging.debug('Put Workers File')
+                sftp.close()
+
+                (stdin, stdout, stderr) = ssh.exec_command("sudo sh -c 'cat /tmp/hosts >> /etc/hosts'")
+                RemoteOutput.capture(clusterNode, "hostFileUpload", stdout, stderr)
             connected = True
         except Exception as e:
             # print e
@@ -477,7 +635,6 @@ def hostFileUpload(clusterNode):
                 print "Failing Process"
                 exit()
         finally:
-            ssh.close()
             logging.debug('hostFileUpload Completed')
 
 
@@ -485,7 +642,6 @@ def getNodeFQDN(clusterDictionary):
     logging.debug('getNodeFQDN Started')
     warnings.simplefilter("ignore")
     logging.debug('SimpleFilter for Warnings: ignore')
-    paramiko.util.log_to_file("/tmp/paramiko.log")
 
     connected = False
     attemptCount = 0
@@ -493,17 +649,14 @@ def getNodeFQDN(clusterDictionary):
     while not connected:
         try:
             attemptCount += 1
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             for node in clusterDictionary["clusterNodes"]:
                 logging.debug('Connecting to ' + node["nodeName"])
                 logging.debug('SSH IP: ' + node["externalIP"] +
                               ' User: gpadmin')
-                ssh.connect(node["externalIP"], 22, "gpadmin", password=str(os.environ["GPADMIN_PW"]), timeout=120)
-                (stdin, stdout, stderr) = ssh.exec_command("hostname -f ")
-                fqdn = stdout.read()
-                logging.debug(stdout.readlines())
-                logging.debug(stderr.readlines())
+                with SSHSessions.borrow(node, "gpadmin") as ssh:
+                    (stdin, stdout, stderr) = ssh.exec_command("hostname -f ")
+                    fqdn = stdout.read()
+                    RemoteOutput.capture(node, "getNodeFQDN", stdout, stderr)
                 node["FQDN"] = fqdn.strip()
                 logging.debug('FQDN set: ' + str(node["FQDN"]))
             connected = True
@@ -519,5 +672,4 @@ def getNodeFQDN(clusterDictionary):
                 print "Failing Process"
                 exit()
         finally:
-            ssh.close()
             logging.debug('getNodeFQDN Completed')
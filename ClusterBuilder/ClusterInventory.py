@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+import time
+import logging
+
+# Persistent cluster inventory.
+# clusterConfigs/<name>/inventory.json holds what a build learned about its
+# nodes (GCE ids, IPs, FQDNs, roles, data volumes) plus the stage it reached,
+# rewritten atomically (temp file + rename) as the build progresses.  query,
+# destroy and gpdb read it instead of listing and name matching the zone.
+
+INVENTORY_VERSION = 1
+
+_lock = threading.Lock()
+
+
+def clusterPath(clusterName):
+    return str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterName
+
+
+def inventoryPath(clusterName):
+    return clusterPath(clusterName) + "/inventory.json"
+
+
+def save(clusterDictionary, stage):
+    inventory = {"version": INVENTORY_VERSION,
+                 "stage": stage,
+                 "updated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                 "project": os.environ.get("PROJECT"),
+                 "zone": os.environ.get("ZONE"),
+                 "cluster": clusterDictionary}
+    path = inventoryPath(clusterDictionary["clusterName"])
+    with _lock:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + ".tmp", "w") as inventoryFile:
+            json.dump(inventory, inventoryFile, indent=2)
+            inventoryFile.flush()
+            os.fsync(inventoryFile.fileno())
+        os.rename(path + ".tmp", path)
+    logging.debug(clusterDictionary["clusterName"] + ': Inventory saved at stage ' + stage)
+
+
+def load(clusterName):
+    # Returns the inventory document, None if the cluster has none
+    path = inventoryPath(clusterName)
+    if os.path.isfile(path):
+        with open(path, "r") as inventoryFile:
+            inventory = json.load(inventoryFile)
+        if inventory.get("version", 0) > INVENTORY_VERSION:
+            raise ValueError(path + ' is inventory version ' + str(inventory.get("version")) +
+                             ', this cape reads up to ' + str(INVENTORY_VERSION))
+        return inventory
+    # Clusters built before the inventory only saved their final dictionary
+    legacyPath = clusterPath(clusterName) + "/clusterDictionary.json"
+    if os.path.isfile(legacyPath):
+        with open(legacyPath, "r") as clusterFile:
+            return {"version": 0, "stage": "built", "updated": None,
+                    "project": os.environ.get("PROJECT"), "zone": os.environ.get("ZONE"),
+                    "cluster": json.load(clusterFile)}
+    return None
+
+
+def loadCluster(clusterName):
+    inventory = load(clusterName)
+    if inventory is None:
+        return None
+    return inventory["cluster"]
+
+
+def setStage(clusterName, stage):
+    inventory = load(clusterName)
+    if inventory is not None:
+        save(inventory["cluster"], stage)
+
+
+def listClusters():
+    # (name, stage, node count, updated) for every cluster with an inventory
+    configsPath = str(os.environ["CAPE_HOME"]) + "/clusterConfigs"
+    clusters = []
+    if not os.path.isdir(configsPath):
+        return clusters
+    for clusterName in sorted(os.listdir(configsPath)):
+        try:
+            inventory = load(clusterName)
+        except ValueError as e:
+            logging.debug(str(e))
+            continue
+        if inventory is None:
+            continue
+        clusters.append((clusterName, inventory["stage"],
+                         len(inventory["cluster"].get("clusterNodes", [])), inventory["updated"]))
+    return clusters
@@ -0,0 +1,70 @@
+import os
+import re
+import logging
+from multiprocessing.pool import ThreadPool
+from libcloud.common.google import ResourceNotFoundError
+
+import BuildBudget
+import GCEDriver
+
+# Cluster labels.
+# Every instance and disk a create makes carries LABEL_KEY=<cluster name>, so
+# destroy can find everything a cluster owns with one filtered list per
+# resource kind instead of listing the zone and matching names.  libcloud
+# 1.1.0 has no label support, these go through the driver's raw connection.
+
+LABEL_KEY = "cape-cluster"
+
+
+def labelValue(clusterName):
+    # GCE label values: lowercase letters, digits, - and _, at most 63 characters
+    return re.sub("[^a-z0-9_-]", "-", clusterName.lower())[:63]
+
+
+def labels(clusterName):
+    return {LABEL_KEY: labelValue(clusterName)}
+
+
+def zonePath(kind, name=None):
+    path = "/zones/" + str(os.environ["ZONE"]) + "/" + kind
+    if name is not None:
+        path += "/" + name
+    return path
+
+
+def setLabels(driver, kind, name, clusterName):
+    # setLabels needs the current fingerprint, existing labels are kept
+    resource = driver.connection.request(zonePath(kind, name), method="GET").object
+    resourceLabels = resource.get("labels", {})
+    resourceLabels.update(labels(clusterName))
+    driver.connection.request(zonePath(kind, name) + "/setLabels", method="POST",
+                              data={"labels": resourceLabels,
+                                    "labelFingerprint": resource.get("labelFingerprint")})
+    logging.debug('Labeled ' + kind + ' ' + name + ' ' + LABEL_KEY + '=' + labelValue(clusterName))
+
+
+def labelResources(clusterName, kind, names):
+    # Bounded pool, each worker on its own driver
+    if not names:
+        return
+    pool = ThreadPool(min(int(os.environ.get("VOLUME_WORKERS", 16)), len(names)))
+    try:
+        pool.map(lambda name: BuildBudget.run(setLabels, GCEDriver.threadDriver(), kind, name, clusterName), names)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def listByLabel(driver, kind, clusterName):
+    # Raw resource dicts (name, id, status, users, ...) carrying the cluster label
+    items = []
+    params = {"filter": "labels." + LABEL_KEY + " eq " + labelValue(clusterName), "maxResults": 500}
+    while True:
+        try:
+            response = driver.connection.request(zonePath(kind), method="GET", params=params).object
+        except ResourceNotFoundError:
+            return items
+        items.extend(response.get("items", []))
+        if not response.get("nextPageToken"):
+            return items
+        params["pageToken"] = response["nextPageToken"]
@@ -0,0 +1,217 @@
+import json
+import os
+import re
+import sys
+import threading
+import traceback
+import logging
+
+import BuildBudget
+import DiskBench
+import RemoteBatch
+import SegmentLayout
+import Trace
+
+# Cluster validation, `cape validate` and VALIDATE=yes at the end of create.
+# Every node runs its checks and disk test at the same time: it must resolve
+# and ping the master, have every data volume mounted, and each mounted data
+# volume gets a direct I/O dd write and read of VALIDATE_DISK_MB.  The
+# network test is iperf3 between the segment hosts, scheduled in rounds in
+# which every host sends to at most one peer and receives from at most one:
+# a single round for the ring (every host to the next), n-1 rounds of
+# disjoint pairs for all pairs.  Results go to
+# clusterConfigs/<cluster>/validate.json.  A volume or link below the median
+# by more than VALIDATE_TOLERANCE is flagged as an outlier; the gate fails on
+# failed checks and, when set, on anything below VALIDATE_MIN_DISK_MBS or
+# VALIDATE_MIN_NET_MBITS.
+
+DEFAULT_DISK_MB = 1024
+DEFAULT_NET_SECONDS = 5
+DEFAULT_TOLERANCE = 0.25
+IPERF_PORT = "5201"
+
+
+def mountPattern():
+    return "^(/data[0-9]+|" + os.environ["BASE_HOME"] + "/disk[0-9]+)$"
+
+
+def expectedVolumes(clusterDictionary):
+    # None when RAID0=auto has no recorded decision for this cluster
+    raid0 = DiskBench.clusterRaid(clusterDictionary)
+    if raid0 is None:
+        return None
+    return len(SegmentLayout.volumes(int(os.environ["DISK_QTY"]), 'yes' in raid0, os.environ["BASE_HOME"]))
+
+
+def diskTest(sizeMB):
+    # One "<volume> <write MB/s> <read MB/s>" line per mounted data volume
+    size = str(sizeMB)
+    return "for v in $(awk '{print $2}' /proc/mounts | grep -E '" + mountPattern() + "'); do\n" + \
+        "  f=$v/cape-validate.$$\n" + \
+        "  s=$(date +%s%N); sudo dd if=/dev/zero of=$f bs=1M count=" + size + " oflag=direct 2>/dev/null || exit 1\n" + \
+        "  e=$(date +%s%N); w=$(( " + size + " * 1000000000 / (e - s) ))\n" + \
+        "  s=$(date +%s%N); sudo dd if=$f of=/dev/null bs=1M iflag=direct 2>/dev/null || exit 1\n" + \
+        "  e=$(date +%s%N); echo \"$v $w $(( " + size + " * 1000000000 / (e - s) ))\"\n" + \
+        "  sudo rm -f $f\n" + \
+        "done"
+
+
+def checkNode(clusterNode, masterNode, sizeMB, results):
+    nodeResult = {"checks": {}, "volumes": {}}
+    try:
+        steps = RemoteBatch.runSteps(clusterNode, [
+            ("hosts", "getent hosts " + masterNode["nodeName"] + " && ping -c 1 -W 2 " + masterNode["nodeName"]),
+            ("diskTest", diskTest(sizeMB)),
+        ], stopOnError=False, keepOutput=True)
+        for step in steps:
+            nodeResult["checks"][step["step"]] = step["rc"] == 0
+            if step["step"] == "diskTest":
+                for line in step["output"].splitlines():
+                    fields = line.split()
+                    if len(fields) == 3 and re.match(mountPattern(), fields[0]):
+                        nodeResult["volumes"][fields[0]] = {"writeMBs": int(fields[1]), "readMBs": int(fields[2])}
+    except Exception as e:
+        logging.debug(traceback.format_exc())
+        nodeResult["error"] = str(e)
+    results[clusterNode["nodeName"]] = nodeResult
+
+
+def linkTest(source, target, seconds, results):
+    link = source["nodeName"] + " -> " + target["nodeName"]
+    try:
+        RemoteBatch.runSteps(target, [("iperf3Server", "iperf3 -s -1 -D -p " + IPERF_PORT)])
+        # The one-off server may still be binding, the client retries
+        steps = RemoteBatch.runSteps(source, [
+            ("iperf3Client", "for i in 1 2 3; do iperf3 -c " + target["internalIP"] + " -p " + IPERF_PORT +
+             " -t " + str(seconds) + " -f m > /tmp/cape-iperf3.out && break; sleep 1; done; " +
+             "grep receiver /tmp/cape-iperf3.out | awk '{print $(NF-2)}'"),
+        ], keepOutput=True)
+        results[link] = {"mbits": float(steps[0]["output"].split()[-1])}
+    except Exception as e:
+        logging.debug(traceback.format_exc())
+        results[link] = {"error": str(e)}
+
+
+def linkRounds(hosts, mode):
+    # Rounds of (source, target) pairs, no host twice in the same direction of a round
+    if len(hosts) < 2:
+        return []
+    if mode == "ring":
+        if len(hosts) == 2:
+            return [[(hosts[0], hosts[1])]]
+        return [[(hosts[hostNum], hosts[(hostNum + 1) % len(hosts)]) for hostNum in range(len(hosts))]]
+    # Circle method, an odd host count sits out one round each
+    circle = list(hosts) + ([None] if len(hosts) % 2 else [])
+    rounds = []
+    for roundNum in range(len(circle) - 1):
+        pairs = [(circle[pairNum], circle[len(circle) - 1 - pairNum]) for pairNum in range(len(circle) / 2)]
+        rounds.append([pair for pair in pairs if None not in pair])
+        circle = [circle[0]] + [circle[-1]] + circle[1:-1]
+    return rounds
+
+
+def runThreads(targets):
+    threads = []
+    for (function, args) in targets:
+        testThread = threading.Thread(target=BuildBudget.run, args=(function,) + args)
+        threads.append(testThread)
+        testThread.start()
+    for x in threads:
+        x.join()
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) / 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def flagOutliers(entries, metric, tolerance):
+    # entries: [(name, result dict)], marks the results below the median by more than tolerance
+    values = [result[metric] for (name, result) in entries if metric in result]
+    if len(values) < 3:
+        return
+    floor = median(values) * (1 - tolerance)
+    for (name, result) in entries:
+        if metric in result and result[metric] < floor:
+            result.setdefault("outliers", []).append(metric)
+
+
+def validate(clusterDictionary, networkMode=None):
+    # Returns True when the cluster passes the gate
+    clusterName = clusterDictionary["clusterName"]
+    clusterNodes = clusterDictionary["clusterNodes"]
+    masterNode = [node for node in clusterNodes if "master1" in node["role"]][0]
+    segmentHosts = [node for node in clusterNodes if node["role"] == "worker"] or clusterNodes
+    networkMode = networkMode or os.environ.get("VALIDATE_NETWORK", "ring")
+    tolerance = float(os.environ.get("VALIDATE_TOLERANCE", DEFAULT_TOLERANCE))
+    print clusterName + ": Validating " + str(len(clusterNodes)) + " Nodes"
+
+    hostResults = {}
+    with Trace.span("validateDisks"):
+        runThreads([(checkNode, (clusterNode, masterNode, int(os.environ.get("VALIDATE_DISK_MB", DEFAULT_DISK_MB)),
+                                 hostResults)) for clusterNode in clusterNodes])
+    linkResults = {}
+    with Trace.span("validateNetwork"):
+        for roundPairs in linkRounds(segmentHosts, networkMode):
+            runThreads([(linkTest, (source, target, int(os.environ.get("VALIDATE_NET_SECONDS", DEFAULT_NET_SECONDS)),
+                                    linkResults)) for (source, target) in roundPairs])
+
+    volumeEntries = [(nodeName + ":" + volume, result) for nodeName in sorted(hostResults)
+                     for (volume, result) in sorted(hostResults[nodeName]["volumes"].items())]
+    flagOutliers(volumeEntries, "writeMBs", tolerance)
+    flagOutliers(volumeEntries, "readMBs", tolerance)
+    linkEntries = sorted(linkResults.items())
+    flagOutliers(linkEntries, "mbits", tolerance)
+
+    failures = []
+    expected = expectedVolumes(clusterDictionary)
+    for nodeName in sorted(hostResults):
+        nodeResult = hostResults[nodeName]
+        if "error" in nodeResult:
+            failures.append(nodeName + ": " + nodeResult["error"])
+        failures.extend([nodeName + ": " + check + " check failed"
+                         for (check, passed) in sorted(nodeResult["checks"].items()) if not passed])
+        if expected is not None and len(nodeResult["volumes"]) != expected:
+            failures.append(nodeName + ": " + str(len(nodeResult["volumes"])) + " of " + str(expected) +
+                            " data volumes mounted")
+    minDisk = os.environ.get("VALIDATE_MIN_DISK_MBS")
+    for (name, result) in volumeEntries:
+        if minDisk and min(result["writeMBs"], result["readMBs"]) < int(minDisk):
+            failures.append(name + ": below VALIDATE_MIN_DISK_MBS=" + minDisk)
+    minNet = os.environ.get("VALIDATE_MIN_NET_MBITS")
+    for (name, result) in linkEntries:
+        if "error" in result:
+            failures.append(name + ": " + result["error"])
+        elif minNet and result["mbits"] < float(minNet):
+            failures.append(name + ": below VALIDATE_MIN_NET_MBITS=" + minNet)
+
+    print "\t" + "Volume".ljust(32) + "Write MB/s".rjust(11) + "Read MB/s".rjust(11)
+    for (name, result) in volumeEntries:
+        print "\t" + name.ljust(32) + str(result["writeMBs"]).rjust(11) + str(result["readMBs"]).rjust(11) + \
+            ("  OUTLIER" if result.get("outliers") else "")
+    if linkEntries:
+        print "\t" + ("Link (" + networkMode + ")").ljust(32) + "Mbit/s".rjust(11)
+    for (name, result) in linkEntries:
+        print "\t" + name.ljust(32) + str(result.get("mbits", "-")).rjust(11) + \
+            ("  OUTLIER" if result.get("outliers") else "")
+    for failure in failures:
+        print "\t" + failure
+    report = {"hosts": hostResults, "links": linkResults, "network": networkMode, "failures": failures}
+    with open(str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterName + "/validate.json", "w") as reportFile:
+        json.dump(report, reportFile, indent=2, sort_keys=True)
+    logging.info(clusterName + ': Validation ' + json.dumps(report))
+    outliers = len([result for (name, result) in volumeEntries + linkEntries if result.get("outliers")])
+    if failures:
+        print clusterName + ": Validation FAILED (" + str(len(failures)) + " failures, " + str(outliers) + " outliers)"
+        return False
+    print clusterName + ": Validation Passed (" + str(outliers) + " outliers)"
+    return True
+
+
+def gate(clusterDictionary):
+    # VALIDATE=yes at the end of create
+    if not validate(clusterDictionary):
+        sys.exit("Cluster Validation Failed: see clusterConfigs/" + clusterDictionary["clusterName"] + "/validate.json")
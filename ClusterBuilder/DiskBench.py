@@ -0,0 +1,134 @@
+import json
+import os
+import threading
+import logging
+
+import NodeReadiness
+import RemoteOutput
+import SSHSessions
+import Trace
+
+# RAID0=auto.
+# Whether striping the data drives beats one filesystem per drive depends on
+# the instance and disk type, so instead of guessing one segment node runs
+# scripts/diskBench.sh against its still blank drives before prepareHost.sh
+# formats them.  The decision goes into the cluster dictionary as "raid0",
+# never into the environment, so every cluster of a batch resolves its own.
+# It and the results are kept in clusterConfigs/<cluster>/diskBench.json, and
+# per shape (SERVER_TYPE, DISK_TYPE, DISK_QTY, DISK_SIZE) in
+# CAPE_HOME/.diskBench.json, so resumed builds and later clusters of the same
+# shape reuse them without benchmarking.  RAID0 has to beat the drives on
+# their own by RAID_MARGIN, one filesystem per drive keeps segments on
+# separate failure domains and lets SegmentLayout spread them.  Shape
+# decisions from another BENCH_VERSION of diskBench.sh are benchmarked again.
+
+DEFAULT_SECONDS = 10
+RAID_MARGIN = 1.1
+# Raised whenever diskBench.sh measures differently
+BENCH_VERSION = 2
+METRICS = ["seqReadKBs", "seqWriteKBs", "randReadIOPS", "randWriteIOPS"]
+
+_lock = threading.Lock()
+_shapeLocks = {}
+
+
+def shapeKey():
+    return "/".join([str(os.environ[key]) for key in ["SERVER_TYPE", "DISK_TYPE", "DISK_QTY", "DISK_SIZE"]])
+
+
+def cachePath():
+    return str(os.environ["CAPE_HOME"]) + "/.diskBench.json"
+
+
+def clusterPath(clusterName):
+    return str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterName + "/diskBench.json"
+
+
+def loadJSON(path):
+    try:
+        with open(path) as jsonFile:
+            return json.load(jsonFile)
+    except (IOError, ValueError):
+        return None
+
+
+def saveDecision(shape, decision, results):
+    with _lock:
+        decisions = loadJSON(cachePath()) or {}
+        decisions[shape] = {"raid0": decision, "results": results, "version": BENCH_VERSION}
+        with open(cachePath(), "w") as cacheFile:
+            json.dump(decisions, cacheFile, indent=2, sort_keys=True)
+
+
+def decide(results):
+    # Mean of RAID0 / per drive over the runs, both at the same total queue depth
+    ratios = [float(results["raid0"][metric]) / max(float(results["jbod"][metric]), 1.0)
+              for metric in METRICS]
+    ratio = sum(ratios) / len(ratios)
+    logging.info('Disk benchmark: RAID0 at ' + str(round(ratio, 2)) + 'x the per drive layout')
+    if ratio > RAID_MARGIN:
+        return "yes"
+    return "no"
+
+
+def runBench(clusterNode):
+    NodeReadiness.waitForNode(clusterNode)
+    seconds = str(int(os.environ.get("DISK_BENCH_SECONDS", DEFAULT_SECONDS)))
+    with SSHSessions.borrow(clusterNode) as ssh:
+        sftp = ssh.open_sftp()
+        Trace.put(sftp, clusterNode, str(os.environ["CAPE_HOME"]) + "/scripts/diskBench.sh", "/tmp/diskBench.sh")
+        sftp.close()
+        (stdin, stdout, stderr) = ssh.exec_command("chmod +x /tmp/diskBench.sh; /tmp/diskBench.sh " +
+                                                   str(os.environ["DISK_QTY"]) + " " + seconds + " 2>&1")
+        if RemoteOutput.capture(clusterNode, "diskBench", stdout, stderr).returnCode != 0:
+            raise Exception("diskBench.sh failed on " + clusterNode["nodeName"])
+        (stdin, stdout, stderr) = ssh.exec_command("cat /tmp/diskBench.json")
+        return json.loads(stdout.read())
+
+
+def resolveRaid(clusterDictionary):
+    # Sets clusterDictionary["raid0"] to yes or no before anything reads it
+    if os.environ["RAID0"] != "auto":
+        clusterDictionary["raid0"] = os.environ["RAID0"]
+        return clusterDictionary["raid0"]
+    clusterName = clusterDictionary["clusterName"]
+    shape = shapeKey()
+    with _lock:
+        shapeLock = _shapeLocks.setdefault(shape, threading.Lock())
+    # Batch members of one shape wait for the first benchmark
+    with shapeLock:
+        recorded = loadJSON(clusterPath(clusterName))
+        if recorded is not None:
+            # Resumed build, its drives may be formatted by now
+            decision = recorded["raid0"]
+        else:
+            cached = (loadJSON(cachePath()) or {}).get(shape)
+            if cached is not None and cached.get("version") == BENCH_VERSION:
+                (decision, results) = (cached["raid0"], cached["results"])
+                logging.info('RAID0=auto: ' + decision + ' for ' + shape + ', cached')
+            else:
+                workers = [clusterNode for clusterNode in clusterDictionary["clusterNodes"]
+                           if clusterNode["role"] == "worker"] or clusterDictionary["clusterNodes"]
+                print clusterName + ": Benchmarking Data Disks on " + workers[0]["nodeName"]
+                with Trace.span("diskBench", "step", workers[0]["nodeName"]):
+                    results = runBench(workers[0])
+                logging.info('Disk benchmark on ' + workers[0]["nodeName"] + ': ' + json.dumps(results))
+                decision = decide(results)
+                saveDecision(shape, decision, results)
+            with open(clusterPath(clusterName), "w") as resultFile:
+                json.dump({"shape": shape, "raid0": decision, "results": results}, resultFile, indent=2,
+                          sort_keys=True)
+    print clusterName + ": RAID0=auto Selected RAID0=" + decision
+    clusterDictionary["raid0"] = decision
+    return decision
+
+
+def clusterRaid(clusterDictionary):
+    # The cluster's resolved RAID0, None when RAID0=auto has no recorded decision for it
+    raid0 = clusterDictionary.get("raid0", os.environ["RAID0"])
+    if raid0 == "auto":
+        recorded = loadJSON(clusterPath(clusterDictionary["clusterName"]))
+        if recorded is None:
+            return None
+        raid0 = recorded["raid0"]
+    return raid0
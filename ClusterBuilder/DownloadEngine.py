@@ -0,0 +1,168 @@
+import json
+import os
+import logging
+import time
+
+import RemoteOutput
+import SSHSessions
+import Trace
+
+# Per host download engine.
+# All files a node needs are fetched by one remote script with at most
+# DOWNLOAD_WORKERS transfers running at once.  Each transfer is a `wget -c`
+# retry loop, so a dropped connection resumes the partial file instead of
+# starting over, and a finished file is checked against the sha256 PivNet
+# publishes before it counts as downloaded.  Every file reports its size,
+# time, tries and verification result back to the controller.
+#
+# With STREAM_EXTRACT=yes, files flagged EXTRACT are unpacked into /tmp as
+# they arrive: tar.gz downloads are piped through pigz into tar (the sha256 is
+# taken from the same stream) and never land on disk as an archive.  tar
+# extracts into a staging directory that is moved into /tmp only once the
+# sha256 matches, so a corrupt download never leaves files behind.  Zip files
+# are unzipped quietly right after their download while the other transfers
+# continue.  A marker file tells uncompressFiles the archive is already done.
+# Streaming only applies to per node downloads (ARTIFACT_FANOUT=no), fanned
+# out artifacts are copied between nodes whole and unpacked by uncompressFiles.
+
+RESULT_MARKER = "CAPE_DOWNLOAD "
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 5
+
+FETCH_FUNCTION = """capeFetch() {
+    CAPE_START=$(date +%s%N)
+    CAPE_TRIES=0
+    CAPE_RC=1
+    CAPE_VERIFIED=none
+    while [ $CAPE_TRIES -lt $CAPE_RETRIES ]; do
+        CAPE_TRIES=$((CAPE_TRIES + 1))
+        if $CAPE_SUDO wget -q -c --tries=1 --timeout=60 --header="Authorization: Token $CAPE_TOKEN" --post-data='' "$2" -O "$3"; then
+            if [ -z "$4" ]; then
+                CAPE_RC=0
+                break
+            fi
+            if echo "$4  $3" | sha256sum -c - > /dev/null 2>&1; then
+                CAPE_RC=0
+                CAPE_VERIFIED=yes
+                break
+            fi
+            CAPE_VERIFIED=no
+            $CAPE_SUDO rm -f "$3"
+        fi
+        sleep $((CAPE_TRIES * 2))
+    done
+    if [ $CAPE_RC -eq 0 ] && [ "$5" = "zip" ]; then
+        (cd /tmp && unzip -qo "$3" && touch /tmp/.cape-extracted-$1) || CAPE_RC=3
+    fi
+    CAPE_END=$(date +%s%N)
+    CAPE_BYTES=$(stat -c %s "$3" 2>/dev/null || echo 0)
+    printf '""" + RESULT_MARKER + """{"name": "%s", "rc": %d, "tries": %d, "ms": %d, "bytes": %d, "verified": "%s"}\\n' \\
+        "$1" $CAPE_RC $CAPE_TRIES $(( (CAPE_END - CAPE_START) / 1000000 )) $CAPE_BYTES $CAPE_VERIFIED
+}
+"""
+
+STREAM_FUNCTION = """capeStream() {
+    CAPE_START=$(date +%s%N)
+    CAPE_TRIES=0
+    CAPE_RC=1
+    CAPE_VERIFIED=none
+    CAPE_WORK=$(mktemp -d)
+    rm -f /tmp/.cape-extracted-$1
+    CAPE_GUNZIP=$(command -v pigz || echo gzip)
+    mkfifo $CAPE_WORK/archive $CAPE_WORK/count
+    while [ $CAPE_TRIES -lt $CAPE_RETRIES ]; do
+        CAPE_TRIES=$((CAPE_TRIES + 1))
+        rm -rf $CAPE_WORK/tree && mkdir $CAPE_WORK/tree
+        (set -o pipefail; cd $CAPE_WORK/tree && $CAPE_GUNZIP -dc < $CAPE_WORK/archive | tar xf -; echo $? > $CAPE_WORK/extract) &
+        CAPE_EXTRACTOR=$!
+        (wc -c < $CAPE_WORK/count > $CAPE_WORK/bytes) &
+        CAPE_COUNTER=$!
+        wget -q --tries=1 --timeout=60 --header="Authorization: Token $CAPE_TOKEN" --post-data='' "$2" -O - | \\
+            tee $CAPE_WORK/archive $CAPE_WORK/count | sha256sum | cut -d' ' -f1 > $CAPE_WORK/sum
+        CAPE_FETCH=${PIPESTATUS[0]}
+        wait $CAPE_EXTRACTOR $CAPE_COUNTER
+        if [ $CAPE_FETCH -eq 0 ] && [ "$(cat $CAPE_WORK/extract)" = "0" ]; then
+            if [ -z "$4" ]; then
+                CAPE_RC=0
+                break
+            fi
+            if [ "$(cat $CAPE_WORK/sum)" = "$4" ]; then
+                CAPE_RC=0
+                CAPE_VERIFIED=yes
+                break
+            fi
+            CAPE_VERIFIED=no
+        fi
+        sleep $((CAPE_TRIES * 2))
+    done
+    if [ $CAPE_RC -eq 0 ]; then
+        (shopt -s dotglob; for CAPE_ENTRY in $CAPE_WORK/tree/*; do
+            rm -rf "/tmp/${CAPE_ENTRY##*/}" && mv "$CAPE_ENTRY" /tmp/ || exit 1
+        done) && touch /tmp/.cape-extracted-$1 || CAPE_RC=3
+    fi
+    CAPE_END=$(date +%s%N)
+    CAPE_BYTES=$(cat $CAPE_WORK/bytes 2>/dev/null || echo 0)
+    rm -rf $CAPE_WORK
+    printf '""" + RESULT_MARKER + """{"name": "%s", "rc": %d, "tries": %d, "ms": %d, "bytes": %d, "verified": "%s"}\\n' \\
+        "$1" $CAPE_RC $CAPE_TRIES $(( (CAPE_END - CAPE_START) / 1000000 )) $CAPE_BYTES $CAPE_VERIFIED
+}
+"""
+
+
+def extractMarker(name):
+    return "/tmp/.cape-extracted-" + name
+
+
+def buildScript(files, sudo=False):
+    # files is a list of {"NAME", "URL", "SHA256", "PATH"}; PATH defaults to /tmp/NAME
+    workers = int(os.environ.get("DOWNLOAD_WORKERS", DEFAULT_WORKERS))
+    script = "CAPE_TOKEN='" + os.environ["PIVNET_APIKEY"] + "'\n"
+    script = script + "CAPE_RETRIES=" + str(int(os.environ.get("DOWNLOAD_RETRIES", DEFAULT_RETRIES))) + "\n"
+    script = script + "CAPE_SUDO=" + ("sudo" if sudo else "") + "\n"
+    script = script + FETCH_FUNCTION + STREAM_FUNCTION
+    for file in files:
+        function = "capeFetch"
+        extract = ""
+        if file.get("EXTRACT") and ".zip" in file["NAME"]:
+            extract = "zip"
+        elif file.get("EXTRACT") and ".gz" in file["NAME"]:
+            function = "capeStream"
+        script = script + "while [ $(jobs -rp | wc -l) -ge " + str(workers) + " ]; do sleep 0.2; done\n"
+        script = script + function + " '" + file["NAME"] + "' '" + str(file["URL"]) + "' '" + \
+                          file.get("PATH", "/tmp/" + file["NAME"]) + "' '" + (file.get("SHA256") or "") + "' '" + \
+                          extract + "' &\n"
+    script = script + "wait\n"
+    return script
+
+
+def fetchFiles(node, files, sudo=False):
+    # Returns the per file results, raises if any file could not be fetched and verified
+    if not files:
+        return []
+    logging.debug(node["nodeName"] + ': Downloading ' + ",".join([file["NAME"] for file in files]))
+    script = buildScript(files, sudo)
+    with SSHSessions.borrow(node) as ssh:
+        (stdin, stdout, stderr) = ssh.exec_command("bash -s")
+        stdin.write(script)
+        stdin.flush()
+        stdin.channel.shutdown_write()
+        lines = RemoteOutput.capture(node, "download", stdout, stderr, RESULT_MARKER).kept
+
+    results = []
+    for line in lines:
+        if line.startswith(RESULT_MARKER):
+            results.append(json.loads(line[len(RESULT_MARKER):]))
+    finished = time.time()
+    for result in results:
+        seconds = max(result["ms"], 1) / 1000.0
+        Trace.record("download " + result["name"], "transfer", finished - seconds, seconds, node["nodeName"],
+                     {"bytes": result["bytes"], "tries": result["tries"]})
+        logging.info(node["nodeName"] + ': ' + result["name"] + ' ' + str(result["bytes"]) + ' bytes in ' +
+                     str(round(seconds, 1)) + 's (' + str(round(result["bytes"] / seconds / 1048576, 1)) +
+                     ' MB/s) tries=' + str(result["tries"]) + ' verified=' + result["verified"])
+
+    failed = [result["name"] for result in results if result["rc"] != 0]
+    missing = [file["NAME"] for file in files if file["NAME"] not in [result["name"] for result in results]]
+    if failed or missing:
+        raise RuntimeError(node["nodeName"] + ': Download failed for ' + ",".join(failed + missing))
+    return results
@@ -0,0 +1,239 @@
+import copy
+import json
+import os
+import random
+import re
+import threading
+import time
+import logging
+from libcloud.common.google import GoogleBaseError
+from libcloud.compute.providers import get_driver
+from libcloud.compute.types import Provider
+
+# libcloud's Connection swaps its http connection on every request, so a
+# driver must not be shared between threads.  Worker threads get their own.
+# Only the first driver authenticates and lists the zones; every later one
+# is a copy of it with its own connection sharing the OAuth token, so any
+# number of builds in one process cost one login.
+#
+# Every request of every driver copy goes through apiRequest():
+#   - one token bucket of GCE_API_RATE requests per second for the process,
+#     sized to the project's API rate quota
+#   - identical GETs in flight at the same time are sent once and the
+#     response handed to every caller
+#   - instance and disk GETs are served from a cache for GCE_NODE_TTL
+#     seconds, any other request on the same resource drops the entry
+#   - rate limit responses are retried with jittered exponential backoff
+#     and drain the bucket so every thread slows down, not just the unlucky one
+#   - calls, errors, retries and latencies are counted per kind of call
+
+DEFAULT_RATE = 20
+DEFAULT_NODE_TTL = 5
+DEFAULT_RETRIES = 6
+BACKOFF_CAP = 32.0
+RATE_LIMIT_CODES = ["rateLimitExceeded", "userRateLimitExceeded", "RATE_LIMIT_EXCEEDED"]
+CACHED_RESOURCE = re.compile(r'^/zones/[^/]+/(instances|disks)/[^/?]+$')
+
+_local = threading.local()
+_lock = threading.Lock()
+_template = [None]
+_bucket = {"tokens": None, "updated": 0.0}
+_inflight = {}
+_cache = {}
+_stats = {}
+
+
+def connectDriver():
+    logging.debug('Connecting GCE driver for PROJECT: ' + str(os.environ["PROJECT"]) +
+                  ' ZONE: ' + str(os.environ["ZONE"]))
+    ComputeEngine = get_driver(Provider.GCE)
+    return ComputeEngine(os.environ["SVC_ACCOUNT"],
+                         str(os.environ["CONFIGS_PATH"]) + str(os.environ["SVC_ACCOUNT_KEY"]),
+                         project=str(os.environ["PROJECT"]),
+                         datacenter=str(os.environ["ZONE"]))
+
+
+def newDriver():
+    with _lock:
+        if _template[0] is None:
+            _template[0] = connectDriver()
+        template = _template[0]
+    driver = copy.copy(template)
+    driver.connection = copy.copy(template.connection)
+    driver.connection.driver = driver
+    driver.connection.connection = None
+    instrument(driver.connection)
+    return driver
+
+
+def threadDriver():
+    if getattr(_local, "driver", None) is None:
+        _local.driver = newDriver()
+    return _local.driver
+
+
+def instrument(connection):
+    request = connection.request
+
+    def limitedRequest(action, params=None, data=None, headers=None, method="GET", **kwargs):
+        return apiRequest(connection, request, action, params, data, headers, method, **kwargs)
+    connection.request = limitedRequest
+
+
+def apiRate():
+    return float(os.environ.get("GCE_API_RATE", DEFAULT_RATE))
+
+
+def resourcePath(action):
+    # selfLinks are full URLs, reduce them to the path below the project
+    return re.sub(r'^(https://[^/]+)?/compute/[^/]+/projects/[^/]+', '', action).split("?")[0]
+
+
+def callName(method, action):
+    # "GET instances", "POST instances.setLabels", "GET operations", ...
+    path = re.sub(r'^/(global|zones/[^/]+|regions/[^/]+)', '', resourcePath(action))
+    collections = [segment for segment in path.strip("/").split("/")[0::2] if segment]
+    return method + " " + (".".join(collections) or "zone")
+
+
+def count(name, stat, amount=1):
+    with _lock:
+        callStats = _stats.setdefault(name, {"calls": 0, "errors": 0, "retries": 0, "coalesced": 0,
+                                             "cached": 0, "seconds": 0.0, "maxSeconds": 0.0, "throttled": 0.0})
+        if stat == "seconds":
+            callStats["maxSeconds"] = max(callStats["maxSeconds"], amount)
+        callStats[stat] += amount
+
+
+def takeToken():
+    # Blocks until the bucket has a token, returns the seconds spent waiting
+    waited = 0.0
+    while True:
+        with _lock:
+            rate = apiRate()
+            now = time.time()
+            if _bucket["tokens"] is None:
+                _bucket["tokens"] = rate
+            _bucket["tokens"] = min(rate, _bucket["tokens"] + (now - _bucket["updated"]) * rate)
+            _bucket["updated"] = now
+            if _bucket["tokens"] >= 1:
+                _bucket["tokens"] -= 1
+                return waited
+            wait = (1 - _bucket["tokens"]) / rate
+        time.sleep(wait)
+        waited += wait
+
+
+def drainBucket(seconds):
+    # A rate limit response means the whole process is too fast
+    with _lock:
+        _bucket["tokens"] = min(_bucket["tokens"] or 0, -seconds * apiRate())
+
+
+def isRateLimit(e):
+    return getattr(e, "code", None) in RATE_LIMIT_CODES or getattr(e, "http_code", None) == 429
+
+
+def copyResponse(response):
+    # Callers may modify what they get back, never hand out the shared object
+    shared = copy.copy(response)
+    shared.object = copy.deepcopy(response.object)
+    return shared
+
+
+def sendRequest(name, request, action, params, data, headers, method, **kwargs):
+    retries = int(os.environ.get("GCE_API_RETRIES", DEFAULT_RETRIES))
+    attempt = 0
+    while True:
+        count(name, "throttled", takeToken())
+        start = time.time()
+        try:
+            response = request(action, params=params, data=data, headers=headers, method=method, **kwargs)
+            count(name, "calls")
+            count(name, "seconds", time.time() - start)
+            return response
+        except GoogleBaseError as e:
+            count(name, "calls")
+            count(name, "seconds", time.time() - start)
+            if not isRateLimit(e) or attempt >= retries:
+                count(name, "errors")
+                raise
+            attempt += 1
+            delay = min(BACKOFF_CAP, 2 ** attempt) * random.uniform(0.5, 1.0)
+            count(name, "retries")
+            logging.info('GCE rate limited on ' + name + ', retry ' + str(attempt) + ' in ' +
+                         str(round(delay, 1)) + 's')
+            drainBucket(delay / 2)
+            time.sleep(delay)
+
+
+def apiRequest(connection, request, action, params, data, headers, method, **kwargs):
+    name = callName(method, action)
+    path = resourcePath(action)
+    if method != "GET" or getattr(connection, "gce_params", None):
+        # Writes make cached reads of the resource stale, paged lists carry connection state
+        if method != "GET":
+            with _lock:
+                for key in [key for key in _cache if key[0] == path or key[0].startswith(path + "/") or
+                            path.startswith(key[0] + "/")]:
+                    del _cache[key]
+        return sendRequest(name, request, action, params, data, headers, method, **kwargs)
+
+    key = (path, json.dumps(params, sort_keys=True))
+    with _lock:
+        cached = _cache.get(key)
+        if cached is not None and time.time() < cached[0]:
+            leader = None
+        else:
+            leader = key not in _inflight
+            if leader:
+                _inflight[key] = {"done": threading.Event(), "response": None, "error": None}
+            flight = _inflight[key]
+    if leader is None:
+        count(name, "cached")
+        return copyResponse(cached[1])
+    if not leader:
+        flight["done"].wait()
+        count(name, "coalesced")
+        if flight["error"] is not None:
+            raise flight["error"]
+        return copyResponse(flight["response"])
+
+    try:
+        response = sendRequest(name, request, action, params, data, headers, method, **kwargs)
+        flight["response"] = response
+    except Exception as e:
+        flight["error"] = e
+        raise
+    finally:
+        with _lock:
+            del _inflight[key]
+            if flight["response"] is not None and CACHED_RESOURCE.match(path):
+                _cache[key] = (time.time() + float(os.environ.get("GCE_NODE_TTL", DEFAULT_NODE_TTL)),
+                               flight["response"])
+        flight["done"].set()
+    return copyResponse(response)
+
+
+def stats():
+    with _lock:
+        return copy.deepcopy(_stats)
+
+
+def summary():
+    # One line for the console, the per call breakdown goes to the log
+    callStats = stats()
+    if not callStats:
+        return None
+    for name in sorted(callStats, key=lambda name: -callStats[name]["calls"]):
+        entry = callStats[name]
+        logging.info('GCE ' + name + ': ' + str(entry["calls"]) + ' calls, ' + str(entry["errors"]) + ' errors, ' +
+                     str(entry["retries"]) + ' retries, ' + str(entry["coalesced"]) + ' coalesced, ' +
+                     str(entry["cached"]) + ' cached, avg ' +
+                     str(round(entry["seconds"] / max(entry["calls"], 1), 3)) + 's, max ' +
+                     str(round(entry["maxSeconds"], 3)) + 's, throttled ' + str(round(entry["throttled"], 1)) + 's')
+    total = dict((stat, sum([entry[stat] for entry in callStats.values()]))
+                 for stat in ["calls", "retries", "coalesced", "cached", "throttled"])
+    return "GCE API: " + str(total["calls"]) + " calls (" + str(total["retries"]) + " rate limit retries, " + \
+        str(total["coalesced"]) + " coalesced, " + str(total["cached"]) + " cached), " + \
+        str(round(total["throttled"], 1)) + "s throttled"
@@ -0,0 +1,181 @@
+import json
+import math
+import os
+import re
+import logging
+
+import GCEDriver
+
+# Hardware aware GUC profiles, GUC_PROFILE=classroom|tpcds|none.
+# The memory GUCs follow the Greenplum sizing formula for the machine
+# SERVER_TYPE gives a segment host:
+#   gp_vmem = (SWAP + RAM - (7.5GB + 0.05 * RAM)) / 1.7
+#   gp_vmem_protect_limit = gp_vmem / acting primaries
+# where the acting primaries are the primaries a host runs after its mirror
+# partner fails (SegmentLayout's failover skew) and swap counts up to half of
+# RAM, prepareHost.sh's 50GB swap file would otherwise dominate small
+# machines.  statement_mem shares 90% of the limit between the profile's
+# concurrent statements, which also become the pg_default resource queue's
+# ACTIVE_STATEMENTS.  Interconnect queue depths come from the profile,
+# gp_max_packet_size stays under the GCE MTU of 1460.  Spill files of a
+# segment may take WORKFILE_SHARE of its part of the host's data disks
+# (DISK_QTY x DISK_SIZE over the primaries and mirrors on the host).
+#
+# vCPUs and RAM of n1 and custom machine types are known from the name, any
+# other type is looked up in the machineTypes API.  When that fails only the
+# profile's fixed GUCs are applied and the sized ones keep their defaults.
+#
+# Every GUC goes into one postgresql.conf parameter file handed to
+# gpinitsystem -p and max_connections into MASTER_MAX_CONNECT, so the
+# instances start with them: no gpconfig run per GUC and no restart.
+# SET_GUCS=yes without a GUC_PROFILE applies tpcds, a superset of the GUCs
+# the old set_specific_GUCs script set.
+
+PROFILES = {
+    "classroom": {"concurrency": 20, "masterConnections": 250, "queueDepth": 4,
+                  "gucs": {"gp_autostats_mode": "on_no_stats"}},
+    "tpcds": {"concurrency": 5, "masterConnections": 100, "queueDepth": 8,
+              "gucs": {"optimizer": "on", "optimizer_analyze_root_partition": "on",
+                       "optimizer_metadata_caching": "on", "gp_autostats_mode": "none"}},
+}
+BASE_GUCS = {"gp_interconnect_transmit_timeout": 3600, "gp_fts_probe_interval": "5min",
+             "gp_fts_probe_timeout": "60s", "gp_filerep_tcp_keepalives_count": 2000,
+             "gp_max_packet_size": 1400, "gp_resqueue_memory_policy": "eager_free"}
+# GB of RAM per vCPU of the predefined n1 machine types, other families differ
+MACHINE_FAMILIES = {"standard": 3.75, "highmem": 6.5, "highcpu": 0.9}
+SHARED_CORE = {"f1-micro": (1, 614), "g1-small": (1, 1740)}
+SWAP_MB = 50 * 1024
+MIN_VMEM_MB = 512
+MIN_STATEMENT_MB = 32
+WORKFILE_SHARE = 0.25
+PARAMS_FILE = "/tmp/gucs.cape"
+
+
+def profileName():
+    name = os.environ.get("GUC_PROFILE")
+    if name is None:
+        if 'yes' in os.environ.get("SET_GUCS", "no"):
+            return "tpcds"
+        return "none"
+    return name
+
+
+def machineFacts(serverType):
+    # None when the machine type can not be sized
+    predefined = re.match(r'^n1-(standard|highmem|highcpu)-([0-9]+)$', serverType)
+    custom = re.match(r'^(?:[a-z][a-z0-9]*-)?custom-([0-9]+)-([0-9]+)(?:-ext)?$', serverType)
+    if predefined:
+        vcpus = int(predefined.group(2))
+        ramMB = int(vcpus * MACHINE_FAMILIES[predefined.group(1)] * 1024)
+    elif custom:
+        (vcpus, ramMB) = (int(custom.group(1)), int(custom.group(2)))
+    elif serverType in SHARED_CORE:
+        (vcpus, ramMB) = SHARED_CORE[serverType]
+    else:
+        # Anything else is asked from the machineTypes API
+        try:
+            size = GCEDriver.threadDriver().ex_get_size(serverType)
+            (vcpus, ramMB) = (int(size.extra["guestCpus"]), int(size.ram))
+        except Exception as e:
+            logging.info('Machine type ' + serverType + ' lookup failed: ' + str(e))
+            return None
+    return {"serverType": serverType, "vcpus": vcpus, "ramMB": ramMB, "swapMB": SWAP_MB,
+            "diskQty": int(os.environ["DISK_QTY"]), "diskSizeGB": int(os.environ["DISK_SIZE"])}
+
+
+def actingPrimaries(layout):
+    if layout["mirrorPolicy"] and layout["failoverSkew"] is not None:
+        return int(math.ceil(layout["segmentsPerHost"] * layout["failoverSkew"]))
+    return layout["segmentsPerHost"]
+
+
+def compute(name, facts, layout):
+    profile = PROFILES[name]
+    gucs = dict(BASE_GUCS)
+    gucs.update({"max_prepared_transactions": profile["masterConnections"],
+                 "gp_interconnect_queue_depth": profile["queueDepth"],
+                 "gp_interconnect_snd_queue_depth": max(profile["queueDepth"] / 2, 2)})
+    gucs.update(profile["gucs"])
+    tuning = {"profile": name, "facts": facts, "actingPrimaries": None,
+              "masterMaxConnect": profile["masterConnections"], "activeStatements": profile["concurrency"],
+              "gucs": gucs}
+    if facts is None:
+        return tuning
+
+    ramMB = facts["ramMB"]
+    acting = actingPrimaries(layout)
+    gpVmemMB = (min(facts["swapMB"], ramMB / 2) + ramMB - (7.5 * 1024 + 0.05 * ramMB)) / 1.7
+    vmemProtectMB = int(gpVmemMB / acting)
+    if vmemProtectMB < MIN_VMEM_MB:
+        logging.info(facts["serverType"] + ' is too small for ' + str(acting) + ' acting primaries, ' +
+                     'gp_vmem_protect_limit raised from ' + str(vmemProtectMB) + 'MB to ' + str(MIN_VMEM_MB) + 'MB')
+        vmemProtectMB = MIN_VMEM_MB
+    maxStatementMB = int(vmemProtectMB * 0.9)
+    statementMB = min(max(maxStatementMB / profile["concurrency"], MIN_STATEMENT_MB), maxStatementMB)
+    sharedBuffersMB = min(max(ramMB / 10 / (acting + 1), 125), 2048)
+    segmentsOnHost = len(layout["primaryDirectories"]) + len(layout["mirrorDirectories"])
+    workfileKB = int(facts["diskQty"] * facts["diskSizeGB"] * 1024 * 1024 * WORKFILE_SHARE / segmentsOnHost)
+
+    gucs.update({"gp_vmem_protect_limit": vmemProtectMB,
+                 "max_statement_mem": str(maxStatementMB) + "MB",
+                 "statement_mem": str(statementMB) + "MB",
+                 "shared_buffers": str(sharedBuffersMB) + "MB",
+                 "gp_resqueue_priority_cpucores_per_segment":
+                     round(float(facts["vcpus"]) / layout["segmentsPerHost"], 1),
+                 "gp_workfile_limit_per_segment": workfileKB})
+    tuning["actingPrimaries"] = acting
+    return tuning
+
+
+def fromEnvironment(name, layout):
+    return compute(name, machineFacts(os.environ["SERVER_TYPE"]), layout)
+
+
+def describe(tuning):
+    gucs = tuning["gucs"]
+    facts = tuning["facts"]
+    if facts is None:
+        return tuning["profile"] + " without sizing, unknown machine type, " + \
+            str(tuning["masterMaxConnect"]) + " connections"
+    return tuning["profile"] + " for " + facts["serverType"] + " (" + str(facts["vcpus"]) + " vCPU, " + \
+        str(round(facts["ramMB"] / 1024.0, 1)) + "GB), " + str(tuning["actingPrimaries"]) + " acting primaries, " + \
+        "gp_vmem_protect_limit " + str(gucs["gp_vmem_protect_limit"]) + "MB, statement_mem " + \
+        gucs["statement_mem"] + " x " + str(tuning["activeStatements"]) + ", shared_buffers " + \
+        gucs["shared_buffers"] + ", workfiles " + str(gucs["gp_workfile_limit_per_segment"] / 1048576) + \
+        "GB per segment, " + str(tuning["masterMaxConnect"]) + " connections"
+
+
+def paramsFile(tuning):
+    # postgresql.conf lines for gpinitsystem -p
+    lines = []
+    for (guc, value) in sorted(tuning["gucs"].items()):
+        if isinstance(value, (int, long, float)):
+            lines.append(guc + " = " + str(value))
+        else:
+            lines.append(guc + " = '" + value + "'")
+    return "\n".join(lines) + "\n"
+
+
+def gpinitsystemConfig(tuning, config):
+    return config + '\n#### CONNECTIONS, segments get 3 times as many\nMASTER_MAX_CONNECT=' + \
+        str(tuning["masterMaxConnect"]) + '\n'
+
+
+def gpinitsystemOptions(tuning):
+    if tuning is None:
+        return ""
+    return " -p " + PARAMS_FILE
+
+
+def queueCommand(tuning):
+    return "psql -d template1 -c 'ALTER RESOURCE QUEUE pg_default WITH (ACTIVE_STATEMENTS=" + \
+        str(tuning["activeStatements"]) + ")'"
+
+
+def save(tuning, clusterName):
+    clusterPath = str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterName
+    with open(clusterPath + "/gucs.json", "w") as tuningFile:
+        json.dump(tuning, tuningFile, indent=2, sort_keys=True)
+    with open(clusterPath + "/gucs.conf", "w") as paramsOut:
+        paramsOut.write(paramsFile(tuning))
+    return clusterPath + "/gucs.conf"
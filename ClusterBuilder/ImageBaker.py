@@ -0,0 +1,120 @@
+import os
+import sys
+import traceback
+import warnings
+import logging
+
+import GCEDriver
+import NodeReadiness
+import RemoteBatch
+import RemoteOutput
+import SSHSessions
+import Trace
+
+# Golden image baking.
+# The image half of scripts/prepareHost.sh (packages, pip and gsutil, sysctl
+# and limits, sshd, SELinux, grub) runs once on a throwaway builder VM whose
+# boot disk is then captured as a GCE image.  Nodes created from that image
+# find IMAGE_MARKER and run only the node half (data disks, fstab, swap), so a
+# create no longer waits on yum and pip mirrors.
+
+IMAGE_MARKER = "/etc/cape-image"
+DEFAULT_IMAGE_PROJECT = "centos-cloud"
+
+
+def sourceImage():
+    # Stock images come from centos-cloud, baked ones from the project they were baked in
+    return "/projects/" + os.environ.get("IMAGE_PROJECT", DEFAULT_IMAGE_PROJECT) + "/global/images/" + \
+           str(os.environ["IMAGE"])
+
+
+def bootDisk(diskName=None):
+    disk = {
+        "kind": "compute#attachedDisk",
+        "boot": True,
+        "autoDelete": True,
+        'initializeParams': {
+            "sourceImage": sourceImage(),
+            "diskSizeGb": 100,
+            "diskStorageType": str(os.environ["DISK_TYPE"]),
+            "diskType": "/compute/v1/projects/" + str(os.environ["PROJECT"]) + "/zones/" + str(
+                os.environ["ZONE"]) + "/diskTypes/" + str(os.environ["DISK_TYPE"])
+        },
+    }
+    if diskName:
+        disk['initializeParams']["diskName"] = diskName
+    return disk
+
+
+def bakeImage(imageName):
+    print imageName + ": Image Bake Started from " + str(os.environ["IMAGE"])
+    logging.info(imageName + ': Image Bake Started from ' + sourceImage())
+    warnings.simplefilter("ignore")
+    driver = GCEDriver.newDriver()
+    builderName = imageName + "-builder"
+    node = None
+    try:
+        with Trace.span("createBuilder"):
+            node = driver.create_node(builderName, str(os.environ["SERVER_TYPE"]), None,
+                                      location=str(os.environ["ZONE"]),
+                                      ex_service_accounts=[{'scopes': ['compute', 'storage-full']}],
+                                      ex_disks_gce_struct=[bootDisk(builderName)])
+        builderNode = {"nodeName": builderName,
+                       "externalIP": node.public_ips[0],
+                       "internalIP": node.private_ips[0]}
+        print builderName + ": Builder Created (" + builderNode["externalIP"] + ")"
+        with Trace.span("waitForBuilder"):
+            if NodeReadiness.waitForNode(builderNode) is None:
+                raise RuntimeError(builderName + ' never became reachable')
+
+        with Trace.span("prepareImage"):
+            prepareImage(builderNode)
+        SSHSessions.invalidate(builderNode)
+
+        print builderName + ": Stopping Builder"
+        with Trace.span("stopBuilder"):
+            driver.ex_stop_node(node)
+        print imageName + ": Capturing Image"
+        with Trace.span("createImage"):
+            volume = driver.ex_get_volume(builderName, str(os.environ["ZONE"]))
+            driver.ex_create_image(imageName, volume,
+                                   description="cape golden image baked from " + str(os.environ["IMAGE"]),
+                                   use_existing=False)
+        print imageName + ": Image Created. Set IMAGE=" + imageName + " and IMAGE_PROJECT=" + \
+            str(os.environ["PROJECT"]) + " in your config.env"
+        logging.info(imageName + ': Image Created in ' + str(os.environ["PROJECT"]))
+    except Exception as e:
+        logging.debug('Exception: ' + str(e))
+        logging.debug(traceback.print_exc())
+        print imageName + ": Image Bake Failed: " + str(e)
+        sys.exit('\n\nImage Bake Failed')
+    finally:
+        if node is not None:
+            print builderName + ": Deleting Builder"
+            try:
+                driver.destroy_node(node, destroy_boot_disk=True)
+            except Exception as e:
+                logging.error(builderName + ': Builder not deleted, remove it manually: ' + str(e))
+
+
+def prepareImage(builderNode):
+    # Same uploads as prepServer minus the per cluster fstab
+    with SSHSessions.borrow(builderNode) as ssh:
+        sftp = ssh.open_sftp()
+        Trace.put(sftp, builderNode, str(os.environ["CAPE_HOME"]) + '/templates/sysctl.conf.cape', '/tmp/sysctl.conf.cape')
+        Trace.put(sftp, builderNode, str(os.environ["CAPE_HOME"]) + '/templates/limits.conf.cape', '/tmp/limits.conf.cape')
+        Trace.put(sftp, builderNode, str(os.environ["CAPE_HOME"]) + '/scripts/prepareHost.sh', '/tmp/prepareHost.sh')
+        sftp.close()
+        print builderNode["nodeName"] + ": Running Host Preparation"
+        (stdin, stdout, stderr) = ssh.exec_command("chmod +x /tmp/prepareHost.sh && /tmp/prepareHost.sh 0 no image 2>&1 | "
+                                                   "tee /tmp/prepareHost.log; exit ${PIPESTATUS[0]}")
+        return_code = RemoteOutput.capture(builderNode, "prepareImage", stdout, stderr).returnCode
+    if return_code != 0:
+        raise RuntimeError('prepareHost.sh image returned: ' + str(return_code))
+    # Leave nothing node specific behind: caches, uploads, host keys (regenerated on first boot)
+    RemoteBatch.runSteps(builderNode, [
+        ("yumClean", "sudo yum clean all"),
+        ("tmpClean", "sudo rm -rf /tmp/sysctl.conf.cape /tmp/limits.conf.cape /tmp/prepareHost.sh /tmp/prepareHost.log"),
+        ("hostKeys", "sudo rm -f /etc/ssh/ssh_host_*"),
+        ("sync", "sync"),
+    ])
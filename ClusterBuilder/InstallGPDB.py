@@ -3,17 +3,30 @@ import sys
 import threading
 import time
 import traceback
-import paramiko
 import json
 import logging
-from paramiko import WarningPolicy
 
+import BuildJournal
+import ClusterInventory
+import DownloadEngine
+import GUCProfiles
+import NodeReadiness
+import RemoteBatch
+import RemoteOutput
+import SegmentLayout
+import SSHSessions
+import StepScheduler
+import Trace
 from LabBuilder import AccessHostPrepare
+from QueryCluster import GPDBState
 
 def installGPDB(clusterDictionary, downloads):
     print clusterDictionary["clusterName"] + ": Installing Greenplum Database on Cluster"
     logging.debug('Installing GPDB with Dictionary: ' + json.dumps(clusterDictionary))
-    threads = []
+    with Trace.span("waitForCluster"):
+        readyTimes = NodeReadiness.waitForCluster(clusterDictionary["clusterName"], clusterDictionary["clusterNodes"])
+    if not NodeReadiness.allReady(readyTimes):
+        sys.exit("Nodes not reachable: Please Verify Cluster Manually.")
     masterNode = {}
     accessNode = {}
     for clusterNode in clusterDictionary["clusterNodes"]:
@@ -21,53 +34,31 @@ def installGPDB(clusterDictionary, downloads):
             masterNode = clusterNode
         elif "access" in clusterNode["role"]:
             accessNode = clusterNode
-        uncompressFilesThread = threading.Thread(target=uncompressFiles, args=(clusterNode, downloads))
-        threads.append(uncompressFilesThread)
-        uncompressFilesThread.start()
-    for x in threads:
-        x.join()
-
-    threads = []
-    for clusterNode in clusterDictionary["clusterNodes"]:
-        prepFilesThread = threading.Thread(target=prepFiles, args=(clusterNode,))
-        threads.append(prepFilesThread)
-        prepFilesThread.start()
-    for x in threads:
-        x.join()
-
-    threads = []
-    for clusterNode in clusterDictionary["clusterNodes"]:
-        installBitsThread = threading.Thread(target=installBits, args=(clusterNode,))
-        threads.append(installBitsThread)
-        installBitsThread.start()
-    for x in threads:
-        x.join()
-
-    threads = []
-    for clusterNode in clusterDictionary["clusterNodes"]:
-        makeDirectoriesThread = threading.Thread(target=makeDirectories, args=(clusterNode,))
-        threads.append(makeDirectoriesThread)
-        makeDirectoriesThread.start()
-    for x in threads:
-        x.join()
-
-    threads = []
-    for clusterNode in clusterDictionary["clusterNodes"]:
-        setPathsThread = threading.Thread(target=setPaths, args=(clusterNode,))
-        threads.append(setPathsThread)
-        setPathsThread.start()
-    for x in threads:
-        x.join()
 
+    # Each node runs its own install chain, initDB is the only barrier
+    with Trace.span("installSteps"):
+        failures = StepScheduler.runNodeSteps(clusterDictionary["clusterNodes"],
+                                              installSteps(downloads, SegmentLayout.fromCluster(clusterDictionary)),
+                                              clusterDictionary["clusterName"])
+    if failures:
+        for nodeName in sorted(failures):
+            print nodeName + ": Failed at " + failures[nodeName]
+            logging.error(nodeName + ': Install failed at ' + failures[nodeName])
+        print "Fix the cause and continue with: cape create --resume --name " + clusterDictionary["clusterName"] + \
+            " --type gpdb"
+        sys.exit("Database Installation Failed: Look at your DEBUG log file for details.")
 
     print clusterDictionary["clusterName"] + ": Database Installation Complete"
     logging.info(clusterDictionary["clusterName"] + ': Database Installation Complete')
     print clusterDictionary["clusterName"] + ": Initializing Greenplum Database"
-    initDB(masterNode, clusterDictionary["clusterName"])
+    with Trace.span("initDB"):
+        BuildJournal.once(clusterDictionary["clusterName"], "initDB", initDB, masterNode, clusterDictionary)
     print clusterDictionary["clusterName"] + ": Database Initialization Complete"
-    verifyInstall(masterNode, clusterDictionary)
+    with Trace.span("verifyInstall"):
+        verifyInstall(masterNode, clusterDictionary)
     print clusterDictionary["clusterName"] + ": Installing Machine Learning Capabilities"
-    installComponents(masterNode, downloads)
+    with Trace.span("installComponents"):
+        BuildJournal.once(clusterDictionary["clusterName"], "installComponents", installComponents, masterNode, downloads)
     print clusterDictionary["clusterName"] + ": Machine Learning Install Complete"
 
     # NEED TO MAKE OPTIONAL
@@ -81,13 +72,27 @@ def installGPDB(clusterDictionary, downloads):
 
     if accessNode:
         print clusterDictionary["clusterName"] + ": Preparing Access Host "
-        AccessHostPrepare.installComponents(clusterDictionary)
+        with Trace.span("accessHost"):
+            BuildJournal.once(clusterDictionary["clusterName"], "accessHost", AccessHostPrepare.installComponents,
+                              clusterDictionary)
         print clusterDictionary["clusterName"] + ": Access Host Install Complete"
         #modifyPHGBA(masterNode)
-        modifyPHGBA(accessNode)
+        BuildJournal.once(clusterDictionary["clusterName"], "modifyPHGBA", modifyPHGBA, accessNode)
         print clusterDictionary["clusterName"] + ": Access Host configured to connect Complete"
 
     setGPADMINPW(masterNode)
+    ClusterInventory.save(clusterDictionary, "installed")
+
+
+def installSteps(downloads, layout):
+    # Per node install steps and the steps of the same node each one needs first
+    return [
+        ("uncompressFiles", lambda clusterNode: uncompressFiles(clusterNode, downloads), []),
+        ("prepFiles", prepFiles, ["uncompressFiles"]),
+        ("installBits", installBits, ["prepFiles"]),
+        ("makeDirectories", lambda clusterNode: makeDirectories(clusterNode, layout), []),
+        ("setPaths", lambda clusterNode: setPaths(clusterNode, layout), ["installBits"]),
+    ]
 
 
 def installComponents(masterNode, downloads):
@@ -98,30 +103,22 @@ def installComponents(masterNode, downloads):
     while not connected:
         try:
             attemptCount += 1
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + str(masterNode["nodeName"]))
             logging.debug('SSH IP: ' + masterNode["externalIP"] +
                           ' User: gpadmin')
-            ssh.connect(masterNode["externalIP"], 22, "gpadmin", str(os.environ["GPADMIN_PW"]), timeout=120)
-            (stdin, stdout, stderr) = ssh.exec_command("createlang plpythonu -d template1")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            (stdin, stdout, stderr) = ssh.exec_command("createlang plpythonu -d gpadmin")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            (stdin, stdout, stderr) = ssh.exec_command("gppkg -i /tmp/madlib*.gppkg")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            ssh.exec_command("$GPHOME/madlib/bin/madpack install -s madlib -p greenplum -c gpadmin@" + masterNode[
-                "nodeName"] + "/template1")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            ssh.exec_command("$GPHOME/madlib/bin/madpack install -s madlib -p greenplum -c gpadmin@" + masterNode[
-                "nodeName"] + "/gpadmin")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
+            with SSHSessions.borrow(masterNode, "gpadmin") as ssh:
+                (stdin, stdout, stderr) = ssh.exec_command("createlang plpythonu -d template1")
+                RemoteOutput.capture(masterNode, "installComponents", stdout, stderr)
+                (stdin, stdout, stderr) = ssh.exec_command("createlang plpythonu -d gpadmin")
+                RemoteOutput.capture(masterNode, "installComponents", stdout, stderr)
+                (stdin, stdout, stderr) = ssh.exec_command("gppkg -i /tmp/madlib*.gppkg")
+                RemoteOutput.capture(masterNode, "installComponents", stdout, stderr)
+                (stdin, stdout, stderr) = ssh.exec_command("$GPHOME/madlib/bin/madpack install -s madlib -p greenplum -c gpadmin@" + masterNode[
+                    "nodeName"] + "/template1")
+                RemoteOutput.capture(masterNode, "installComponents", stdout, stderr)
+                (stdin, stdout, stderr) = ssh.exec_command("$GPHOME/madlib/bin/madpack install -s madlib -p greenplum -c gpadmin@" + masterNode[
+                    "nodeName"] + "/gpadmin")
+                RemoteOutput.capture(masterNode, "installComponents", stdout, stderr)
             connected = True
 
         except Exception as e:
@@ -156,72 +153,38 @@ def verifyInstall(masterNode, clusterDictionary):
         try:
             attemptCount += 1
 
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + str(masterNode["nodeName"]))
             logging.debug('SSH IP: ' + masterNode["externalIP"] +
                           ' User: gpadmin')
-            ssh.connect(masterNode["externalIP"], 22, "gpadmin", str(os.environ["GPADMIN_PW"]), timeout=120)
-            (stdin, stdout, stderr) = ssh.exec_command(
-                "psql -c \"SELECT version() ;\"")
-            return_code = stdout.channel.recv_exit_status()
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            if return_code != 0:
-                print("Returned: " + str(return_code))
+            # One aggregated query replaces the per count psql calls
+            state = GPDBState.queryState(masterNode)
+            if state is None:
                 sys.exit("Failed to connect to Database using psql: Please Verify Database Manually.")
-            else:
-                print (masterNode["nodeName"] + ": Performing detailed database verification")
-                (stdin, stdout, stderr) = ssh.exec_command(
-                    "psql -c \"SELECT count(*) FROM gp_segment_configuration WHERE content >= 0 and status = 'u' and role = 'p';\"")
-                upPrimarySegments = int((stdout.readlines())[2])
-                logging.debug('upPrimarySegements: ' + str(upPrimarySegments))
-                logging.debug(stderr.readlines())
-
-                (stdin, stdout, stderr) = ssh.exec_command(
-                    "psql -c \"SELECT count(*) FROM gp_segment_configuration WHERE content >= 0 and status = 'u' and role = 'm';\"")
-                upMirrorSegments = int((stdout.readlines())[2])
-                logging.debug('upMirrorSegements: ' + str(upMirrorSegments))
-                logging.debug(stderr.readlines())
-
-                (stdin, stdout, stderr) = ssh.exec_command(
-                    "psql -c \"SELECT count(*) FROM gp_segment_configuration WHERE content >= 0 and status = 'd';\"")
-                downSegments = int((stdout.readlines())[2])
-                logging.debug('downSegments: ' + str(downSegments))
-                logging.debug(stderr.readlines())
+            print (masterNode["nodeName"] + ": Performing detailed database verification")
+            upPrimarySegments = state["primaries"]["up"]
+            logging.debug('upPrimarySegements: ' + str(upPrimarySegments))
+            upMirrorSegments = state["mirrors"]["up"]
+            logging.debug('upMirrorSegements: ' + str(upMirrorSegments))
+            downSegments = state["primaries"]["down"] + state["mirrors"]["down"]
+            logging.debug('downSegments: ' + str(downSegments))
+            primarySegments = state["primaries"]["total"]
+            logging.debug('primarySegments: ' + str(primarySegments))
+            mirrorSegments = state["mirrors"]["total"]
+            logging.debug('mirrorSegments: ' + str(mirrorSegments))
 
-                (stdin, stdout, stderr) = ssh.exec_command(
-                    "psql -c \"SELECT count(*) FROM gp_segment_configuration WHERE content >= 0;\"")
-                segments = int(stdout.readlines()[2])
-                logging.debug('segments: ' + str(segments))
-                logging.debug(stderr.readlines())
-
-                (stdin, stdout, stderr) = ssh.exec_command(
-                    "psql -c \"SELECT count(*) FROM gp_segment_configuration WHERE content >= 0 and role='p';\"")
-                primarySegments = int(stdout.readlines()[2])
-                logging.debug('primarySegments: ' + str(primarySegments))
-                logging.debug(stderr.readlines())
+            connected = True
 
-                (stdin, stdout, stderr) = ssh.exec_command(
-                    "psql -c \"SELECT count(*) FROM gp_segment_configuration WHERE content >= 0 and role='m';\"")
-
-                mirrorSegments = int(stdout.readlines()[2])
-                logging.debug('mirrorSegments: ' + str(mirrorSegments))
-                logging.debug(stderr.readlines())
-
-                connected = True
-
-                if (totalSegmentDBs == upPrimarySegments) and (totalSegmentDBs == primarySegments):
-                    if 'yes' in os.environ['MIRRORS'] and (totalSegmentDBs == upMirrorSegments) and (totalSegmentDBs != mirrorSegments):
-                        print clusterDictionary[
-                              "clusterName"] + ": Something went wrong with the Database mirror initialization, please verify manually"
-                        logging.info('GPDB Mirror Counts do not match. Failing to Verify!')
-                    print clusterDictionary["clusterName"] + ": Greenplum Database Initialization Verified"
-                    logging.info('verifyInstall Completed on: ' + str(masterNode["nodeName"]))
-                else:
+            if (totalSegmentDBs == upPrimarySegments) and (totalSegmentDBs == primarySegments):
+                if 'yes' in os.environ['MIRRORS'] and not (totalSegmentDBs == upMirrorSegments == mirrorSegments):
                     print clusterDictionary[
-                          "clusterName"] + ": Something went wrong with the Database initialization, please verify manually"
-                    logging.info('GPDB Primary Counts do not match. Failing to Verify!')
+                          "clusterName"] + ": Something went wrong with the Database mirror initialization, please verify manually"
+                    logging.info('GPDB Mirror Counts do not match. Failing to Verify!')
+                print clusterDictionary["clusterName"] + ": Greenplum Database Initialization Verified"
+                logging.info('verifyInstall Completed on: ' + str(masterNode["nodeName"]))
+            else:
+                print clusterDictionary[
+                      "clusterName"] + ": Something went wrong with the Database initialization, please verify manually"
+                logging.info('GPDB Primary Counts do not match. Failing to Verify!')
 
         except Exception as e:
             print e
@@ -244,61 +207,50 @@ def installDSPackages(clusterNode):
         try:
             attemptCount += 1
 
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + str(clusterNode["nodeName"]))
             logging.debug('SSH IP: ' + clusterNode["externalIP"] +
                           ' User: gpadmin')
-            ssh.connect(clusterNode["externalIP"], 22, "gpadmin", str(os.environ["GPADMIN_PW"]), timeout=120)
-
-            # FIX FOR GENSIM
-            logging.info('Gensim fix')
-            (stdin, stdout, stderr) = ssh.exec_command("echo -e 'import sys\nsys.setdefaultencoding(\"utf-8\")' >> /usr/local/greenplum-db-4.3.9.1/ext/python/lib/python2.6/site-packages/sitecustomize.py")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
-            # INSTALL PIP FOR GP-PYTHON
-            logging.info('Installing pip')
-            (stdin, stdout, stderr) = ssh.exec_command("wget https://bootstrap.pypa.io/get-pip.py -O /tmp/get-pip.py;python /tmp/get-pip.py --no-cache-dir")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
-            # INSTALL NUMPY
-            logging.info('Installing numpy')
-            (stdin, stdout, stderr) = ssh.exec_command("pip install numpy==1.9.3 -U --no-cache-dir")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
-            # INSTALL SCIPY
-            logging.info('Installing scipy')
-            (stdin, stdout, stderr) = ssh.exec_command("export CXX=/usr/bin/g++;pip install scipy==0.18.0 -U --no-cache-dir")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
-            # INSTALL SCIKIT-LEARN
-            logging.info('Installing scikit-learn')
-            (stdin, stdout, stderr) = ssh.exec_command("pip install scikit-learn==0.17.1 -U --no-cache-dir")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
-            # INSTALL nltk
-            logging.info('Installing nltk')
-            (stdin, stdout, stderr) = ssh.exec_command("pip install nltk==3.1 -U --no-cache-dir")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
-            # INSTALL GENSIM
-            logging.info('Installing gensim')
-            (stdin, stdout, stderr) = ssh.exec_command("cp /usr/lib64/python2.6/lib-dynload/bz2.so /usr/local/greenplum-db-4.3.9.1/ext/python/lib/python2.6/lib-dynload/bz2.so")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
-            (stdin, stdout, stderr) = ssh.exec_command("pip install gensim -U --no-cache-dir --no-dependencies")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
-
+            with SSHSessions.borrow(clusterNode, "gpadmin") as ssh:
+
+                # FIX FOR GENSIM
+                logging.info('Gensim fix')
+                (stdin, stdout, stderr) = ssh.exec_command("echo -e 'import sys\nsys.setdefaultencoding(\"utf-8\")' >> /usr/local/greenplum-db-4.3.9.1/ext/python/lib/python2.6/site-packages/sitecustomize.py")
+                RemoteOutput.capture(clusterNode, "installDSPackages", stdout, stderr)
+
+                # INSTALL PIP FOR GP-PYTHON
+                logging.info('Installing pip')
+                (stdin, stdout, stderr) = ssh.exec_command("wget https://bootstrap.pypa.io/get-pip.py -O /tmp/get-pip.py;python /tmp/get-pip.py --no-cache-dir")
+                RemoteOutput.capture(clusterNode, "installDSPackages", stdout, stderr)
+
+                # INSTALL NUMPY
+                logging.info('Installing numpy')
+                (stdin, stdout, stderr) = ssh.exec_command("pip install numpy==1.9.3 -U --no-cache-dir")
+                RemoteOutput.capture(clusterNode, "installDSPackages", stdout, stderr)
+
+                # INSTALL SCIPY
+                logging.info('Installing scipy')
+                (stdin, stdout, stderr) = ssh.exec_command("export CXX=/usr/bin/g++;pip install scipy==0.18.0 -U --no-cache-dir")
+                RemoteOutput.capture(clusterNode, "installDSPackages", stdout, stderr)
+
+                # INSTALL SCIKIT-LEARN
+                logging.info('Installing scikit-learn')
+                (stdin, stdout, stderr) = ssh.exec_command("pip install scikit-learn==0.17.1 -U --no-cache-dir")
+                RemoteOutput.capture(clusterNode, "installDSPackages", stdout, stderr)
+
+                # INSTALL nltk
+                logging.info('Installing nltk')
+                (stdin, stdout, stderr) = ssh.exec_command("pip install nltk==3.1 -U --no-cache-dir")
+                RemoteOutput.capture(clusterNode, "installDSPackages", stdout, stderr)
+
+                # INSTALL GENSIM
+                logging.info('Installing gensim')
+                (stdin, stdout, stderr) = ssh.exec_command("cp /usr/lib64/python2.6/lib-dynload/bz2.so /usr/local/greenplum-db-4.3.9.1/ext/python/lib/python2.6/lib-dynload/bz2.so")
+                RemoteOutput.capture(clusterNode, "installDSPackages", stdout, stderr)
+
+                (stdin, stdout, stderr) = ssh.exec_command("pip install gensim -U --no-cache-dir --no-dependencies")
+                RemoteOutput.capture(clusterNode, "installDSPackages", stdout, stderr)
             connected = True
+
         except Exception as e:
             print clusterNode["nodeName"] + ": Attempting SSH Connection"
             time.sleep(3)
@@ -309,11 +261,10 @@ def installDSPackages(clusterNode):
                 print "Failing Process"
                 exit()
         finally:
-            ssh.close()
             logging.info('installDSPackages Completed on: ' + str(clusterNode["nodeName"]))
 ###
 
-def setPaths(clusterNode):
+def setPaths(clusterNode, layout):
     logging.info('setPaths Started on: ' + str(clusterNode["nodeName"]))
     connected = False
     attemptCount = 0
@@ -321,29 +272,16 @@ def setPaths(clusterNode):
         try:
             attemptCount += 1
 
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + str(clusterNode["nodeName"]))
             logging.debug('SSH IP: ' + clusterNode["externalIP"] +
                           ' User: gpadmin')
-            ssh.connect(clusterNode["externalIP"], 22, "gpadmin", str(os.environ["GPADMIN_PW"]), timeout=120)
             logging.info('Setting up bashrc')
-            (stdin, stdout, stderr) = ssh.exec_command(
-                "echo 'source /usr/local/greenplum-db/greenplum_path.sh\n' >> ~/.bashrc")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            if 'yes' in os.environ["RAID0"]:
-                logging.info('Set MASTER_DATA_DIRECTORY to /data1/master/gpseg-1')
-                (stdin, stdout, stderr) = ssh.exec_command(
-                    "echo 'export MASTER_DATA_DIRECTORY=/data1/master/gpseg-1\n' >> ~/.bashrc")
-                logging.debug(stdout.readlines())
-                logging.debug(stderr.readlines())
-            else:
-                logging.info('Set MASTER_DATA_DIRECTORY to /data/disk1/master/gpseg-1')
-                (stdin, stdout, stderr) = ssh.exec_command(
-                    "echo 'export MASTER_DATA_DIRECTORY=/data/disk1/master/gpseg-1\n' >> ~/.bashrc")
-                logging.debug(stdout.readlines())
-                logging.debug(stderr.readlines())
+            masterDataDirectory = layout["masterDirectory"] + "/gpseg-1"
+            logging.info('Set MASTER_DATA_DIRECTORY to ' + masterDataDirectory)
+            RemoteBatch.runSteps(clusterNode, [
+                ("greenplumPath", "echo 'source /usr/local/greenplum-db/greenplum_path.sh\n' >> ~/.bashrc"),
+                ("masterDataDirectory", "echo 'export MASTER_DATA_DIRECTORY=" + masterDataDirectory + "\n' >> ~/.bashrc"),
+            ], "gpadmin")
             connected = True
         except Exception as e:
             print clusterNode["nodeName"] + ": Attempting SSH Connection"
@@ -355,7 +293,6 @@ def setPaths(clusterNode):
                 print "Failing Process"
                 exit()
         finally:
-            ssh.close()
             logging.info('setPaths Completed on: ' + str(clusterNode["nodeName"]))
 
 
@@ -363,7 +300,7 @@ def cleanUp(clusterDictionary):
     print "cleanUp"
 
 
-def makeDirectories(clusterNode):
+def makeDirectories(clusterNode, layout):
     logging.info('makeDirectories Started on: ' + str(clusterNode["nodeName"]))
     connected = False
     attemptCount = 0
@@ -371,66 +308,20 @@ def makeDirectories(clusterNode):
         try:
             attemptCount += 1
 
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + clusterNode["nodeName"])
             logging.debug('SSH IP: ' + clusterNode["externalIP"] + ' User: ' +
                           os.environ["SSH_USERNAME"] + ' Key: ' +
                           str(os.environ["CONFIGS_PATH"]) +
                           str(os.environ["SSH_KEY"]))
-            ssh.connect(clusterNode["externalIP"], 22, str(os.environ["SSH_USERNAME"]), None, pkey=None,
-                        key_filename=str(os.environ["CONFIGS_PATH"]) + str(os.environ["SSH_KEY"]),
-                        timeout=120)
-            if "master" in clusterNode["role"]:
-                if 'yes' in os.environ["RAID0"]:
-                    logging.info('Making /data1/master')
-                    (stdin, stdout, stderr) = ssh.exec_command("sudo mkdir -p /data1/master")
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-                    logging.info('Settings permissions for gpadmin on /data1/*')
-                    (stdin, stdout, stderr) = ssh.exec_command("sudo chown -R gpadmin: /data1")
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-                else:
-                    logging.info('Making /data/disk1/master as we have no RAID0 set')
-                    (stdin, stdout, stderr) = ssh.exec_command("sudo mkdir -p /data/disk1/master")
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-                    logging.info('Settings permissions for gpadmin on /data/disk1/*')
-                    (stdin, stdout, stderr) = ssh.exec_command("sudo chown -R gpadmin: /data/disk1/")
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-            else:
-                numDisks = os.environ["DISK_QTY"]
-                logging.debug('numDisks: ' + str(numDisks))
-                segDBs = os.environ["SEGMENTDBS"]
-                logging.debug('segmentdbs: ' + str(segDBs))
-                if 'yes' in os.environ["RAID0"]:
-                    logging.info('Making primary and mirror top level dirs and setting permissions with RAID0')
-                    for diskNum in range(1, int(numDisks) + 1):
-                        (stdin, stdout, stderr) = ssh.exec_command("sudo mkdir -p /data1/primary")
-                        logging.debug(stdout.readlines())
-                        logging.debug(stderr.readlines())
-                        (stdin, stdout, stderr) = ssh.exec_command("sudo mkdir -p /data1/mirror")
-                        logging.debug(stdout.readlines())
-                        logging.debug(stderr.readlines())
-                    (stdin, stdout, stderr) = ssh.exec_command("sudo chown -R gpadmin: /data1")
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-                else:
-                    logging.info('Making primary and mirror top level dirs and setting permissions with no RAID0')
-                    for diskNum in range(1, int(numDisks) + 1):
-                        (stdin, stdout, stderr) = ssh.exec_command("sudo mkdir -p /data/disk"+str(diskNum)+"/primary")
-                        logging.debug(stdout.readlines())
-                        logging.debug(stderr.readlines())
-                        (stdin, stdout, stderr) = ssh.exec_command("sudo mkdir -p /data/disk"+str(diskNum)+"/mirror")
-                        logging.debug(stdout.readlines())
-                        logging.debug(stderr.readlines())
-                    (stdin, stdout, stderr) = ssh.exec_command("sudo chown -R gpadmin: /data")
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-
+            (directories, owned) = SegmentLayout.hostDirectories(layout, clusterNode["role"])
+            logging.info('Making ' + " ".join(directories))
+            logging.info('Settings permissions for gpadmin on ' + " ".join(owned))
+            RemoteBatch.runSteps(clusterNode, [
+                ("mkdir", "sudo mkdir -p " + " ".join(directories)),
+                ("chown", "sudo chown -R gpadmin: " + " ".join(owned)),
+            ])
             connected = True
+
         except Exception as e:
             print clusterNode["nodeName"] + ": Attempting SSH Connection"
             time.sleep(3)
@@ -441,7 +332,6 @@ def makeDirectories(clusterNode):
                 print "Failing Process"
                 exit()
         finally:
-            ssh.close()
             logging.info('makeDirectories Completed on: ' + str(clusterNode["nodeName"]))
 
 
@@ -452,19 +342,16 @@ def setGPADMINPW(masterNode):
     while not connected:
         try:
             attemptCount += 1
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + str(masterNode["nodeName"]))
             logging.debug('SSH IP: ' + masterNode["externalIP"] +
                           ' User: gpadmin')
-            ssh.connect(masterNode["externalIP"], 22, "gpadmin", str(os.environ["GPADMIN_PW"]), timeout=120)
-            logging.info('Setting gpadmin password in DB')
-            (stdin, stdout, stderr) = ssh.exec_command(
-                "psql -c \"alter user gpadmin with password '" + str(os.environ["GPADMIN_PW"]) + "';\"")
-
-            # (stdin, stdout, stderr) = ssh.exec_command("alter user gpadmin with password '"+str(os.environ.get("GPADMIN_PW"))+ "';")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
+            with SSHSessions.borrow(masterNode, "gpadmin") as ssh:
+                logging.info('Setting gpadmin password in DB')
+                (stdin, stdout, stderr) = ssh.exec_command(
+                    "psql -c \"alter user gpadmin with password '" + str(os.environ["GPADMIN_PW"]) + "';\"")
+
+                # (stdin, stdout, stderr) = ssh.exec_command("alter user gpadmin with password '"+str(os.environ.get("GPADMIN_PW"))+ "';")
+                RemoteOutput.capture(masterNode, "setGPADMINPW", stdout, stderr)
             connected = True
         except Exception as e:
             print e
@@ -478,7 +365,6 @@ def setGPADMINPW(masterNode):
                 print "Failing Process"
                 exit()
         finally:
-            ssh.close()
             logging.info('setGPADMINPW Started on: ' + str(masterNode["nodeName"]))
 
 
@@ -490,21 +376,18 @@ def modifyPHGBA(masterNode):
     while not connected:
         try:
             attemptCount += 1
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + str(masterNode["nodeName"]))
             logging.debug('SSH IP: ' + masterNode["externalIP"] +
                           ' User: gpadmin')
-            ssh.connect(masterNode["externalIP"], 22, "gpadmin", str(os.environ["GPADMIN_PW"]), timeout=120)
-            #logging.info('allowing access')
-            #(stdin, stdout, stderr) = ssh.exec_command(
-             #   "echo 'host all gpadmin " + accessNode['internalIP'] + "/0 md5' >> /data/master/gpseg-1/pg_hba.conf")
-            #logging.debug(stdout.readlines())
-            #logging.debug(stderr.readlines())
-            logging.info('Restarting DB')
-            (stdin, stdout, stderr) = ssh.exec_command("gpstop -a -r")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
+            with SSHSessions.borrow(masterNode, "gpadmin") as ssh:
+                #logging.info('allowing access')
+                #(stdin, stdout, stderr) = ssh.exec_command(
+                 #   "echo 'host all gpadmin " + accessNode['internalIP'] + "/0 md5' >> /data/master/gpseg-1/pg_hba.conf")
+                #logging.debug(stdout.readlines())
+                #logging.debug(stderr.readlines())
+                logging.info('Restarting DB')
+                (stdin, stdout, stderr) = ssh.exec_command("gpstop -a -r")
+                RemoteOutput.capture(masterNode, "modifyPHGBA", stdout, stderr)
             connected = True
         except Exception as e:
             print masterNode["nodeName"] + ": Attempting SSH Connection"
@@ -516,7 +399,6 @@ def modifyPHGBA(masterNode):
                 print "Failing Process"
                 exit()
         finally:
-            ssh.close()
             logging.info('modifyPHGBA Completed on: ' + str(masterNode["nodeName"]))
 
 
@@ -528,32 +410,29 @@ def uncompressFiles(clusterNode, downloads):
         try:
             attemptCount += 1
 
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + clusterNode["nodeName"])
             logging.debug('SSH IP: ' + clusterNode["externalIP"] + ' User: ' +
                           os.environ["SSH_USERNAME"] + ' Key: ' +
                           str(os.environ["CONFIGS_PATH"]) +
                           str(os.environ["SSH_KEY"]))
-            ssh.connect(clusterNode["externalIP"], 22, str(os.environ["SSH_USERNAME"]), None, pkey=None,
-                        key_filename=str(os.environ["CONFIGS_PATH"]) + str(os.environ["SSH_KEY"]), timeout=120)
             logging.info('Unzipping files')
+            steps = []
+            # Archives already unpacked by a streaming download leave a marker and are skipped
             for file in downloads:
+                marker = DownloadEngine.extractMarker(file["NAME"])
                 if ".zip" in file["NAME"]:
-                    (stdin, stdout, stderr) = ssh.exec_command("cd /tmp;unzip ./" + file["NAME"])
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
+                    steps.append(("unzip", "[ -f " + marker + " ] || (cd /tmp && unzip -qo ./" + file["NAME"] +
+                                  " && touch " + marker + ")"))
                 elif ".gz" in file["NAME"]:
-                    (stdin, stdout, stderr) = ssh.exec_command("cd /tmp;tar xvfz ./" + file["NAME"])
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
+                    steps.append(("untar", "[ -f " + marker + " ] || (cd /tmp && tar -I pigz -xf ./" + file["NAME"] +
+                                  " && touch " + marker + ")"))
             if os.environ["GPDB_BUILD"]:
                 logging.info('Unzipping pre-release build')
-                (stdin, stdout, stderr) = ssh.exec_command("cd /tmp;unzip ./" + os.path.basename(str(os.environ["GPDB_BUILD"])))
-                logging.debug(stdout.readlines())
-                logging.debug(stderr.readlines())
-
+                steps.append(("unzipBuild", "cd /tmp && unzip -qo ./" + os.path.basename(str(os.environ["GPDB_BUILD"]))))
+            if steps:
+                RemoteBatch.runSteps(clusterNode, steps)
             connected = True
+
         except Exception as e:
             print clusterNode["nodeName"] + ": Attempting SSH Connection"
             time.sleep(3)
@@ -564,7 +443,6 @@ def uncompressFiles(clusterNode, downloads):
                 print "Failing Process"
                 exit()
         finally:
-            ssh.close()
             logging.info('uncompressFiles Completed on: ' + str(clusterNode["nodeName"]))
 
 
@@ -576,33 +454,21 @@ def prepFiles(clusterNode):
         try:
             attemptCount += 1
 
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + clusterNode["nodeName"])
             logging.debug('SSH IP: ' + clusterNode["externalIP"] + ' User: ' +
                           os.environ["SSH_USERNAME"] + ' Key: ' +
                           str(os.environ["CONFIGS_PATH"]) +
                           str(os.environ["SSH_KEY"]))
-            ssh.connect(clusterNode["externalIP"], 22, str(os.environ["SSH_USERNAME"]), None, pkey=None,
-                        key_filename=str(os.environ["CONFIGS_PATH"]) + str(os.environ["SSH_KEY"]), timeout=120)
             logging.info('Preparing GPDB Install Binary')
-            (stdin, stdout, stderr) = ssh.exec_command("sudo sed -i 's/more <</cat <</g' /tmp/greenplum-db*.bin")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            (stdin, stdout, stderr) = ssh.exec_command("sudo sed -i 's/agreed=/agreed=1/' /tmp/greenplum-db*.bin")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
-            (stdin, stdout, stderr) = ssh.exec_command(
-                "sudo sed -i 's/pathVerification=/pathVerification=1/' /tmp/greenplum-db*.bin")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            (stdin, stdout, stderr) = ssh.exec_command(
-                "sudo sed -i 's/user_specified_installPath=/user_specified_installPath=${installPath}/' /tmp/greenplum-db*.bin")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
+            RemoteBatch.runSteps(clusterNode, [
+                ("more", "sudo sed -i 's/more <</cat <</g' /tmp/greenplum-db*.bin"),
+                ("agreed", "sudo sed -i 's/agreed=/agreed=1/' /tmp/greenplum-db*.bin"),
+                ("pathVerification", "sudo sed -i 's/pathVerification=/pathVerification=1/' /tmp/greenplum-db*.bin"),
+                ("installPath",
+                 "sudo sed -i 's/user_specified_installPath=/user_specified_installPath=${installPath}/' /tmp/greenplum-db*.bin"),
+            ])
             connected = True
+
         except Exception as e:
             print clusterNode["nodeName"] + ": Attempting SSH Connection"
             time.sleep(3)
@@ -613,7 +479,6 @@ def prepFiles(clusterNode):
                 print "Failing Process"
                 exit()
         finally:
-            ssh.close()
             logging.info('prepFiles Completed on: ' + str(clusterNode["nodeName"]))
 
 
@@ -625,31 +490,18 @@ def installBits(clusterNode):
         try:
             attemptCount += 1
 
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + clusterNode["nodeName"])
             logging.debug('SSH IP: ' + clusterNode["externalIP"] + ' User: ' +
                           os.environ["SSH_USERNAME"] + ' Key: ' +
                           str(os.environ["CONFIGS_PATH"]) +
                           str(os.environ["SSH_KEY"]))
-            ssh.connect(clusterNode["externalIP"], 22, str(os.environ["SSH_USERNAME"]), None, pkey=None,
-                        key_filename=str(os.environ["CONFIGS_PATH"]) + str(os.environ["SSH_KEY"]),
-                        timeout=120)
             logging.info('Installing GPDB')
-            (stdin, stdout, stderr) = ssh.exec_command("sudo /tmp/greenplum-db*.bin")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            (stdin, stdout, stderr) = ssh.exec_command("sudo chown -R gpadmin: /usr/local/greenplum-db*")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-
-            # Go ahead and change owner on Data Disk(s).   Only One now, but change this if more disks are added.
-            # (stdin, stdout, stderr) = ssh.exec_command("sudo mkdir -p /data/master;sudo chown -R gpadmin: /data")
-            # I believe these need to be commented as the command got commented
-            # stdout.readlines()
-            # stderr.readlines()
-
+            RemoteBatch.runSteps(clusterNode, [
+                ("install", "sudo /tmp/greenplum-db*.bin"),
+                ("chown", "sudo chown -R gpadmin: /usr/local/greenplum-db*"),
+            ])
             connected = True
+
         except Exception as e:
             print clusterNode["nodeName"] + ": Attempting SSH Connection"
             time.sleep(3)
@@ -660,69 +512,30 @@ def installBits(clusterNode):
                 print "Failing Process"
                 exit()
         finally:
-            ssh.close()
             logging.info('installBits Completed on: ' + str(clusterNode["nodeName"]))
 
 
-def initDB(clusterNode, clusterName):
+def initDB(clusterNode, clusterDictionary):
+    clusterName = clusterDictionary["clusterName"]
     logging.info('initDB Started on: ' + str(clusterNode["nodeName"]))
-    # Read the template, modify it, write it to the cluster directory and the master
-
-    ## BUILD DATA DIRECTORY AND MIRROR DIRECTORY
-    # SHOULD BE #SEGDB ENTRIES ACROSS # DRIVES.
-    logging.debug('CAPE_HOME: ' + str(os.environ["CAPE_HOME"]))
-    logging.debug('Current Dir: ' + os.getcwd())
-    numDisks = os.environ["DISK_QTY"]
-    logging.debug('numDisks: ' + str(numDisks))
-    segDBs = os.environ["SEGMENTDBS"]
-    logging.debug('segDBs: ' + str(segDBs))
-    diskBase = os.environ["BASE_HOME"]
-    logging.debug('diskBase: ' + diskBase)
-    dataDirectories = ""
-    mirrorDirectories = ""
-
-    if int(numDisks) > 1:
-        # Spread Primaries and mirrors across all drives
-        segDBDirs = (int(segDBs)/int(numDisks))
-        logging.debug('segDBDirs: '+ str(segDBDirs))
-    else:
-        # We only have one drive so no spreading of primaries and mirrors
-        segDBDirs = int(segDBs)
-        logging.debug('segDBDirs: ' + str(segDBDirs))
-
-    for diskNum in range(1, int(numDisks)+1):
-        for segNum in range(1, int(segDBDirs)+1):
-            if 'yes' in os.environ["RAID0"]:
-                dataDirectories = dataDirectories + "/data1/primary "
-                if 'yes' in os.environ["MIRRORS"]:
-                    mirrorDirectories = mirrorDirectories + "/data1/mirror "
-            else:
-                dataDirectories = dataDirectories + diskBase+"/disk" +\
-                    str(diskNum) + "/primary "
-                if 'yes' in os.environ["MIRRORS"]:
-                    mirrorDirectories = mirrorDirectories + diskBase+"/disk" +\
-                        str(diskNum)+"/mirror "
-    logging.debug('dataDirectories: ' + dataDirectories)
-    logging.debug('mirrorDirectories: ' + mirrorDirectories)
-
-    with open(str(os.environ["CAPE_HOME"])+"/templates/gpinitsystem_config.template", 'r+') as gpConfigTemplate:
-        gpConfigTemplateData = gpConfigTemplate.read()
-        gpConfigTemplateModData = gpConfigTemplateData.replace("%MASTER%", clusterNode["nodeName"])
-        if 'yes' in os.environ["RAID0"]:
-            gpConfigTemplateMasterDir = gpConfigTemplateModData.replace("MASTER_DIRECTORY=/data/disk1/master","MASTER_DIRECTORY=/data1/master")
-        else:
-            # Basically no replacement but doing this to make coede readable and work smoothly
-            gpConfigTemplateMasterDir = gpConfigTemplateModData.replace("MASTER_DIRECTORY=/data/disk1/master","MASTER_DIRECTORY=/data/disk1/master")
-        gpConfigDirectoriesData = gpConfigTemplateMasterDir.replace("declare -a DATA_DIRECTORY=(/data/primary /data/primary)","declare -a DATA_DIRECTORY=("+dataDirectories+")")
-
-        if 'yes' in os.environ["MIRRORS"]:
-            gpConfigTemplateData = gpConfigDirectoriesData + '\n#### MIRROR PARAMETERS\n' \
-                                                           + 'MIRROR_PORT_BASE=5000\n' \
-                                                           + 'REPLICATION_PORT_BASE=41000\n' \
-                                                           + 'MIRROR_REPLICATION_PORT_BASE=51000\n' \
-                                                           + 'declare -a MIRROR_DATA_DIRECTORY=(%s)\n' % mirrorDirectories
-        else:
-            gpConfigTemplateData = gpConfigDirectoriesData
+    # gpinitsystem_config comes from the same layout makeDirectories created
+    segmentHosts = [node for node in clusterDictionary["clusterNodes"]
+                    if not any(role in node["role"] for role in ["master", "access"])]
+    layout = SegmentLayout.fromCluster(clusterDictionary, len(segmentHosts))
+    print clusterName + ": Segment Layout: " + SegmentLayout.describe(layout)
+    logging.info('Segment layout: ' + json.dumps(layout))
+
+    with open(str(os.environ["CAPE_HOME"])+"/templates/gpinitsystem_config.template", 'r') as gpConfigTemplate:
+        gpConfigTemplateData = SegmentLayout.gpinitsystemConfig(layout, clusterNode["nodeName"],
+                                                                gpConfigTemplate.read())
+    # GUCs go in at init time, gpinitsystem -p and MASTER_MAX_CONNECT
+    tuning = None
+    if GUCProfiles.profileName() != "none":
+        tuning = GUCProfiles.fromEnvironment(GUCProfiles.profileName(), layout)
+        print clusterName + ": GUC Profile: " + GUCProfiles.describe(tuning)
+        logging.info('GUC profile: ' + json.dumps(tuning))
+        gucsFile = GUCProfiles.save(tuning, clusterName)
+        gpConfigTemplateData = GUCProfiles.gpinitsystemConfig(tuning, gpConfigTemplateData)
 
     with open(os.environ["CAPE_HOME"] + "/clusterConfigs/" + str(clusterName) + "/gpinitsystem_config",
               'w') as gpConfigCluster:
@@ -734,42 +547,25 @@ def initDB(clusterNode, clusterName):
     while not connected:
         try:
             attemptCount += 1
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + clusterNode["nodeName"])
             logging.debug('SSH IP: ' + clusterNode["externalIP"] + ' User: ' +
                           os.environ["SSH_USERNAME"] + ' Key: ' +
                           str(os.environ["CONFIGS_PATH"]) +
                           str(os.environ["SSH_KEY"]))
-            ssh.connect(clusterNode["externalIP"], 22, os.environ["SSH_USERNAME"], None, pkey=None,
-                        key_filename=str(os.environ["CONFIGS_PATH"]) + str(os.environ["SSH_KEY"]),
-                        timeout=120)
-            logging.info('Uploading gpinitsystem_config.cape file')
-            sftp = ssh.open_sftp()
-            sftp.put("gpinitsystem_config", "/tmp/gpinitsystem_config.cape", confirm=True)
-            if 'yes' in os.environ["SET_GUCS"]:
-                # Upload GUCS file
-                logging.info('Uploading /templates/set_specific_GUCs.cape file')
-                sftp.put(os.environ["CAPE_HOME"] +
-                         "/templates/set_specific_GUCs.cape",
-                         "/tmp/set_specific_GUCs.sh", confirm=True)
-                logging.info('Making /tmp/set_specific_GUCs.sh executable')
-                (stdin, stdout, stderr) = ssh.exec_command("sudo chmod +x " +
-                                                           "/tmp/set_specific_GUCs.sh")
-                logging.debug(stdout.readlines())
-                logging.debug(stderr.readlines())
-                logging.info('Making gpadmin own /tmp/set_specific_GUCs.sh')
+            with SSHSessions.borrow(clusterNode) as ssh:
+                logging.info('Uploading gpinitsystem_config.cape file')
+                sftp = ssh.open_sftp()
+                Trace.put(sftp, clusterNode, os.environ["CAPE_HOME"] + "/clusterConfigs/" + str(clusterName) +
+                          "/gpinitsystem_config", "/tmp/gpinitsystem_config.cape")
+                if tuning is not None:
+                    Trace.put(sftp, clusterNode, gucsFile, GUCProfiles.PARAMS_FILE)
+                sftp.close()
+                # setting gpadmin as owner for gpinitsystem_config.cape
                 (stdin, stdout, stderr) = ssh.exec_command("sudo chown " +
                                                            "gpadmin:gpadmin " +
-                                                           "/tmp/set_specific_GUCs.sh")
-                logging.debug(stdout.readlines())
-                logging.debug(stderr.readlines())
-            # setting gpadmin as owner for gpinitsystem_config.cape
-            (stdin, stdout, stderr) = ssh.exec_command("sudo chown " +
-                                                       "gpadmin:gpadmin " +
-                                                       "/tmp/gpinitsystem_config.cape")
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
+                                                           "/tmp/gpinitsystem_config.cape" +
+                                                           (" " + GUCProfiles.PARAMS_FILE if tuning else ""))
+                RemoteOutput.capture(clusterNode, "initDB", stdout, stderr)
             connected = True
         except Exception as e:
             print clusterNode["nodeName"] + ": Attempting SSH Connection"
@@ -780,8 +576,6 @@ def initDB(clusterNode, clusterName):
                 logging.debug('Failed')
                 print "Failing Process"
                 exit()
-        finally:
-            ssh.close()
 
     connected = False
     attemptCount = 0
@@ -789,56 +583,40 @@ def initDB(clusterNode, clusterName):
     while not connected:
         try:
             attemptCount += 1
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + str(clusterNode["nodeName"]))
             logging.debug('SSH IP: ' + clusterNode["externalIP"] +
                           ' User: gpadmin')
-            ssh.connect(clusterNode["externalIP"], 22, "gpadmin", str(os.environ["GPADMIN_PW"]), timeout=120)
-            #
-            # Adding gpssh-exkeys here for now
-            # We need to figure out the key exchange and then remove this step
-            #
-            # (stdin, stdout, stderr) = ssh.exec_command(
-            #     "source /usr/local/greenplum-db/greenplum_path.sh;gpssh-exkeys -f /tmp/workers")
-            # stdout.readlines()
-            # stderr.readlines()
-            logging.info('Starting DB init')
-            (stdin, stdout, stderr) = ssh.exec_command(
-                "source /usr/local/greenplum-db/greenplum_path.sh;gpinitsystem -c /tmp/gpinitsystem_config.cape -a")
-            return_code = stdout.channel.recv_exit_status()
-            logging.debug(stdout.readlines())
-            logging.debug(stderr.readlines())
-            if return_code != 0:
-                logging.info('InitDB Failed')
-                logging.debug('InitDB returned: ' + str(return_code))
-                print('InitDB Failed with return Code: ' + str(return_code))
-                sys.exit('Look at your DEBUG log file for details.')
-            if 'yes' in os.environ["SET_GUCS"]:
+            with SSHSessions.borrow(clusterNode, "gpadmin") as ssh:
+                #
+                # Adding gpssh-exkeys here for now
+                # We need to figure out the key exchange and then remove this step
+                #
+                # (stdin, stdout, stderr) = ssh.exec_command(
+                #     "source /usr/local/greenplum-db/greenplum_path.sh;gpssh-exkeys -f /tmp/workers")
+                # stdout.readlines()
+                # stderr.readlines()
+                logging.info('Starting DB init')
                 (stdin, stdout, stderr) = ssh.exec_command(
-                    "source /usr/local/greenplum-db/greenplum_path.sh;/tmp/set_specific_GUCs.sh")
-                return_code = stdout.channel.recv_exit_status()
-                logging.debug(stdout.readlines())
-                logging.debug(stderr.readlines())
+                    "source /usr/local/greenplum-db/greenplum_path.sh;gpinitsystem -c /tmp/gpinitsystem_config.cape -a" +
+                    SegmentLayout.gpinitsystemOptions(layout) + GUCProfiles.gpinitsystemOptions(tuning))
+                return_code = RemoteOutput.capture(clusterNode, "initDB", stdout, stderr).returnCode
                 if return_code != 0:
-                    logging.info('Settings GUCS Failed')
-                    logging.debug('Setting GUCS returned: ' + str(return_code))
-                    print('Setting GUCS Failed with return Code: ' + str(return_code))
-                    print('Look at your DEBUG log file for details. Will Continue.')
-                elif return_code == 0:
-                    logging.info('GUCS set. Restarting GPDB')
+                    logging.info('InitDB Failed')
+                    logging.debug('InitDB returned: ' + str(return_code))
+                    print('InitDB Failed with return Code: ' + str(return_code))
+                    sys.exit('Look at your DEBUG log file for details.')
+                if tuning is not None:
+                    # The profile's concurrency, statement_mem assumes no more statements run at once
                     (stdin, stdout, stderr) = ssh.exec_command(
-                        "source /usr/local/greenplum-db/greenplum_path.sh;gpstop -ar")
-                    return_code = stdout.channel.recv_exit_status()
-                    logging.debug(stdout.readlines())
-                    logging.debug(stderr.readlines())
-                    if return_code !=0:
-                        logging.info('Restart GPDB failed')
-                        logging.debug('Restart GPDB returned: ' + str(return_code))
-                        print('Restart GPDB Failed with return Code: ' + str(return_code))
+                        "source /usr/local/greenplum-db/greenplum_path.sh;" + GUCProfiles.queueCommand(tuning))
+                    return_code = RemoteOutput.capture(clusterNode, "initDB", stdout, stderr).returnCode
+                    if return_code != 0:
+                        logging.info('Setting resource queue failed')
+                        logging.debug('Setting resource queue returned: ' + str(return_code))
+                        print('Setting Resource Queue Failed with return Code: ' + str(return_code))
                         print('Look at your DEBUG log file for details. Will Continue.')
-
             connected = True
+
         except Exception as e:
             print clusterNode["nodeName"] + ": Attempting SSH Connection"
             time.sleep(3)
@@ -849,5 +627,4 @@ def initDB(clusterNode, clusterName):
                 print "Failing InitDB Process"
                 exit()
         finally:
-            ssh.close()
             logging.info('initDB Completed on: ' + str(clusterNode["nodeName"]))
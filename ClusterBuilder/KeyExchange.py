@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+import traceback
+import logging
+import paramiko
+
+import BuildBudget
+import RemoteOutput
+import SSHSessions
+
+# Controller driven key exchange.
+# The controller owns the gpadmin and root keypairs for a cluster, builds one
+# authorized_keys and one known_hosts for the whole cluster and pushes them to
+# every node in parallel.  Each node costs one read (host keys) and one write
+# (all key material for both users) instead of 6 remote commands per peer.
+# Either round raises unless it succeeded on every node, so a cluster with a
+# node left without keys is never journaled as keyShare done.  Only failed
+# connections are retried, a key script that exits non-zero fails the node.
+
+KEY_USERS = ["gpadmin", "root"]
+HOST_KEY_TYPES = ("ssh-", "ecdsa-")
+
+
+def distributeKeys(clusterDictionary):
+    logging.debug('distributeKeys Started')
+    print clusterDictionary["clusterName"] + ": Distributing SSH Keys"
+    clusterPath = str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterDictionary["clusterName"]
+    keys = {}
+    for user in KEY_USERS:
+        keys[user] = loadOrGenerateKey(clusterPath, user)
+
+    hostKeys = {}
+    runOnNodes(clusterDictionary["clusterNodes"], collectHostKeys, hostKeys)
+
+    knownHosts = buildKnownHosts(clusterDictionary["clusterNodes"], hostKeys)
+    with open(clusterPath + "/known_hosts", "w") as knownHostsFile:
+        knownHostsFile.write(knownHosts)
+    logging.debug('Wrote known_hosts with ' + str(len(knownHosts.splitlines())) + ' entries')
+
+    runOnNodes(clusterDictionary["clusterNodes"], pushKeys, keys, knownHosts)
+    logging.debug('distributeKeys Completed')
+
+
+def runOnNodes(clusterNodes, function, *args):
+    # function(clusterNode, *args) on every node in parallel, raises unless it returned True everywhere
+    results = {}
+    threads = []
+    for clusterNode in clusterNodes:
+        nodeThread = threading.Thread(target=runOnNode, args=(results, function, clusterNode) + args)
+        threads.append(nodeThread)
+        nodeThread.start()
+    for x in threads:
+        x.join()
+    failed = [clusterNode["nodeName"] for clusterNode in clusterNodes if not results.get(clusterNode["nodeName"])]
+    if failed:
+        raise Exception(function.__name__ + " failed on " + ",".join(failed))
+
+
+def runOnNode(results, function, clusterNode, *args):
+    try:
+        results[clusterNode["nodeName"]] = BuildBudget.run(function, clusterNode, *args)
+    except Exception as e:
+        logging.error(clusterNode["nodeName"] + ': ' + function.__name__ + ' failed: ' + str(e))
+        logging.debug(traceback.format_exc())
+        results[clusterNode["nodeName"]] = False
+
+
+def loadOrGenerateKey(clusterPath, user):
+    # Keys live with the cluster config so a rerun reuses the same identity
+    keyPath = clusterPath + "/" + user + "_id_rsa"
+    if os.path.isfile(keyPath):
+        logging.debug('Loading existing key: ' + keyPath)
+        key = paramiko.RSAKey.from_private_key_file(keyPath)
+    else:
+        logging.debug('Generating key: ' + keyPath)
+        key = paramiko.RSAKey.generate(2048)
+        key.write_private_key_file(keyPath)
+    publicKey = key.get_name() + " " + key.get_base64() + " " + user + "@" + os.path.basename(clusterPath)
+    with open(keyPath + ".pub", "w") as publicKeyFile:
+        publicKeyFile.write(publicKey + "\n")
+    with open(keyPath, "r") as privateKeyFile:
+        privateKey = privateKeyFile.read()
+    return {"private": privateKey, "public": publicKey}
+
+
+def collectHostKeys(clusterNode, hostKeys):
+    logging.debug('collectHostKeys Started on: ' + clusterNode["nodeName"])
+    connected = False
+    attemptCount = 0
+    while not connected:
+        try:
+            attemptCount += 1
+            with SSHSessions.borrow(clusterNode) as ssh:
+                (stdin, stdout, stderr) = ssh.exec_command("cat /etc/ssh/ssh_host_*key.pub")
+                lines = RemoteOutput.capture(clusterNode, "hostKeys", stdout, stderr, HOST_KEY_TYPES).kept
+            hostKeys[clusterNode["nodeName"]] = [" ".join(line.split()[0:2]) for line in lines if line.strip()]
+            connected = True
+        except Exception as e:
+            print "     " + clusterNode["nodeName"] + ": Attempting SSH Connection"
+            time.sleep(3)
+            if attemptCount > 40:
+                logging.debug('Exception: ' + str(e))
+                logging.debug(traceback.format_exc())
+                logging.debug('Failed')
+                return False
+    logging.debug('collectHostKeys Completed on: ' + clusterNode["nodeName"])
+    return True
+
+
+def buildKnownHosts(clusterNodes, hostKeys):
+    # One line per host key covering every name the cluster uses for a node
+    knownHosts = ""
+    for clusterNode in clusterNodes:
+        names = [clusterNode["internalIP"], clusterNode["nodeName"]]
+        if clusterNode.get("FQDN") and clusterNode["FQDN"] not in names:
+            names.append(clusterNode["FQDN"])
+        for hostKey in hostKeys.get(clusterNode["nodeName"], []):
+            knownHosts = knownHosts + ",".join(names) + " " + hostKey + "\n"
+    return knownHosts
+
+
+def buildKeyScript(keys, knownHosts):
+    script = "set -e\n"
+    for user in KEY_USERS:
+        script = script + "HOMEDIR=$(getent passwd " + user + " | cut -d: -f6)\n"
+        script = script + "mkdir -p $HOMEDIR/.ssh\n"
+        script = script + "cat > $HOMEDIR/.ssh/id_rsa <<'CAPE_EOF'\n" + keys[user]["private"].strip() + "\nCAPE_EOF\n"
+        script = script + "cat > $HOMEDIR/.ssh/id_rsa.pub <<'CAPE_EOF'\n" + keys[user]["public"] + "\nCAPE_EOF\n"
+        script = script + "cat > $HOMEDIR/.ssh/known_hosts <<'CAPE_EOF'\n" + knownHosts + "CAPE_EOF\n"
+        script = script + "touch $HOMEDIR/.ssh/authorized_keys\n"
+        script = script + "grep -qxF '" + keys[user]["public"] + "' $HOMEDIR/.ssh/authorized_keys || " \
+                          "echo '" + keys[user]["public"] + "' >> $HOMEDIR/.ssh/authorized_keys\n"
+        script = script + "grep -q 'StrictHostKeyChecking' $HOMEDIR/.ssh/config 2>/dev/null || " \
+                          "printf 'Host *\\nStrictHostKeyChecking no\\n' >> $HOMEDIR/.ssh/config\n"
+        script = script + "chmod 700 $HOMEDIR/.ssh\n"
+        script = script + "chmod 600 $HOMEDIR/.ssh/id_rsa $HOMEDIR/.ssh/authorized_keys $HOMEDIR/.ssh/known_hosts\n"
+        script = script + "chmod 400 $HOMEDIR/.ssh/config\n"
+        script = script + "chown -R " + user + ": $HOMEDIR/.ssh\n"
+    return script
+
+
+def pushKeys(clusterNode, keys, knownHosts):
+    logging.debug('pushKeys Started on: ' + clusterNode["nodeName"])
+    script = buildKeyScript(keys, knownHosts)
+    connected = False
+    attemptCount = 0
+    while not connected:
+        # Only a failed connection is retried, the script's own exit code is final
+        try:
+            attemptCount += 1
+            with SSHSessions.borrow(clusterNode) as ssh:
+                (stdin, stdout, stderr) = ssh.exec_command("sudo sh -s")
+                stdin.write(script)
+                stdin.flush()
+                stdin.channel.shutdown_write()
+                output = RemoteOutput.capture(clusterNode, "pushKeys", stdout, stderr)
+            connected = True
+        except Exception as e:
+            print "     " + clusterNode["nodeName"] + ": Attempting SSH Connection"
+            time.sleep(3)
+            if attemptCount > 40:
+                logging.debug('Exception: ' + str(e))
+                logging.debug(traceback.format_exc())
+                logging.debug('Failed')
+                return False
+    if output.returnCode != 0:
+        logging.error(clusterNode["nodeName"] + ': Key push returned: ' + str(output.returnCode) + ', see ' + output.path)
+        return False
+    logging.debug('pushKeys Completed on: ' + clusterNode["nodeName"])
+    return True
@@ -0,0 +1,154 @@
+import errno
+import random
+import select
+import socket
+import threading
+import time
+import logging
+
+import SSHSessions
+
+# Readiness probing for cluster nodes.
+# A node is probed in three stages, cheapest first: a non-blocking TCP connect
+# to the SSH port, a read of the SSH banner and finally an authenticated command on
+# the pooled session.  A failed stage backs off exponentially with jitter, so
+# a booting node costs a few SYNs instead of a full handshake every 3 seconds.
+
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 15.0
+
+
+def backoffDelay(attempt):
+    # Exponential backoff with jitter so a whole cluster does not probe in lockstep
+    delay = min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def probeTCP(host, timeout=3):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(0)
+    try:
+        result = sock.connect_ex((host, SSHSessions.sshPort()))
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            return False
+        (readable, writable, errored) = select.select([], [sock], [sock], timeout)
+        if not writable:
+            return False
+        return sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+    finally:
+        sock.close()
+
+
+def probeBanner(host, timeout=5):
+    try:
+        sock = socket.create_connection((host, SSHSessions.sshPort()), timeout)
+    except (socket.error, socket.timeout):
+        return False
+    try:
+        return sock.recv(64).startswith("SSH-")
+    except (socket.error, socket.timeout):
+        return False
+    finally:
+        sock.close()
+
+
+def probeAuth(clusterNode, user=None):
+    # The provisioning user also needs working sudo before we hand the node over
+    if user is None:
+        command = "sudo -n true"
+    else:
+        command = "true"
+    try:
+        with SSHSessions.borrow(clusterNode, user, timeout=30) as ssh:
+            (stdin, stdout, stderr) = ssh.exec_command(command)
+            return stdout.channel.recv_exit_status() == 0
+    except Exception as e:
+        logging.debug(clusterNode["nodeName"] + ': Auth probe failed: ' + str(e))
+        SSHSessions.invalidateSession(clusterNode, user)
+        return False
+
+
+def waitForNode(clusterNode, user=None, timeout=600):
+    # Returns seconds until the node accepted an authenticated command, None on timeout
+    startTime = time.time()
+    attempt = 0
+    stage = "tcp"
+    while time.time() - startTime < timeout:
+        if probeTCP(clusterNode["externalIP"]):
+            stage = "banner"
+            if probeBanner(clusterNode["externalIP"]):
+                stage = "auth"
+                if probeAuth(clusterNode, user):
+                    readyTime = time.time() - startTime
+                    logging.debug(clusterNode["nodeName"] + ': Ready in ' + str(round(readyTime, 1)) + 's')
+                    return readyTime
+        logging.debug(clusterNode["nodeName"] + ': Not ready at stage ' + stage + ' attempt ' + str(attempt))
+        time.sleep(backoffDelay(attempt))
+        attempt += 1
+    logging.error(clusterNode["nodeName"] + ': Not ready after ' + str(timeout) + 's at stage ' + stage)
+    return None
+
+
+def bootID(clusterNode, user=None):
+    # Changes on every boot, so a reboot is over when it no longer matches
+    with SSHSessions.borrow(clusterNode, user, timeout=30) as ssh:
+        (stdin, stdout, stderr) = ssh.exec_command("cat /proc/sys/kernel/random/boot_id")
+        return stdout.read().strip()
+
+
+def waitForReboot(clusterNode, oldBootID, user=None, timeout=600):
+    # Returns seconds until the node answered with a new boot id, None on timeout.
+    # A still running sshd answers with the old id and is simply probed again.
+    startTime = time.time()
+    attempt = 0
+    while time.time() - startTime < timeout:
+        if waitForNode(clusterNode, user, timeout - (time.time() - startTime)) is None:
+            break
+        try:
+            if bootID(clusterNode, user) not in ["", oldBootID]:
+                rebootTime = time.time() - startTime
+                logging.debug(clusterNode["nodeName"] + ': Rebooted in ' + str(round(rebootTime, 1)) + 's')
+                return rebootTime
+        except Exception as e:
+            logging.debug(clusterNode["nodeName"] + ': Boot id read failed: ' + str(e))
+        SSHSessions.invalidate(clusterNode)
+        time.sleep(backoffDelay(attempt))
+        attempt += 1
+    logging.error(clusterNode["nodeName"] + ': No new boot id ' + str(timeout) + 's after reboot')
+    return None
+
+
+def waitForCluster(clusterName, clusterNodes, user=None, timeout=600):
+    # Probe every node at once and report each node's time-to-ready
+    logging.debug('waitForCluster Started for ' + str(len(clusterNodes)) + ' Nodes')
+    readyTimes = {}
+    threads = []
+
+    def probeNode(clusterNode):
+        readyTimes[clusterNode["nodeName"]] = waitForNode(clusterNode, user, timeout)
+
+    for clusterNode in clusterNodes:
+        probeThread = threading.Thread(target=probeNode, args=(clusterNode,))
+        threads.append(probeThread)
+        probeThread.start()
+    for x in threads:
+        x.join()
+
+    notReady = sorted([name for name, readyTime in readyTimes.items() if readyTime is None])
+    if notReady:
+        print clusterName + ": Nodes not reachable: " + ",".join(notReady)
+        logging.error('Nodes not reachable: ' + ",".join(notReady))
+        return readyTimes
+    if not readyTimes:
+        print clusterName + ": No Nodes to Wait For"
+        return readyTimes
+    slowest = max(readyTimes, key=readyTimes.get)
+    print clusterName + ": " + str(len(readyTimes)) + " Nodes Ready (slowest " + slowest + ": " + \
+        str(round(readyTimes[slowest], 1)) + "s)"
+    for name in sorted(readyTimes):
+        logging.info(name + ': Time to ready ' + str(round(readyTimes[name], 1)) + 's')
+    return readyTimes
+
+
+def allReady(readyTimes):
+    return None not in readyTimes.values()
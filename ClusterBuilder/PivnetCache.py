@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+
+# PivNet metadata cache.
+# Product, release and release detail responses are kept on disk under
+# CAPE_HOME/.pivnetCache with their ETag and Last-Modified headers.  A fresh
+# entry (younger than PIVNET_CACHE_TTL seconds) is used without touching the
+# network, a stale one is revalidated with a conditional GET, so a create after
+# `cape stage` spends no time on PivNet discovery.  All calls share one pooled
+# HTTP session.  PIVNET_URL points the cache at another server (e.g. a local
+# fake PivNet for testing).  Resolved releases are also kept in memory, and
+# concurrent builds in one process asking for the same product wait on the
+# first resolution instead of all missing the disk cache at once.
+
+DEFAULT_URL = "https://network.pivotal.io"
+DEFAULT_TTL = 3600
+
+_session = None
+_lock = threading.Lock()
+_releases = {}
+_releaseLocks = {}
+
+
+def session():
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=3)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def baseURL():
+    return os.environ.get("PIVNET_URL", DEFAULT_URL).rstrip("/")
+
+
+def cacheTTL():
+    return int(os.environ.get("PIVNET_CACHE_TTL", DEFAULT_TTL))
+
+
+def cacheDir():
+    path = str(os.environ["CAPE_HOME"]) + "/.pivnetCache"
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def entryPath(url):
+    return cacheDir() + "/" + hashlib.sha1(url).hexdigest() + ".json"
+
+
+def loadEntry(url):
+    try:
+        with open(entryPath(url), "r") as entryFile:
+            return json.load(entryFile)
+    except (IOError, ValueError):
+        return None
+
+
+def storeEntry(url, entry):
+    # Write to a temp file and rename so a concurrent reader never sees half an entry
+    path = entryPath(url)
+    tempPath = path + "." + str(os.getpid()) + "." + str(threading.current_thread().ident)
+    with open(tempPath, "w") as entryFile:
+        json.dump(entry, entryFile)
+    os.rename(tempPath, path)
+
+
+def getJSON(url, headers=None, ttl=None):
+    if ttl is None:
+        ttl = cacheTTL()
+    entry = loadEntry(url)
+    if entry is not None and time.time() - entry["fetched"] < ttl:
+        logging.debug('PivNet cache hit: ' + url)
+        return entry["body"]
+
+    requestHeaders = dict(headers or {})
+    if entry is not None:
+        if entry.get("etag"):
+            requestHeaders["If-None-Match"] = entry["etag"]
+        if entry.get("lastModified"):
+            requestHeaders["If-Modified-Since"] = entry["lastModified"]
+    try:
+        response = session().get(url, headers=requestHeaders)
+    except requests.RequestException as e:
+        if entry is not None:
+            logging.warning('PivNet unreachable, using cached ' + url + ': ' + str(e))
+            return entry["body"]
+        raise
+
+    if response.status_code == 304 and entry is not None:
+        logging.debug('PivNet cache revalidated: ' + url)
+        entry["fetched"] = time.time()
+        storeEntry(url, entry)
+        return entry["body"]
+    if response.status_code >= 400:
+        raise RuntimeError('ERROR: status code {sc} for GET {url}'.format(
+                sc=response.status_code, url=url))
+    logging.debug('PivNet cache miss: ' + url)
+    body = json.loads(response.text)
+    storeEntry(url, {"url": url,
+                     "etag": response.headers.get("ETag"),
+                     "lastModified": response.headers.get("Last-Modified"),
+                     "fetched": time.time(),
+                     "body": body})
+    return body
+
+
+def acceptEULA(package, releaseId, headers):
+    # Acceptance is per release, remember it so later creates skip the POST
+    eulaURL = baseURL() + "/api/v2/products/" + package + "/releases/" + str(releaseId) + "/eula_acceptance"
+    entry = loadEntry(eulaURL)
+    if entry is not None:
+        logging.debug('EULA already accepted: ' + eulaURL)
+        return entry["body"]
+    response = session().post(eulaURL, headers=headers)
+    if response.status_code >= 400:
+        raise RuntimeError('ERROR: status code {sc} for POST {url}'.format(
+                sc=response.status_code, url=eulaURL))
+    print "Software EULA Accepted:", response.text
+    storeEntry(eulaURL, {"url": eulaURL, "fetched": time.time(), "body": response.text})
+    return response.text
+
+
+def latestRelease(package, ttl=None):
+    # FIND PRODUCT
+    res = getJSON(baseURL() + "/api/v2/products", ttl=ttl)
+    releasesURL = None
+    for product in res["products"]:
+        if package in product["slug"]:
+            releasesURL = product["_links"]["releases"].get("href")
+            logging.debug('Release URL: ' + releasesURL)
+            productId = product["id"]
+            logging.debug('ProdID: ' + str(productId))
+    if releasesURL is None:
+        raise RuntimeError('ERROR: product ' + package + ' not found on ' + baseURL())
+    res = getJSON(releasesURL, ttl=ttl)
+
+    # GET LATEST RELEASE
+    latest = ['0', '0', '0']
+    latestVersion = None
+    for versions in res["releases"]:
+        versionSplit = [i for i in re.split(r'(\d+).', str(versions["version"])) if i][0:3]
+        if (versionSplit > latest):
+            latest = versionSplit
+            latestVersion = versions
+    return latestVersion
+
+
+def resolveRelease(package, headers, ttl=None):
+    # Returns the release detail (file groups and download links) of the latest release
+    with _lock:
+        releaseLock = _releaseLocks.setdefault(package, threading.Lock())
+    with releaseLock:
+        if ttl != 0 and package in _releases:
+            logging.debug('Release resolved earlier in this process: ' + package)
+            return _releases[package]
+        latestVersion = latestRelease(package, ttl)
+        getURL = baseURL() + "/api/v2/products/" + package + "/releases/" + str(latestVersion["id"])
+        logging.debug('latestVersion URL: ' + getURL)
+        release = getJSON(getURL, headers=headers, ttl=ttl)
+        acceptEULA(package, latestVersion["id"], headers)
+        _releases[package] = release
+    return release
+
+
+def prefetch(package):
+    # Revalidate everything a create needs, used by `cape stage`
+    headers = {"Authorization": "Token " + os.environ["PIVNET_APIKEY"]}
+    release = resolveRelease(package, headers, ttl=0)
+    fileCount = 0
+    for fileInfo in release.get("file_groups", []):
+        fileCount += len(fileInfo.get("product_files", []))
+    return {"version": release.get("version"), "id": release.get("id"), "files": fileCount}
@@ -0,0 +1,85 @@
+import base64
+import json
+import logging
+import time
+
+import RemoteOutput
+import SSHSessions
+import Trace
+
+# Remote batch execution.
+# A node's list of steps is compiled into one bash script that is streamed to
+# the node and run over a single channel.  Each step writes its output to
+# STEP_LOGS/<step>.log on the node and reports only its exit code and
+# duration as one marker line, so a step list costs one round trip instead of
+# one exec_command (and two blocking reads) per command, and a chatty step
+# costs the controller nothing.  A failed step's last lines come back on
+# stderr, which RemoteOutput streams into the batch's local log.  Callers that
+# parse a step's output (cape validate) ask for its tail with keepOutput.
+
+RESULT_MARKER = "CAPE_STEP "
+STEP_LOGS = "/tmp/cape-logs-$(id -un)"
+OUTPUT_TAIL_BYTES = 2048
+FAILURE_TAIL_LINES = 40
+
+
+def buildScript(steps, stopOnError=True, keepOutput=False):
+    # steps is a list of (stepName, shell command); step names are plain words
+    script = "CAPE_LOGS=" + STEP_LOGS + "\nmkdir -p $CAPE_LOGS\n"
+    for (stepName, command) in steps:
+        stepLog = "$CAPE_LOGS/" + stepName + ".log"
+        script = script + "CAPE_START=$(date +%s%N)\n"
+        script = script + "(\n" + command + "\n) > " + stepLog + " 2>&1 < /dev/null\n"
+        script = script + "CAPE_RC=$?\n"
+        script = script + "CAPE_END=$(date +%s%N)\n"
+        if keepOutput:
+            script = script + "printf '" + RESULT_MARKER + "{\"step\": \"%s\", \"rc\": %d, \"ms\": %d, \"log\": \"%s\", " \
+                              "\"output\": \"%s\"}\\n' '" + stepName + "' $CAPE_RC " \
+                              "$(( (CAPE_END - CAPE_START) / 1000000 )) \"" + stepLog + "\" " \
+                              "\"$(tail -c " + str(OUTPUT_TAIL_BYTES) + " " + stepLog + " | base64 | tr -d '\\n')\"\n"
+        else:
+            script = script + "printf '" + RESULT_MARKER + "{\"step\": \"%s\", \"rc\": %d, \"ms\": %d, \"log\": \"%s\"}\\n' " \
+                              "'" + stepName + "' $CAPE_RC $(( (CAPE_END - CAPE_START) / 1000000 )) \"" + stepLog + "\"\n"
+        script = script + "if [ $CAPE_RC -ne 0 ]; then tail -n " + str(FAILURE_TAIL_LINES) + " " + stepLog + " >&2; fi\n"
+        if stopOnError:
+            script = script + "if [ $CAPE_RC -ne 0 ]; then exit $CAPE_RC; fi\n"
+    return script
+
+
+def parseResults(lines):
+    results = []
+    for line in lines:
+        if line.startswith(RESULT_MARKER):
+            result = json.loads(line[len(RESULT_MARKER):])
+            if "output" in result:
+                result["output"] = base64.b64decode(result["output"])
+            results.append(result)
+    return results
+
+
+def runSteps(clusterNode, steps, user=None, stopOnError=True, keepOutput=False):
+    # Returns the per step results, raises if a step failed and stopOnError is set.
+    # Results carry the step's output tail only with keepOutput.
+    script = buildScript(steps, stopOnError, keepOutput)
+    start = time.time()
+    with SSHSessions.borrow(clusterNode, user) as ssh:
+        (stdin, stdout, stderr) = ssh.exec_command("bash -s")
+        stdin.write(script)
+        stdin.flush()
+        stdin.channel.shutdown_write()
+        output = RemoteOutput.capture(clusterNode, "batch", stdout, stderr, RESULT_MARKER)
+    return_code = output.returnCode
+    results = parseResults(output.kept)
+    stepStart = start
+    for result in results:
+        Trace.record(result["step"], "batchStep", stepStart, result["ms"] / 1000.0, clusterNode["nodeName"],
+                     {"rc": result["rc"]})
+        stepStart += result["ms"] / 1000.0
+        logging.debug(clusterNode["nodeName"] + ': ' + result["step"] + ' rc=' + str(result["rc"]) +
+                      ' ' + str(result["ms"]) + 'ms, output in ' + result["log"])
+    if stopOnError and (return_code != 0 or len(results) != len(steps)):
+        failed = results[-1]["step"] if results else "batch"
+        raise RuntimeError(clusterNode["nodeName"] + ': Step ' + failed + ' failed with return code ' +
+                           str(return_code) + ', see ' + output.path)
+    return results
+
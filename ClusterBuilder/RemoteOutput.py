@@ -0,0 +1,114 @@
+import collections
+import os
+import re
+import select
+import threading
+import time
+import logging
+
+import Trace
+
+# Streaming capture of remote command output.
+# stdout and stderr of a remote command are drained from the channel as they
+# arrive and appended line by line to
+# clusterConfigs/<cluster>/logs/<node>/<step>.log.  Only the last TAIL_LINES
+# lines stay in memory for error reporting, so a chatty `yum install` or
+# `gpinitsystem` costs a file write instead of a list of every line held by
+# the controller and logged as one giant line.  stdout lines starting with
+# the caller's keepPrefix (a string or tuple, e.g. RemoteBatch's step result
+# marker) are kept in full as well.
+
+TAIL_LINES = 40
+READ_SIZE = 32768
+
+_dirLock = threading.Lock()
+
+
+def clusterName(nodeName):
+    # Nodes are named <cluster>-NNN
+    return re.sub(r'-\d{3}$', '', nodeName)
+
+
+def logPath(clusterNode, step):
+    logDir = str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterName(clusterNode["nodeName"]) + \
+             "/logs/" + clusterNode["nodeName"]
+    with _dirLock:
+        if not os.path.isdir(logDir):
+            os.makedirs(logDir)
+    return logDir + "/" + step + ".log"
+
+
+class Capture(object):
+
+    def __init__(self, clusterNode, step, keepPrefix=None):
+        self.nodeName = clusterNode["nodeName"]
+        self.step = step
+        self.path = logPath(clusterNode, step)
+        self.tail = collections.deque(maxlen=TAIL_LINES)
+        self.keepPrefix = keepPrefix
+        self.kept = []
+        self.bytes = {"stdout": 0, "stderr": 0}
+        self.lines = {"stdout": 0, "stderr": 0}
+        self.returnCode = None
+        self._partial = {"stdout": "", "stderr": ""}
+        self._logFile = open(self.path, "a")
+        self._logFile.write("### " + time.strftime("%Y-%m-%d %H:%M:%S") + "\n")
+
+    def feed(self, stream, data):
+        self.bytes[stream] += len(data)
+        lines = (self._partial[stream] + data).split("\n")
+        self._partial[stream] = lines.pop()
+        for line in lines:
+            self.writeLine(stream, line)
+
+    def writeLine(self, stream, line):
+        self.lines[stream] += 1
+        prefix = "err: " if stream == "stderr" else ""
+        self._logFile.write(prefix + line + "\n")
+        self.tail.append(prefix + line)
+        if self.keepPrefix and stream == "stdout" and line.startswith(self.keepPrefix):
+            self.kept.append(line)
+
+    def close(self):
+        for stream in ["stdout", "stderr"]:
+            if self._partial[stream]:
+                self.writeLine(stream, self._partial[stream])
+                self._partial[stream] = ""
+        self._logFile.write("### rc=" + str(self.returnCode) + "\n")
+        self._logFile.close()
+
+    def tailText(self):
+        return "\n".join(self.tail)
+
+
+def capture(clusterNode, step, stdout, stderr=None, keepPrefix=None):
+    # Drains both streams of the command behind stdout, returns the Capture once the command exits
+    channel = stdout.channel
+    output = Capture(clusterNode, step, keepPrefix)
+    start = time.time()
+    try:
+        while True:
+            progressed = False
+            if channel.recv_ready():
+                output.feed("stdout", channel.recv(READ_SIZE))
+                progressed = True
+            if channel.recv_stderr_ready():
+                output.feed("stderr", channel.recv_stderr(READ_SIZE))
+                progressed = True
+            if progressed:
+                continue
+            if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                break
+            select.select([channel], [], [], 0.2)
+        output.returnCode = channel.recv_exit_status()
+    finally:
+        output.close()
+        Trace.record(step, "command", start, time.time() - start, clusterNode["nodeName"],
+                     {"rc": output.returnCode, "bytes": output.bytes["stdout"] + output.bytes["stderr"]})
+    logging.debug(output.nodeName + ': ' + step + ' rc=' + str(output.returnCode) + ' ' +
+                  str(output.lines["stdout"]) + '/' + str(output.lines["stderr"]) + ' lines ' +
+                  str(output.bytes["stdout"]) + '/' + str(output.bytes["stderr"]) + ' bytes -> ' + output.path)
+    if output.returnCode != 0 and output.tail:
+        logging.debug(output.nodeName + ': ' + step + ' tail:\n' + output.tailText())
+    return output
+
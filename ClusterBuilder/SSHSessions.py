@@ -0,0 +1,149 @@
+import os
+import threading
+import logging
+import paramiko
+from contextlib import contextmanager
+from paramiko import WarningPolicy
+
+import Trace
+
+# Shared SSH sessions for every build phase.
+# Sessions are keyed by (host, user, auth method) so all the steps that talk to
+# a node as the same user ride on one transport instead of doing a fresh
+# handshake per step.  Borrowers are capped per host (SSH_MAX_SESSIONS) so we
+# stay under the sshd MaxSessions default of 10 channels per connection.
+
+_sessions = {}
+_hostSlots = {}
+_lock = threading.Lock()
+_stats = {"handshakes": 0}
+
+# Once per process, every call adds another handler to the paramiko logger
+paramiko.util.log_to_file("/tmp/paramiko.log")
+
+
+class _Session(object):
+    def __init__(self, host, user, authMethod):
+        self.host = host
+        self.user = user
+        self.authMethod = authMethod
+        self.client = None
+        self.lock = threading.Lock()
+
+    def isActive(self):
+        if self.client is None:
+            return False
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def connect(self, timeout, track=None):
+        # Reconnect transparently if the transport went away (reboot, idle drop)
+        with self.lock:
+            if self.isActive():
+                return self.client
+            self.reset()
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(WarningPolicy())
+            logging.debug('SSH Handshake: ' + self.host + ' User: ' + self.user + ' Auth: ' + self.authMethod)
+            with Trace.span("ssh connect " + self.user, "ssh", track or self.host):
+                if self.authMethod == "key":
+                    client.connect(self.host, sshPort(), self.user, None, pkey=None,
+                                   key_filename=str(os.environ["CONFIGS_PATH"]) + str(os.environ["SSH_KEY"]),
+                                   timeout=timeout)
+                else:
+                    client.connect(self.host, sshPort(), self.user, password=_passwordFor(self.user), timeout=timeout)
+            client.get_transport().set_keepalive(30)
+            self.client = client
+            with _lock:
+                _stats["handshakes"] += 1
+            return self.client
+
+    def reset(self):
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception as e:
+                logging.debug('Closing stale session to ' + self.host + ': ' + str(e))
+            self.client = None
+
+
+def sshPort():
+    # SSH_PORT lets the nodes (or a local simulator) run sshd on another port
+    return int(os.environ.get("SSH_PORT", 22))
+
+
+def _passwordFor(user):
+    if user == "gpadmin":
+        return str(os.environ["GPADMIN_PW"])
+    elif user == "root":
+        return str(os.environ["ROOT_PW"])
+    return None
+
+
+def _sessionKey(host, user):
+    # The provisioning user logs in with the SSH key, gpadmin and root with passwords
+    if user is None or user == os.environ["SSH_USERNAME"]:
+        return (host, str(os.environ["SSH_USERNAME"]), "key")
+    return (host, user, "password")
+
+
+def _getSession(host, user):
+    key = _sessionKey(host, user)
+    with _lock:
+        if key not in _sessions:
+            _sessions[key] = _Session(*key)
+        if host not in _hostSlots:
+            _hostSlots[host] = threading.BoundedSemaphore(int(os.environ.get("SSH_MAX_SESSIONS", 8)))
+        return _sessions[key], _hostSlots[host]
+
+
+@contextmanager
+def borrow(clusterNode, user=None, timeout=120):
+    # Borrow a connected SSHClient for clusterNode as user (default SSH_USERNAME)
+    session, slots = _getSession(clusterNode["externalIP"], user)
+    slots.acquire()
+    try:
+        client = session.connect(timeout, clusterNode.get("nodeName"))
+        try:
+            yield client
+        except Exception:
+            if not session.isActive():
+                session.reset()
+            raise
+    finally:
+        slots.release()
+
+
+def invalidate(clusterNode):
+    # Drop every session to a node, e.g. right before it reboots
+    host = clusterNode["externalIP"]
+    with _lock:
+        sessions = [s for k, s in _sessions.items() if k[0] == host]
+    for session in sessions:
+        with session.lock:
+            session.reset()
+    logging.debug('Invalidated SSH sessions to ' + host)
+
+
+def invalidateSession(clusterNode, user=None):
+    # Drop only the session of one user, other users' sessions to the node may be busy
+    with _lock:
+        session = _sessions.get(_sessionKey(clusterNode["externalIP"], user))
+    if session is not None:
+        with session.lock:
+            session.reset()
+        logging.debug('Invalidated SSH session to ' + session.host + ' as ' + session.user)
+
+
+def closeAll():
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+        _hostSlots.clear()
+    for session in sessions:
+        session.reset()
+    logging.debug('Closed all SSH sessions')
+
+
+def handshakeCount():
+    return _stats["handshakes"]
@@ -0,0 +1,144 @@
+import os
+import logging
+
+# Segment layout planner.
+# One plan decides where the segments of every segment host live: the data
+# volumes a host has (one per disk, or the RAID0 volumes prepareHost.sh
+# assembles), the primary and mirror directory of each segment and the
+# mirror policy handed to gpinitsystem.  initDB writes gpinitsystem_config
+# from the plan, makeDirectories and setPaths create and use the same
+# directories, buildFSTAB mounts the same volumes.
+#
+# Primaries are dealt round robin over the volumes, mirrors the same way from
+# the last volume backwards, so a volume carrying one primary more than the
+# others carries one mirror fewer.  Every plan is scored for
+#   - disk load: busiest volume / average volume, a primary weighs 1 and a
+#     mirror MIRROR_WEIGHT (it only replays its primary's writes)
+#   - failover skew: segments the busiest host runs after one host fails /
+#     segments per host; 2.0 for group mirroring, 1 + 1/segments for spread
+
+MIRROR_POLICIES = ["group", "spread"]
+MIRROR_WEIGHT = 0.5
+
+
+def raidVolumes(diskQty):
+    # The volume count prepareHost.sh builds for diskQty drives
+    if diskQty < 8:
+        volumeQty = 1
+    elif diskQty < 16:
+        volumeQty = 2
+    else:
+        volumeQty = 4
+    if diskQty % volumeQty != 0:
+        return 1
+    return volumeQty
+
+
+def volumes(diskQty, raid0, baseHome):
+    if raid0:
+        return ["/data" + str(volumeNum) for volumeNum in range(1, raidVolumes(diskQty) + 1)]
+    return [baseHome + "/disk" + str(diskNum) for diskNum in range(1, diskQty + 1)]
+
+
+def mirrorPolicy(requested, hostCount, segmentsPerHost):
+    # Spread puts each mirror of a host on a different host, gpinitsystem -S
+    # refuses when there are not more segment hosts than segments per host
+    if requested == "spread" and hostCount <= segmentsPerHost:
+        logging.info('Spread mirroring needs more than ' + str(segmentsPerHost) + ' segment hosts, have ' +
+                     str(hostCount) + ': using group mirroring')
+        return "group"
+    return requested
+
+
+def plan(diskQty, raid0, baseHome, segmentsPerHost, mirrors, policy="group", hostCount=1):
+    dataVolumes = volumes(diskQty, raid0, baseHome)
+    volumeQty = len(dataVolumes)
+    layout = {"volumes": dataVolumes,
+              "masterDirectory": dataVolumes[0] + "/master",
+              "segmentsPerHost": segmentsPerHost,
+              "hostCount": hostCount,
+              "primaryDirectories": [dataVolumes[segNum % volumeQty] + "/primary"
+                                     for segNum in range(segmentsPerHost)],
+              "mirrorDirectories": [],
+              "mirrorPolicy": None}
+    if mirrors:
+        layout["mirrorDirectories"] = [dataVolumes[volumeQty - 1 - segNum % volumeQty] + "/mirror"
+                                       for segNum in range(segmentsPerHost)]
+        layout["mirrorPolicy"] = mirrorPolicy(policy, hostCount, segmentsPerHost)
+    layout.update(score(layout))
+    return layout
+
+
+def fromCluster(clusterDictionary, hostCount=1):
+    # RAID0 as resolved for this cluster, DiskBench.resolveRaid
+    return plan(int(os.environ["DISK_QTY"]), 'yes' in clusterDictionary["raid0"], os.environ["BASE_HOME"],
+                int(os.environ["SEGMENTDBS"]), 'yes' in os.environ["MIRRORS"],
+                os.environ.get("MIRROR_POLICY", "group"), hostCount)
+
+
+def mirrorHosts(layout, hostNum):
+    # Hosts gpinitsystem puts the mirrors of hostNum's primaries on, one per primary
+    hostCount = layout["hostCount"]
+    if layout["mirrorPolicy"] == "spread":
+        return [(hostNum + 1 + segNum) % hostCount for segNum in range(layout["segmentsPerHost"])]
+    return [(hostNum + 1) % hostCount] * layout["segmentsPerHost"]
+
+
+def score(layout):
+    load = dict((volume, 0.0) for volume in layout["volumes"])
+    for directory in layout["primaryDirectories"]:
+        load[os.path.dirname(directory)] += 1
+    for directory in layout["mirrorDirectories"]:
+        load[os.path.dirname(directory)] += MIRROR_WEIGHT
+    average = sum(load.values()) / len(load)
+    diskLoad = max(load.values()) / average if average else 1.0
+
+    failoverSkew = None
+    if layout["mirrorPolicy"] and layout["hostCount"] > 1:
+        # Every host is alike, losing host 0 shows the worst case
+        active = [layout["segmentsPerHost"]] * layout["hostCount"]
+        active[0] = 0
+        for mirrorHost in mirrorHosts(layout, 0):
+            active[mirrorHost] += 1
+        failoverSkew = round(float(max(active)) / layout["segmentsPerHost"], 2)
+    return {"diskLoad": round(diskLoad, 2), "failoverSkew": failoverSkew}
+
+
+def describe(layout):
+    description = str(layout["segmentsPerHost"]) + " segments per host over " + str(len(layout["volumes"])) + \
+        " volumes, disk load " + str(layout["diskLoad"])
+    if layout["mirrorPolicy"]:
+        description += ", " + layout["mirrorPolicy"] + " mirrors"
+        if layout["failoverSkew"] is not None:
+            description += ", failover skew " + str(layout["failoverSkew"])
+    else:
+        description += ", no mirrors"
+    return description
+
+
+def hostDirectories(layout, role):
+    # (directories to create, volumes gpadmin must own) on a node of this role
+    if "master" in role:
+        return ([layout["masterDirectory"]], [os.path.dirname(layout["masterDirectory"])])
+    directories = sorted(set(layout["primaryDirectories"] + layout["mirrorDirectories"]))
+    return (directories, sorted(set([os.path.dirname(directory) for directory in directories])))
+
+
+def gpinitsystemConfig(layout, masterName, template):
+    config = template.replace("%MASTER%", masterName)
+    config = config.replace("MASTER_DIRECTORY=/data/disk1/master", "MASTER_DIRECTORY=" + layout["masterDirectory"])
+    config = config.replace("declare -a DATA_DIRECTORY=(/data/primary /data/primary)",
+                            "declare -a DATA_DIRECTORY=(" + " ".join(layout["primaryDirectories"]) + ")")
+    if layout["mirrorDirectories"]:
+        config = config + '\n#### MIRROR PARAMETERS\n' \
+                        + 'MIRROR_PORT_BASE=5000\n' \
+                        + 'REPLICATION_PORT_BASE=41000\n' \
+                        + 'MIRROR_REPLICATION_PORT_BASE=51000\n' \
+                        + 'declare -a MIRROR_DATA_DIRECTORY=(%s)\n' % " ".join(layout["mirrorDirectories"])
+    return config
+
+
+def gpinitsystemOptions(layout):
+    if layout["mirrorPolicy"] == "spread":
+        return " -S"
+    return ""
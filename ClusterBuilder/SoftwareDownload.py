@@ -1,16 +1,20 @@
 import json
 import os
-import re
 import threading
 import time
 import warnings
 import logging
-import paramiko
-import requests
 import traceback
-from paramiko import WarningPolicy
 from distutils.version import StrictVersion
 
+import ArtifactCache
+import BuildBudget
+import BuildJournal
+import DownloadEngine
+import PivnetCache
+import SSHSessions
+import Trace
+
 def downloadSoftware(clusterDictionary):
     logging.info('downloadSoftware Started')
     warnings.simplefilter("ignore")
@@ -20,47 +24,11 @@ def downloadSoftware(clusterDictionary):
     headers = {"Authorization": "Token " + os.environ["PIVNET_APIKEY"]}
     logging.debug('Auth Token: ' + json.dumps(headers))
 
-    # FIND PRODUCT
-    response = requests.get("https://network.pivotal.io/api/v2/products")
-    res = json.loads(response.text)
-    for product in res["products"]:
-        if package in product["slug"]:
-            releasesURL = product["_links"]["releases"].get("href")
-            logging.debug('Release URL: ' + releasesURL)
-            productId = product["id"]
-            logging.debug('ProdID: ' + str(productId))
-    response = requests.get(releasesURL)
-    res = json.loads(response.text)
-
-    if response.status_code >= 400:
-        raise RuntimeError('ERROR: status code {sc} for GET {url}'.format(
-                sc=response.status_code, url=releasesURL))
-
-    # GET LATEST RELEASE
-    latest = ['0', '0', '0']
-    for versions in res["releases"]:
-        versionSplit = [i for i in re.split(r'(\d+).', str(versions["version"])) if i][0:3]
-        if (versionSplit > latest):
-            latest = versionSplit;
-            latestVersion = versions
-
-    # GET DOWNLOAD URL AND FILENAME
-    getURL = "https://network.pivotal.io/api/v2/products/" + package + "/releases/" + str(latestVersion["id"])
-    logging.debug('latestVersion URL: ' + getURL)
-    response = requests.get(getURL, headers=headers)
-    responseJSON = json.loads(response.text)
+    # FIND PRODUCT, LATEST RELEASE, DOWNLOAD URLS AND ACCEPT EULA (cached on disk)
+    with Trace.span("resolveRelease"):
+        responseJSON = PivnetCache.resolveRelease(package, headers)
     downloads = []
 
-    if response.status_code >= 400:
-        raise RuntimeError('ERROR: status code {sc} for GET {url}'.format(
-                sc=response.status_code, url=getURL))
-
-    # ACCEPT EULA
-    eulaURL = "https://network.pivotal.io/api/v2/products/" + package + "/releases/" + str(
-        latestVersion["id"]) + "/eula_acceptance"
-    response = requests.post(eulaURL, headers=headers)
-    print "Software EULA Accepted:", response.text
-
     ### SHOULD ADD A FLAG TO TELL WHICH HOSTS THE SW GOES ON
     #   0 : CLUSTERWIDE
     #   1 : ACCESS
@@ -80,6 +48,8 @@ def downloadSoftware(clusterDictionary):
                         if "Red Hat Enterprise Linux 5, 6" in file["name"]:
                             downloadFile["URL"] = file["_links"]["download"].get("href")
                             downloadFile["NAME"] = str(file["aws_object_key"]).split("/")[2]
+                            downloadFile["ID"] = file["id"]
+                            downloadFile["SHA256"] = file.get("sha256")
                             downloadFile["TARGET"] = 0
                             downloads.append(downloadFile)
 
@@ -88,6 +58,8 @@ def downloadSoftware(clusterDictionary):
                     if "Red Hat Enterprise Linux x86_64" in file["name"]:
                         downloadFile["URL"] = file["_links"]["download"].get("href")
                         downloadFile["NAME"] = str(file["aws_object_key"]).split("/")[2]
+                        downloadFile["ID"] = file["id"]
+                        downloadFile["SHA256"] = file.get("sha256")
                         downloadFile["TARGET"] = 0
                         downloads.append(downloadFile)
 
@@ -98,6 +70,8 @@ def downloadSoftware(clusterDictionary):
                         latestVersion = str(file["file_version"])
                         downloadFile["URL"] = file["_links"]["download"].get("href")
                         downloadFile["NAME"] = str(file["aws_object_key"]).split("/")[2]
+                        downloadFile["ID"] = file["id"]
+                        downloadFile["SHA256"] = file.get("sha256")
                         downloadFile["TARGET"] = 2
                         downloads.append(downloadFile)
 
@@ -106,6 +80,8 @@ def downloadSoftware(clusterDictionary):
                     if "PL/R Extension for RHEL" in file["name"]:
                         downloadFile["URL"] = file["_links"]["download"].get("href")
                         downloadFile["NAME"] = str(file["aws_object_key"]).split("/")[2]
+                        downloadFile["ID"] = file["id"]
+                        downloadFile["SHA256"] = file.get("sha256")
                         downloadFile["TARGET"] = 2
                         downloads.append(downloadFile)
 
@@ -114,6 +90,8 @@ def downloadSoftware(clusterDictionary):
                     if "Clients for Red Hat Enterprise Linux x86_64" in file["name"]:
                         downloadFile["URL"] = file["_links"]["download"].get("href")
                         downloadFile["NAME"] = str(file["aws_object_key"]).split("/")[2]
+                        downloadFile["ID"] = file["id"]
+                        downloadFile["SHA256"] = file.get("sha256")
                         downloadFile["TARGET"] = 1
                         downloads.append(downloadFile)
 
@@ -148,16 +126,25 @@ def downloadSoftware(clusterDictionary):
         # for x in threads:
         #     x.join()
 
-        # Thread PER HOST
+        if os.environ.get("ARTIFACT_FANOUT", "yes") == "no":
+            # Thread PER HOST
 
-        threads = []
+            threads = []
 
-        for clusterNode in clusterDictionary["clusterNodes"]:
-            hostDownloadsThread = threading.Thread(target=hostDownloads, args=(clusterNode, downloads,))
-            threads.append(hostDownloadsThread)
-            hostDownloadsThread.start()
-        for x in threads:
-            x.join()
+            with Trace.span("hostDownloads"):
+                for clusterNode in BuildJournal.pending(clusterDictionary["clusterName"], "hostDownloads",
+                                                        clusterDictionary["clusterNodes"]):
+                    hostDownloadsThread = threading.Thread(target=BuildBudget.run,
+                                                           args=(hostDownloads, clusterNode, downloads,
+                                                                 clusterDictionary["clusterName"]))
+                    threads.append(hostDownloadsThread)
+                    hostDownloadsThread.start()
+                for x in threads:
+                    x.join()
+        else:
+            # Each artifact leaves PivNet once and is spread over the internal network
+            with Trace.span("distributeArtifacts"):
+                ArtifactCache.distributeArtifacts(clusterDictionary, downloads)
 
 
 
@@ -170,22 +157,9 @@ def downloadSoftware(clusterDictionary):
                     try:
                         attemptCount += 1
 
-                        ssh = paramiko.SSHClient()
-                        ssh.set_missing_host_key_policy(WarningPolicy())
-                        ssh.connect(node["externalIP"], 22, os.environ["SSH_USERNAME"], None, pkey=None,
-                                    key_filename=str(os.environ["CONFIGS_PATH"]) + str(os.environ["SSH_KEY"]),
-                                    timeout=120)
-
-                        for file in downloads:
-                            (stdin, stdout, stderr) = ssh.exec_command(
-                                "wget --header=\"Authorization: Token " + str(os.environ[
-                                    "PIVNET_APIKEY"]) + "\" --post-data='' " + str(
-                                    file['URL']) + " -O /tmp/" + str(file['NAME']))
-
-                            stderr.readlines()
-                            stdout.readlines()
-
+                        DownloadEngine.fetchFiles(node, downloads)
                         connected = True
+
                     except Exception as e:
                         print e
                         print node["nodeName"] + ": Attempting SSH Connection"
@@ -196,8 +170,6 @@ def downloadSoftware(clusterDictionary):
                             logging.debug('Failed')
                             print "Failing Process"
                             exit()
-                    finally:
-                        ssh.close()
 
     logging.info('downloadSoftware Completed')
     return downloads
@@ -209,51 +181,33 @@ def downloadSoftware(clusterDictionary):
 #   2 : MASTERS
 #   3 : DATANODES OR SEGMENT DB HOST
 
-def hostDownloads(node, downloads):
+def hostDownloads(node, downloads, clusterName):
     logging.info('hostDownloads Started')
     connected = False
     attemptCount = 0
     while not connected:
         try:
             attemptCount += 1
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
             logging.debug('Connecting to Node: ' + node["nodeName"])
             logging.debug('SSH IP: ' + node["externalIP"] + ' User: ' +
                           os.environ["SSH_USERNAME"] + ' Key: ' +
                           str(os.environ["CONFIGS_PATH"]) +
                           str(os.environ["SSH_KEY"]))
-            ssh.connect(node["externalIP"], 22, os.environ["SSH_USERNAME"], None, pkey=None,
-                        key_filename=str(os.environ["CONFIGS_PATH"]) + str(os.environ["SSH_KEY"]), timeout=120)
-            for file in downloads:
-                if (file["TARGET"] == 2) and ("master" in node["role"]):
-                    (stdin, stdout, stderr) = ssh.exec_command("wget --header=\"Authorization: Token " + os.environ[
-                        "PIVNET_APIKEY"] + "\" --post-data='' " + str(file['URL']) + " -O /tmp/" + str(file['NAME']))
-                    logging.debug(stderr.readlines())
-                    logging.debug(stdout.readlines())
-                elif (file["TARGET"] == 1) and ("access" in node["role"]):
-
-                    (stdin, stdout, stderr) = ssh.exec_command("wget --header=\"Authorization: Token " + os.environ[
-                        "PIVNET_APIKEY"] + "\" --post-data='' " + str(file['URL']) + " -O /tmp/" + str(file['NAME']))
-                    logging.debug(stderr.readlines())
-                    logging.debug(stdout.readlines())
-                elif (file["TARGET"] == 3) and ("worker" in node["role"]):
-
-                    (stdin, stdout, stderr) = ssh.exec_command("wget --header=\"Authorization: Token " + os.environ[
-                        "PIVNET_APIKEY"] + "\" --post-data='' " + str(file['URL']) + " -O /tmp/" + str(file['NAME']))
-                    logging.debug(stderr.readlines())
-                    logging.debug(stdout.readlines())
-                elif (file["TARGET"] == 0):  # and ("access" not in node["role"]):  Decided to put GPDB on ACCESS
-                    (stdin, stdout, stderr) = ssh.exec_command("wget --header=\"Authorization: Token " + os.environ[
-                        "PIVNET_APIKEY"] + "\" --post-data='' " + str(file['URL']) + " -O /tmp/" + str(file['NAME']))
-                    logging.debug(stderr.readlines())
-                    logging.debug(stdout.readlines())
+            files = [dict(file) for file in downloads if ArtifactCache.targetNodes([node], file)]
+            if os.environ.get("STREAM_EXTRACT", "no") == "yes":
+                # Unpack while downloading, uncompressFiles skips what is already extracted
+                for file in files:
+                    file["EXTRACT"] = True
+            DownloadEngine.fetchFiles(node, files)
             if os.environ["GPDB_BUILD"]:
                 logging.info('Pre-Release GPDB build detected')
                 logging.debug('Uploading File: ' + str(os.environ["GPDB_BUILD"]))
-                sftp = ssh.open_sftp()
-                sftp.put(str(os.environ["GPDB_BUILD"]), "/tmp/" + os.path.basename(str(os.environ["GPDB_BUILD"])), confirm=True)
+                with SSHSessions.borrow(node) as ssh:
+                    sftp = ssh.open_sftp()
+                    Trace.put(sftp, node, str(os.environ["GPDB_BUILD"]), "/tmp/" + os.path.basename(str(os.environ["GPDB_BUILD"])))
+                    sftp.close()
             connected = True
+            BuildJournal.record(clusterName, "hostDownloads", node["nodeName"])
         except Exception as e:
             print e
             print node["nodeName"] + ": Attempting SSH Connection"
@@ -265,5 +219,4 @@ def hostDownloads(node, downloads):
                 print "Failing Process"
                 exit()
         finally:
-            ssh.close()
             logging.info('hostDownloads Completed')
@@ -0,0 +1,75 @@
+import threading
+import time
+import traceback
+import logging
+
+import BuildBudget
+import BuildJournal
+import Trace
+
+# Dependency aware per node step runner.
+# Every node walks its own chain of steps in one thread, so a fast node is not
+# held back by the slowest node of each phase.  The only cluster wide barrier
+# is the return of runNodeSteps, which callers place where one is really
+# needed (before initDB, before key exchange).  Given a cluster name, completed
+# steps go to the build journal and steps it already has are skipped.  A step
+# is only journaled when its function returns, so a step function must raise
+# (or exit) when any of its remote commands fails: RemoteBatch.runSteps with
+# stopOnError, or a check of the returnCode RemoteOutput.capture hands back.
+# Each step (not the whole chain) holds a build budget slot while it runs.
+
+
+def stepOrder(steps):
+    # steps is a list of (stepName, function, [stepNames it depends on])
+    ordered = []
+    done = set()
+    pending = list(steps)
+    while pending:
+        ready = [step for step in pending if set(step[2]) <= done]
+        if not ready:
+            raise ValueError('Unresolvable step dependencies: ' + ",".join([step[0] for step in pending]))
+        for step in ready:
+            ordered.append(step)
+            done.add(step[0])
+            pending.remove(step)
+    return ordered
+
+
+def runNodeSteps(clusterNodes, steps, clusterName=None):
+    # Returns {nodeName: failed stepName} for every node that did not finish
+    ordered = stepOrder(steps)
+    logging.debug('Step order: ' + ",".join([step[0] for step in ordered]))
+    failures = {}
+    threads = []
+    for clusterNode in clusterNodes:
+        nodeThread = threading.Thread(target=runChain, args=(clusterNode, ordered, failures, clusterName))
+        threads.append(nodeThread)
+        nodeThread.start()
+    for x in threads:
+        x.join()
+    return failures
+
+
+def runChain(clusterNode, orderedSteps, failures, clusterName=None):
+    chainStart = time.time()
+    for (stepName, function, dependsOn) in orderedSteps:
+        if clusterName and BuildJournal.done(clusterName, stepName, clusterNode["nodeName"]):
+            logging.debug(clusterNode["nodeName"] + ': ' + stepName + ' already done')
+            continue
+        stepStart = time.time()
+        try:
+            with Trace.span(stepName, "step", clusterNode["nodeName"]):
+                BuildBudget.run(function, clusterNode)
+        except (Exception, SystemExit) as e:
+            # Step helpers still exit() on failure, stop this node's chain only
+            logging.debug(clusterNode["nodeName"] + ': ' + stepName + ' Failed: ' + str(e))
+            logging.debug(traceback.format_exc())
+            failures[clusterNode["nodeName"]] = stepName
+            return
+        # Reached only when the step raised nothing, a failed step is never journaled
+        if clusterName:
+            BuildJournal.record(clusterName, stepName, clusterNode["nodeName"])
+        logging.debug(clusterNode["nodeName"] + ': ' + stepName + ' took ' +
+                      str(round(time.time() - stepStart, 1)) + 's')
+    logging.info(clusterNode["nodeName"] + ': Step chain completed in ' +
+                 str(round(time.time() - chainStart, 1)) + 's')
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+# Build timing traces.
+# Phases, per node steps, SSH handshakes, remote commands and file transfers
+# are recorded as complete events in Chrome trace format (load
+# clusterConfigs/<cluster>/trace-<command>.json in chrome://tracing or
+# ui.perfetto.dev).  Each node gets its own track, the
+# controller's phases run on the "controller" track (on a track named after
+# the cluster when several clusters build in one process).  summary() walks
+# the controller phases and names the node that finished last in each one,
+# which is the critical path of the run.  Given a cluster's controller track,
+# write() and summary() only cover that cluster's phases and nodes.
+
+CONTROLLER = "controller"
+
+_events = []
+_tracks = {}
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def setController(track):
+    # Phases recorded by this thread go to `track` instead of CONTROLLER
+    _local.controller = track
+
+
+def controllerTrack():
+    return getattr(_local, "controller", CONTROLLER)
+
+
+def trackId(track):
+    with _lock:
+        if track not in _tracks:
+            _tracks[track] = len(_tracks) + 1
+        return _tracks[track]
+
+
+def record(name, category, start, duration, track=None, args=None):
+    event = {"name": name, "cat": category, "ph": "X", "pid": 1,
+             "tid": trackId(track or controllerTrack()),
+             "ts": int(start * 1000000), "dur": int(duration * 1000000),
+             "args": args or {}}
+    with _lock:
+        _events.append(event)
+
+
+@contextmanager
+def span(name, category="phase", track=None, **args):
+    # Yields the args dict so the caller can add results (bytes, rc) to the event
+    start = time.time()
+    try:
+        yield args
+    finally:
+        record(name, category, start, time.time() - start, track, args)
+
+
+def put(sftp, clusterNode, localPath, remotePath):
+    # sftp.put that records the transfer size and time on the node's track
+    with span("put " + os.path.basename(remotePath), "transfer", clusterNode["nodeName"]) as args:
+        attributes = sftp.put(localPath, remotePath, confirm=True)
+        args["bytes"] = attributes.st_size
+    return attributes
+
+
+def reset():
+    with _lock:
+        del _events[:]
+        _tracks.clear()
+
+
+def clusterEvents(clusterName, track=None):
+    # (events, tracks), only the controller track and <cluster>-NNN node tracks when track is given
+    with _lock:
+        events = list(_events)
+        tracks = dict(_tracks)
+    if track is not None:
+        tracks = dict((trackName, tid) for trackName, tid in tracks.items()
+                      if trackName == track or trackName.startswith(clusterName + "-"))
+        events = [e for e in events if e["tid"] in tracks.values()]
+    return (events, tracks)
+
+
+def write(clusterName, command, track=None):
+    clusterPath = str(os.environ["CAPE_HOME"]) + "/clusterConfigs/" + clusterName
+    if not os.path.isdir(clusterPath):
+        os.makedirs(clusterPath)
+    (events, tracks) = clusterEvents(clusterName, track)
+    metadata = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": track}}
+                for track, tid in tracks.items()]
+    metadata.append({"name": "process_name", "ph": "M", "pid": 1, "tid": 0,
+                     "args": {"name": "cape " + command + " " + clusterName}})
+    tracePath = clusterPath + "/trace-" + command + ".json"
+    with open(tracePath, "w") as traceFile:
+        json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, traceFile)
+    logging.info('Wrote ' + str(len(events)) + ' trace events to ' + tracePath)
+    return tracePath
+
+
+def summary(clusterName, track=None):
+    (events, tracks) = clusterEvents(clusterName, track)
+    names = dict((tid, trackName) for trackName, tid in tracks.items())
+    if not events:
+        return
+    controller = tracks.get(track or CONTROLLER)
+    phases = sorted([e for e in events if e["tid"] == controller and e["cat"] == "phase"], key=lambda e: e["ts"])
+    start = min(e["ts"] for e in events)
+    total = max(e["ts"] + e["dur"] for e in events) - start
+    print clusterName + ": Critical path (" + str(round(total / 1000000.0, 1)) + "s total)"
+    for phase in phases:
+        phaseEnd = phase["ts"] + phase["dur"]
+        inside = [e for e in events if e["tid"] != controller and phase["ts"] <= e["ts"] and e["ts"] + e["dur"] <= phaseEnd]
+        # Phases inside other phases (installGPDB > initDB) are indented under them
+        depth = len([p for p in phases if p is not phase and p["ts"] <= phase["ts"] and phaseEnd <= p["ts"] + p["dur"]])
+        line = "\t" + ("  " * depth + phase["name"]).ljust(24) + str(round(phase["dur"] / 1000000.0, 1)).rjust(8) + "s " + \
+            str(int(100.0 * phase["dur"] / max(total, 1))).rjust(3) + "%"
+        if inside:
+            last = max(inside, key=lambda e: e["ts"] + e["dur"])
+            longest = max([e for e in inside if e["tid"] == last["tid"]], key=lambda e: e["dur"])
+            line = line + "  slowest node " + names[last["tid"]] + " (" + longest["name"] + " " + \
+                str(round(longest["dur"] / 1000000.0, 1)) + "s)"
+        print line
+    connects = [e for e in events if e["cat"] == "ssh"]
+    commands = [e for e in events if e["cat"] == "command"]
+    transferred = sum([e["args"].get("bytes", 0) for e in events if e["cat"] == "transfer"])
+    print clusterName + ": " + str(len(connects)) + " SSH handshakes (" + \
+        str(round(sum([e["dur"] for e in connects]) / 1000000.0, 1)) + "s), " + str(len(commands)) + \
+        " remote commands (" + str(round(sum([e["dur"] for e in commands]) / 1000000.0, 1)) + "s), " + \
+        str(round(transferred / 1048576.0, 1)) + " MB transferred"
@@ -1,63 +1,175 @@
 import sys
 import os
+import threading
+import time
 import warnings
 import traceback
 import logging
-from libcloud.compute.providers import get_driver
-from libcloud.compute.types import Provider
-from libcloud.compute.base import Node as node
+from multiprocessing.pool import ThreadPool
+from libcloud.common.google import GoogleBaseError, ResourceNotFoundError, ResourceInUseError
+
+from ClusterBuilder import ClusterInventory
+from ClusterBuilder import ClusterLabels
+from ClusterBuilder import GCEDriver
+
+# Label driven teardown.
+# The instances and disks of every cluster being destroyed are selected with
+# one filtered list per kind (ClusterLabels), inventory and legacy names fill
+# in for clusters built before labels.  All deletes go through one bounded
+# pool of DESTROY_WORKERS, each worker issuing a DELETE and polling its own
+# operation.  Instances are deleted with their auto delete disks while
+# unattached disks are deleted alongside them.  A delete taking longer than
+# the adaptive timeout is left running and picked up by the next round,
+# which re-lists what is still there until nothing billable remains.
+
+DESTROY_ROUNDS = 3
+MIN_TIMEOUT = 60
+FIRST_TIMEOUT = 600
+
+_timingLock = threading.Lock()
+_slowest = [0]
+# Operations of deletes that outlived their timeout, polled again next round
+_inflight = {}
+
+
+def deleteTimeout():
+    # Until a delete has finished allow FIRST_TIMEOUT, then 3x the slowest seen
+    with _timingLock:
+        if not _slowest[0]:
+            return FIRST_TIMEOUT
+        return max(MIN_TIMEOUT, 3 * _slowest[0])
+
+
+def observe(duration):
+    with _timingLock:
+        _slowest[0] = max(_slowest[0], duration)
+
+
+def deleteResource(resource):
+    (kind, name) = resource
+    driver = GCEDriver.threadDriver()
+    # Each round gives a delete a fresh timeout, its duration counts from the DELETE
+    roundStart = time.time()
+    with _timingLock:
+        (operation, start) = _inflight.pop(resource, (None, roundStart))
+    try:
+        if operation is None:
+            operation = driver.connection.request(ClusterLabels.zonePath(kind, name), method="DELETE").object
+        pollInterval = 1
+        while operation.get("status") != "DONE":
+            if time.time() - roundStart > deleteTimeout():
+                logging.info(kind + ' ' + name + ': Delete still running after ' + str(int(time.time() - start)) + 's')
+                with _timingLock:
+                    _inflight[resource] = (operation, start)
+                return (kind, name, "timeout")
+            time.sleep(pollInterval)
+            pollInterval = min(pollInterval * 2, 10)
+            operation = driver.connection.request(operation["selfLink"]).object
+    except ResourceNotFoundError:
+        return (kind, name, "gone")
+    except ResourceInUseError as e:
+        logging.debug(kind + ' ' + name + ' in use: ' + str(e))
+        return (kind, name, "in use")
+    except GoogleBaseError as e:
+        logging.debug(kind + ' ' + name + ' delete failed: ' + str(e))
+        return (kind, name, "failed")
+    if operation.get("error"):
+        logging.debug(kind + ' ' + name + ' delete failed: ' + str(operation["error"]))
+        return (kind, name, "failed")
+    observe(time.time() - start)
+    logging.debug(kind + ' ' + name + ': Deleted in ' + str(round(time.time() - start, 1)) + 's')
+    return (kind, name, "deleted")
+
+
+def exists(resource):
+    (kind, name) = resource
+    try:
+        GCEDriver.threadDriver().connection.request(ClusterLabels.zonePath(kind, name), method="GET")
+    except ResourceNotFoundError:
+        return False
+    return True
+
+
+def knownNames(clusterName, nodeQty):
+    # Instance and disk names for clusters created before labels
+    inventory = ClusterInventory.load(clusterName)
+    if inventory is not None and inventory["cluster"].get("clusterNodes"):
+        clusterNodes = inventory["cluster"]["clusterNodes"]
+        logging.info(clusterName + ': Nodes from inventory (stage ' + inventory["stage"] + ')')
+        return ([clusterNode["nodeName"] for clusterNode in clusterNodes],
+                [volume for clusterNode in clusterNodes for volume in clusterNode.get("dataVolumes", [])])
+    if nodeQty is None:
+        return ([], [])
+    return ([clusterName + "-" + str(nodeNum).zfill(3) for nodeNum in range(int(nodeQty))], [])
+
+
+def remaining(pool, clusterNames, unlabeled):
+    # (kind, name) of everything still billable: labeled instances, labeled
+    # disks no instance uses any more, and unlabeled names that still exist
+    driver = GCEDriver.threadDriver()
+    resources = []
+    for clusterName in clusterNames:
+        for instance in ClusterLabels.listByLabel(driver, "instances", clusterName):
+            resources.append(("instances", instance["name"]))
+        for disk in ClusterLabels.listByLabel(driver, "disks", clusterName):
+            if not disk.get("users"):
+                resources.append(("disks", disk["name"]))
+    unlabeled = [resource for resource in unlabeled if resource not in resources]
+    if unlabeled:
+        resources.extend([resource for (resource, found) in zip(unlabeled, pool.map(exists, unlabeled)) if found])
+    return resources
+
+
+def destroyClusters(clusterNames, nodeQty=None):
+    warnings.simplefilter("ignore")
+    for clusterName in clusterNames:
+        print clusterName + ": Destroy Cluster Started"
+    unlabeled = []
+    for clusterName in clusterNames:
+        (instanceNames, diskNames) = knownNames(clusterName, nodeQty)
+        unlabeled.extend([("instances", name) for name in instanceNames])
+        unlabeled.extend([("disks", name) for name in diskNames])
+    pool = ThreadPool(int(os.environ.get("DESTROY_WORKERS", 16)))
+    try:
+        deleted = {"instances": 0, "disks": 0}
+        resources = remaining(pool, clusterNames, [resource for resource in unlabeled if resource[0] == "instances"])
+        if not resources:
+            print ",".join(clusterNames) + ": Nothing Found to Destroy"
+        for destroyRound in range(1, DESTROY_ROUNDS + 1):
+            if not resources:
+                break
+            logging.info('Destroy round ' + str(destroyRound) + ': ' +
+                         ",".join([kind + "/" + name for (kind, name) in resources]))
+            print "Deleting " + str(len([r for r in resources if r[0] == "instances"])) + " Instances and " + \
+                str(len([r for r in resources if r[0] == "disks"])) + " Disks"
+            for (kind, name, status) in pool.map(deleteResource, resources):
+                if status in ["deleted", "gone"]:
+                    deleted[kind] += 1
+                print "\t" + name + ": " + status
+            # Disks come loose once their instance is gone, unlabeled ones are looked up by name
+            resources = remaining(pool, clusterNames, unlabeled)
+        if resources:
+            for (kind, name) in resources:
+                print "\t" + name + ": Still Present"
+            logging.error('Not destroyed: ' + ",".join([kind + "/" + name for (kind, name) in resources]))
+            sys.exit('destroyServers Failed, ' + str(len(resources)) + ' resources left, rerun destroy')
+        print ",".join(clusterNames) + ": Destroyed " + str(deleted["instances"]) + " Instances and " + \
+            str(deleted["disks"]) + " Disks, Nothing Left"
+        for clusterName in clusterNames:
+            ClusterInventory.setStage(clusterName, "destroyed")
+    finally:
+        pool.close()
+        pool.join()
 
 
 def destroyServers(clusterDictionary):
     #
     # This method destroys a cluster without checking on state of the nodes
     #
-    warnings.simplefilter("ignore")
-    print clusterDictionary["clusterName"] + ": Destroy Cluster Started"
     try:
-
-        logging.debug('SVC_ACCOUNT: ' + str(os.environ["SVC_ACCOUNT"]))
-        logging.debug('CONFIGS_PATH: ' + str(os.environ["CONFIGS_PATH"]))
-        logging.debug('SVC_ACCOUNT_KEY: ' + str(os.environ["SVC_ACCOUNT_KEY"]))
-        logging.debug('PROJECT: ' + str(os.environ["PROJECT"]))
-        logging.debug('ZONE: ' + str(os.environ["ZONE"]))
-        ComputeEngine = get_driver(Provider.GCE)
-        driver = ComputeEngine(os.environ["SVC_ACCOUNT"],
-                               str(os.environ["CONFIGS_PATH"]) +
-                               str(os.environ["SVC_ACCOUNT_KEY"]),
-                               project=str(os.environ["PROJECT"]),
-                               datacenter=str(os.environ["ZONE"]))
-        nodeList = []
-        delNames = []
-        # get a list of nodes from the Cloud Provider
-        nodes = driver.list_nodes(ex_zone=str(os.environ["ZONE"]))
-        numNodes = int(clusterDictionary["nodeQty"])
-        # Create a list of node names to delete
-        for i in range(0, int(numNodes)):
-            delNames.append(clusterDictionary["clusterName"] + "-00" + str(i))
-
-        logging.info('List of all Node Names to delete: {0}'.format(",".join(delNames)))
-
-        nodeList = [node for x in delNames for node in nodes if x in node.name]
-        logging.debug("Nodes being deleted {0}".format(nodeList))
-
-        delnodes = driver.ex_destroy_multiple_nodes(nodeList,
-                                                    ignore_errors=True,
-                                                    destroy_boot_disk=False,
-                                                    poll_interval=2,
-                                                    timeout=300)
-        if (len(nodeList)) != (len(delnodes)):
-            print clusterDictionary["clusterName"] + ": We may have deleted \
-                more nodes than expected!! "
-            logging.debug('nodeList: ' + str(len(nodeList)))
-            logging.debug('delnodes: ' + str(len(delnodes)))
-            print delnodes
-        else:
-            print clusterDictionary["clusterName"] + ": Destroyed Nodes"
-            for i in range(0, int(len(nodeList))):
-                print "\t" + nodeList[i].name + ": " + str(delnodes[i])
-                logging.debug(nodeList[i].name + ": " + str(delnodes[i]))
-
+        destroyClusters(clusterDictionary["clusterName"].split(","), clusterDictionary.get("nodeQty"))
+    except SystemExit:
+        raise
     except Exception as e:
         print e
         print traceback.print_exc()
@@ -1,8 +1,7 @@
 import os
 import time
 
-import paramiko
-from paramiko import WarningPolicy
+from ClusterBuilder import RemoteBatch
 
 
 def installComponents(clusterDictionary):
@@ -20,48 +19,26 @@ def installComponents(clusterDictionary):
     while not connected:
         try:
             attemptCount += 1
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(WarningPolicy())
-            ssh.connect(accessNode["externalIP"], 22, str(os.environ.get("SSH_USERNAME")), None, pkey=None,
-                        key_filename=str(os.environ.get("CONFIGS_PATH")) + str(os.environ.get("SSH_KEY")), timeout=120)
-            (stdin, stdout, stderr) = ssh.exec_command("source /opt/rh/python27/enable")
-            stdout.readlines()
-            stderr.readlines()
-            # create a instructor account
-            (stdin, stdout, stderr) = ssh.exec_command(
-                "sudo useradd -s /bin/bash -c 'Instructor Account' -m instructor")
-            stderr.readlines()
-            stdout.readlines()
-            (stdin, stdout, stderr) = ssh.exec_command(
-                "sudo echo " + str(os.environ.get("INSTRUCTOR_PW")) + " | sudo passwd --stdin instructor")
-            stdout.readlines()
-            stderr.readlines()
-            (stdin, stdout, stderr) = ssh.exec_command("sudo chown -R instructor: /home/instructor")
-            stderr.readlines()
-            stdout.readlines()
+            RemoteBatch.runSteps(accessNode, [
+                ("python27", "source /opt/rh/python27/enable"),
+                # create a instructor account
+                ("instructorUser", "sudo useradd -s /bin/bash -c 'Instructor Account' -m instructor"),
+                ("instructorPassword",
+                 "sudo echo " + str(os.environ.get("INSTRUCTOR_PW")) + " | sudo passwd --stdin instructor"),
+                ("instructorHome", "sudo chown -R instructor: /home/instructor"),
 
-            ### ADD GP VARIABLES ###
+                ### ADD GP VARIABLES ###
 
-            (stdin, stdout, stderr) = ssh.exec_command("sudo echo 'export GPHOME=/usr/local/greenplum-db' >> ~/.bashrc")
-            stderr.readlines()
-            stdout.readlines()
-            (stdin, stdout, stderr) = ssh.exec_command("sudo echo 'export PATH=$GPHOME/bin:$PATH' >> ~/.bashrc")
-            stderr.readlines()
-            stdout.readlines()
-            (stdin, stdout, stderr) = ssh.exec_command(
-                "sudo echo 'export LD_LIBRARY_PATH=$GPHOME/lib:$LD_LIBRARY_PATH' >> ~/.bashrc")
-            stderr.readlines()
-            stdout.readlines()
+                ("gphome", "sudo echo 'export GPHOME=/usr/local/greenplum-db' >> ~/.bashrc"),
+                ("path", "sudo echo 'export PATH=$GPHOME/bin:$PATH' >> ~/.bashrc"),
+                ("ldLibraryPath", "sudo echo 'export LD_LIBRARY_PATH=$GPHOME/lib:$LD_LIBRARY_PATH' >> ~/.bashrc"),
 
-            ########################
+                ########################
 
-            (stdin, stdout, stderr) = ssh.exec_command("sudo echo 'source /opt/rh/python27/enable' >> ~/.bashrc")
-            stderr.readlines()
-            stdout.readlines()
-            (stdin, stdout, stderr) = ssh.exec_command("sudo echo 'export PGHOST=" + masterNode[
-                "internalIP"] + "' >> ~/.bashrc;sudo cp ~/.bashrc /root/.bashrc;sudo cp ~/.bashrc /home/instructor/.bashrc;sudo cp ~/.bashrc /home/gpadmin/.bashrc")
-            stderr.readlines()
-            stdout.readlines()
+                ("python27Bashrc", "sudo echo 'source /opt/rh/python27/enable' >> ~/.bashrc"),
+                ("pghost", "sudo echo 'export PGHOST=" + masterNode[
+                    "internalIP"] + "' >> ~/.bashrc;sudo cp ~/.bashrc /root/.bashrc;sudo cp ~/.bashrc /home/instructor/.bashrc;sudo cp ~/.bashrc /home/gpadmin/.bashrc"),
+            ], stopOnError=False)
             # (stdin, stdout, stderr) = ssh.exec_command("sudo -i pip install pip -U")
             # stderr.readlines()
             # stdout.readlines()
@@ -84,7 +61,6 @@ def installComponents(clusterDictionary):
             # (stdin, stdout, stderr) = ssh.exec_command("sudo -i pip install gensim -U >> python-tools.log")
             # stderr.readlines()
             # stdout.readlines()
-
             connected = True
 
         except Exception as e:
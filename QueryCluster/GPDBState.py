@@ -0,0 +1,105 @@
+import json
+import logging
+
+from ClusterBuilder import RemoteOutput
+from ClusterBuilder import SSHSessions
+
+# Greenplum cluster state in one round trip.
+# A single aggregated query over gp_segment_configuration returns segment
+# counts by host, role, status and mode plus the master and standby rows in
+# unaligned, pipe separated form, so checking a large cluster costs one psql
+# call instead of one per count.  Output is streamed through RemoteOutput,
+# only the state rows are kept.
+
+STATE_ROWS = ("segment|", "master|")
+
+STATE_QUERY = "SELECT 'segment', hostname, role, preferred_role, status, mode, count(*) " \
+              "FROM gp_segment_configuration WHERE content >= 0 " \
+              "GROUP BY hostname, role, preferred_role, status, mode " \
+              "UNION ALL " \
+              "SELECT 'master', hostname, role, preferred_role, status, mode, 1 " \
+              "FROM gp_segment_configuration WHERE content = -1"
+
+
+def findMaster(clusterDictionary):
+    for clusterNode in clusterDictionary["clusterNodes"]:
+        if "master1" in clusterNode["role"]:
+            return clusterNode
+    return None
+
+
+def parseState(lines):
+    state = {"primaries": {"total": 0, "up": 0, "down": 0},
+             "mirrors": {"total": 0, "up": 0, "down": 0},
+             "modes": {},
+             "notPreferredRole": 0,
+             "hosts": {},
+             "master": None,
+             "standby": None}
+    for line in lines:
+        fields = line.strip().split("|")
+        if len(fields) != 7:
+            continue
+        (kind, hostname, role, preferredRole, status, mode, count) = fields
+        count = int(count)
+        if kind == "master":
+            entry = {"host": hostname, "status": status, "mode": mode}
+            if role == "p":
+                state["master"] = entry
+            else:
+                state["standby"] = entry
+            continue
+        counts = state["primaries"] if role == "p" else state["mirrors"]
+        counts["total"] += count
+        counts["up" if status == "u" else "down"] += count
+        state["modes"][mode] = state["modes"].get(mode, 0) + count
+        if role != preferredRole:
+            state["notPreferredRole"] += count
+        host = state["hosts"].setdefault(hostname, {"primaries": 0, "mirrors": 0, "down": 0})
+        host["primaries" if role == "p" else "mirrors"] += count
+        if status != "u":
+            host["down"] += count
+    return state
+
+
+def queryState(masterNode):
+    # Returns the parsed state, None if psql could not reach the database
+    with SSHSessions.borrow(masterNode, "gpadmin") as ssh:
+        (stdin, stdout, stderr) = ssh.exec_command("psql -d template1 -t -A -F'|' -c \"" + STATE_QUERY + "\"")
+        output = RemoteOutput.capture(masterNode, "queryState", stdout, stderr, STATE_ROWS)
+    if output.returnCode != 0:
+        logging.debug('State query returned: ' + str(output.returnCode) + ' ' + output.tailText())
+        return None
+    state = parseState(output.kept)
+    logging.debug('GPDB State: ' + json.dumps(state))
+    return state
+
+
+def printState(clusterName, state):
+    if state is None:
+        print clusterName + ": Database is not reachable"
+        return
+    if state["master"]:
+        print clusterName + ": Master " + state["master"]["host"] + " status " + state["master"]["status"]
+    if state["standby"]:
+        print clusterName + ": Standby " + state["standby"]["host"] + " status " + state["standby"]["status"]
+    else:
+        print clusterName + ": No Standby Master"
+    for kind in ["primaries", "mirrors"]:
+        counts = state[kind]
+        print clusterName + ": " + kind.capitalize() + " " + str(counts["up"]) + "/" + str(counts["total"]) + " up"
+    print clusterName + ": Modes " + ",".join([mode + "=" + str(count) for mode, count in sorted(state["modes"].items())])
+    if state["notPreferredRole"]:
+        print clusterName + ": " + str(state["notPreferredRole"]) + " Segments not in their preferred role"
+    for hostname in sorted(state["hosts"]):
+        host = state["hosts"][hostname]
+        print "\t" + hostname + ": primaries " + str(host["primaries"]) + " mirrors " + str(host["mirrors"]) + \
+            " down " + str(host["down"])
+
+
+def controlDatabase(masterNode, action):
+    # start/stop through the master, returns the utility's exit code
+    commands = {"start": "gpstart -a", "stop": "gpstop -a -M fast"}
+    with SSHSessions.borrow(masterNode, "gpadmin") as ssh:
+        (stdin, stdout, stderr) = ssh.exec_command(commands[action])
+        return RemoteOutput.capture(masterNode, action + "Database", stdout, stderr).returnCode
@@ -2,9 +2,34 @@ import os
 import warnings
 import traceback
 import logging
-from libcloud.compute.providers import get_driver
-from libcloud.compute.types import Provider
+from multiprocessing.pool import ThreadPool
+from libcloud.common.google import ResourceNotFoundError
 
+from ClusterBuilder import ClusterInventory
+from ClusterBuilder import GCEDriver
+
+
+def listClusters():
+    # Every cluster this CAPE_HOME has an inventory for, no GCE calls
+    clusters = ClusterInventory.listClusters()
+    if not clusters:
+        print "No clusters recorded in " + str(os.environ["CAPE_HOME"]) + "/clusterConfigs"
+        return
+    print "Cluster".ljust(24) + "Stage".ljust(12) + "Nodes".rjust(6) + "  Updated"
+    for (clusterName, stage, nodeCount, updated) in clusters:
+        print clusterName.ljust(24) + stage.ljust(12) + str(nodeCount).rjust(6) + "  " + str(updated or "-")
+
+
+def nodeState(clusterNode):
+    # One GET by name, the zone size does not matter
+    driver = GCEDriver.threadDriver()
+    try:
+        node = driver.ex_get_node(clusterNode["nodeName"], str(os.environ["ZONE"]))
+    except ResourceNotFoundError:
+        return "missing"
+    if clusterNode.get("nodeId") not in [None, node.id]:
+        return "replaced (id " + str(node.id) + ")"
+    return node.state
 
 
 def checkServerState(clusterDictionary):
@@ -14,22 +39,23 @@ def checkServerState(clusterDictionary):
     warnings.simplefilter("ignore")
     print clusterDictionary["clusterName"] + ": Querying Cluster State Started"
     try:
-        ComputeEngine = get_driver(Provider.GCE)
-        driver = ComputeEngine(os.environ["SVC_ACCOUNT"],
-                               str(os.environ["CONFIGS_PATH"]) +
-                               str(os.environ["SVC_ACCOUNT_KEY"]),
-                               project=str(os.environ["PROJECT"]),
-                               datacenter=str(os.environ["ZONE"]))
-
-        nodes = driver.list_nodes(ex_zone=str(os.environ["ZONE"]))
-        if not nodes:
+        inventory = ClusterInventory.load(clusterDictionary["clusterName"])
+        if inventory is None or not inventory["cluster"].get("clusterNodes"):
             print "Did not find any nodes for that cluster!"
             logging.info('Did not find any nodes for that cluster')
-        else:
-            for node in nodes:
-                if clusterDictionary["clusterName"] in node.name:
-                    print "\t" + node.name + ": " + node.state
-                    logging.debug(node.name + ": " + node.state)
+            return
+        print clusterDictionary["clusterName"] + ": Stage " + inventory["stage"]
+        clusterNodes = inventory["cluster"]["clusterNodes"]
+        pool = ThreadPool(min(16, len(clusterNodes)))
+        try:
+            states = pool.map(nodeState, clusterNodes)
+        finally:
+            pool.close()
+            pool.join()
+        for clusterNode, state in zip(clusterNodes, states):
+            print "\t" + clusterNode["nodeName"] + ": " + state + "  " + clusterNode["externalIP"] + \
+                "  " + clusterNode.get("role", "-")
+            logging.debug(clusterNode["nodeName"] + ": " + state)
 
     except Exception as e:
         print e
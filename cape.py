@@ -7,10 +7,19 @@ import json
 
 from dotenv import load_dotenv
 
-from ClusterBuilder import ClusterBuilder
-from ClusterBuilder import InstallGPDB
-from ClusterBuilder import SoftwareDownload
+from ClusterBuilder import BatchCreate
+from ClusterBuilder import BuildJournal
+from ClusterBuilder import ClusterInventory
+from ClusterBuilder import ClusterValidate
+from ClusterBuilder import GCEDriver
+from ClusterBuilder import GUCProfiles
+from ClusterBuilder import ImageBaker
+from ClusterBuilder import PivnetCache
+from ClusterBuilder import SegmentLayout
+from ClusterBuilder import SSHSessions
+from ClusterBuilder import Trace
 from ClusterDestroyer import ClusterDestroyer
+from QueryCluster import GPDBState
 from QueryCluster import QueryCluster
 
 def checkRequiredVars(args):
@@ -103,12 +112,12 @@ def checkRequiredVars(args):
         sys.exit('Failed! Add ROOT_PW=<desired root password> to your ' +
                  args.config + ' file.\n')
     if os.environ["RAID0"] is not None:
-        if any(x in os.environ["RAID0"] for x in allowed):
+        if any(x in os.environ["RAID0"] for x in allowed + ["auto"]):
             logging.debug('RAID0: ' + str(os.environ["RAID0"]))
         else:
-            sys.exit('Failed! Add RAID0=<yes|no> to your ' +
+            sys.exit('Failed! Add RAID0=<yes|no|auto> to your ' +
                      args.config + ' file.\n If yes, we will create ' +
-                     'a RADID0 volume using all data drives.\n')
+                     'a RADID0 volume using all data drives, auto benchmarks both.\n')
     if os.environ["MIRRORS"] is not None:
         if any(x in os.environ["MIRRORS"] for x in allowed):
             logging.debug('MIRRORS: ' + str(os.environ["MIRRORS"]))
@@ -137,13 +146,19 @@ def checkRequiredVars(args):
     else:
         sys.exit('Failed! Add SEGMENTDBS=<# of segs per node> to your ' +
                  args.config + ' file.\n')
-    if os.environ["SEGMENTDBS"] < os.environ["DISK_QTY"]:
-        logging.debug('Failed Check: SEGMENTDBS less than DISK_QTY ')
-        sys.exit('Failed! You requested lesser segs per node ' +
-                 'than the number of drives per node.\n Change SEGMENTDBS ' +
-                 'to be equal to or greater than DISK_QTY.\n\n' +
-                 'Fix SEGMENTDBS=<# of segs per node> in your ' + args.config +
-                 ' file.\n')
+    dataVolumes = SegmentLayout.volumes(int(os.environ["DISK_QTY"]), 'yes' in os.environ["RAID0"],
+                                        os.environ["BASE_HOME"])
+    if os.environ["RAID0"] != "auto" and int(os.environ["SEGMENTDBS"]) < len(dataVolumes):
+        # The layout leaves the extra volumes without a primary
+        logging.warning('SEGMENTDBS less than the ' + str(len(dataVolumes)) + ' data volumes per node')
+        print "Warning: SEGMENTDBS=" + os.environ["SEGMENTDBS"] + " leaves some of the " + \
+            str(len(dataVolumes)) + " data volumes per node without a primary segment"
+    if os.environ.get("GUC_PROFILE", "none") not in GUCProfiles.PROFILES.keys() + ["none"]:
+        sys.exit('Failed! Set GUC_PROFILE=<' + "|".join(sorted(GUCProfiles.PROFILES) + ["none"]) + '> in your ' +
+                 args.config + ' file.\n')
+    if os.environ.get("MIRROR_POLICY", "group") not in SegmentLayout.MIRROR_POLICIES:
+        sys.exit('Failed! Set MIRROR_POLICY=<group|spread> in your ' +
+                 args.config + ' file.\n')
     if os.environ["STANDBY"] is not None:
         if any(x in os.environ["STANDBY"] for x in allowed):
             logging.debug('STANDBY: ' + os.environ["STANDBY"])
@@ -173,6 +188,57 @@ def checkRequiredVars(args):
                      'yes or no.\n It should be: SET_GUCS=<yes|no>\n' +
                      'Fix SET_GUCS to be either yes or no in your ' +
                      args.config + ' file.\n')
+    if os.getenv("KEY_SHARE") is None:
+        logging.debug('Optional: KEY_SHARE is not set. Using controller')
+    elif os.environ["KEY_SHARE"] in ['controller', 'legacy']:
+        logging.debug('KEY_SHARE: ' + os.environ["KEY_SHARE"])
+    else:
+        sys.exit('Failed! Optional variable KEY_SHARE is not ' +
+                 'controller or legacy.\n It should be: ' +
+                 'KEY_SHARE=<controller|legacy>\n' +
+                 'Fix KEY_SHARE in your ' + args.config + ' file.\n')
+    if os.getenv("PIVNET_CACHE_TTL") is None:
+        logging.debug('Optional: PIVNET_CACHE_TTL is not set. Using 3600')
+    elif os.environ["PIVNET_CACHE_TTL"].isdigit():
+        logging.debug('PIVNET_CACHE_TTL: ' + os.environ["PIVNET_CACHE_TTL"])
+    else:
+        sys.exit('Failed! Optional variable PIVNET_CACHE_TTL is not ' +
+                 'a number of seconds.\n It should be: PIVNET_CACHE_TTL=<seconds>\n' +
+                 'Fix PIVNET_CACHE_TTL in your ' + args.config + ' file.\n')
+    if os.getenv("REBOOT") is None:
+        logging.debug('Optional: REBOOT is not set. Using auto')
+    elif os.environ["REBOOT"] in ["auto", "always"]:
+        logging.debug('REBOOT: ' + os.environ["REBOOT"])
+    else:
+        sys.exit('Failed! Optional variable REBOOT is not auto or always.\n' +
+                 'Fix REBOOT=<auto|always> in your ' + args.config + ' file.\n')
+    if os.getenv("SSH_PORT") is None:
+        logging.debug('Optional: SSH_PORT is not set. Using 22')
+    elif os.environ["SSH_PORT"].isdigit():
+        logging.debug('SSH_PORT: ' + os.environ["SSH_PORT"])
+    else:
+        sys.exit('Failed! Optional variable SSH_PORT is not ' +
+                 'a port number.\n It should be: SSH_PORT=<port>\n' +
+                 'Fix SSH_PORT in your ' + args.config + ' file.\n')
+    if os.getenv("ARTIFACT_FANOUT") is None:
+        logging.debug('Optional: ARTIFACT_FANOUT is not set. Using yes')
+    elif os.environ["ARTIFACT_FANOUT"] in allowed:
+        logging.debug('ARTIFACT_FANOUT: ' + os.environ["ARTIFACT_FANOUT"])
+    else:
+        sys.exit('Failed! Optional variable ARTIFACT_FANOUT is not ' +
+                 'yes or no.\n It should be: ARTIFACT_FANOUT=<yes|no>\n' +
+                 'Fix ARTIFACT_FANOUT in your ' + args.config + ' file.\n')
+    if os.getenv("STREAM_EXTRACT") is None:
+        logging.debug('Optional: STREAM_EXTRACT is not set. Using no')
+    elif os.environ["STREAM_EXTRACT"] in allowed:
+        logging.debug('STREAM_EXTRACT: ' + os.environ["STREAM_EXTRACT"])
+    else:
+        sys.exit('Failed! Optional variable STREAM_EXTRACT is not ' +
+                 'yes or no.\n It should be: STREAM_EXTRACT=<yes|no>\n' +
+                 'Fix STREAM_EXTRACT in your ' + args.config + ' file.\n')
+    if os.environ.get("STREAM_EXTRACT", "no") == "yes" and os.environ.get("ARTIFACT_FANOUT", "yes") != "no":
+        logging.warning('STREAM_EXTRACT=yes has no effect with ARTIFACT_FANOUT=yes')
+        print "Warning: STREAM_EXTRACT=yes only applies with ARTIFACT_FANOUT=no, archives are unpacked after the fan out"
     if os.getenv("GPDB_BUILD") is None:
         logging.debug('Optional: GPDB_BUILD is not set.')
     elif os.environ["GPDB_BUILD"] is not None:
@@ -193,6 +259,35 @@ def checkRequiredVars(args):
 
 
 
+def createDictionary(args, clusterName):
+    clusterDictionary = {}
+    clusterDictionary["clusterName"] = clusterName
+    clusterDictionary["nodeQty"] = args.nodes
+    clusterDictionary["clusterType"] = "pivotal-" + args.type
+    clusterDictionary["segmentDBs"] = os.environ["SEGMENTDBS"]
+    clusterDictionary["masterCount"] = 0
+    clusterDictionary["accessCount"] = 0
+    clusterDictionary["segmentCount"] = 0
+    if args.resume:
+        inventory = ClusterInventory.load(clusterName)
+        if inventory is None:
+            sys.exit('Failed! No inventory for ' + clusterName + ', nothing to resume.\n')
+        clusterDictionary.update(inventory["cluster"])
+        completedSteps = BuildJournal.start(clusterName, resume=True)
+        print clusterDictionary["clusterName"] + ": Resuming from Stage " + inventory["stage"] + " (" + \
+            str(completedSteps) + " Completed Steps)"
+    elif args.nodes is None:
+        sys.exit('Failed! --nodes is required unless resuming.\n')
+    elif (ClusterInventory.load(clusterName) or {"stage": "destroyed"})["stage"] == "destroyed":
+        BuildJournal.start(clusterName)
+    elif "test" not in clusterName:
+        # Checked before the journal is truncated, a live cluster keeps what --resume needs
+        sys.exit('Failed! Cluster ' + clusterName + ' already exists. Continue it with --resume ' +
+                 'or destroy it first.\n')
+    # A taken test name gets a timestamp in buildServers, the journal of the existing one stays
+    return clusterDictionary
+
+
 def cliParse():
     VALID_ACTION = ["create", "destroy", "query", "stage", "dbctl"]
     parser = argparse.ArgumentParser(description='Cluster Automation for Pivotal Education')
@@ -202,13 +297,20 @@ def cliParse():
     parser_query = subparsers.add_parser("query", help="Query a Cluster")
     parser_stage = subparsers.add_parser("stage", help="Stage a Cluster")
     parser_gpdb = subparsers.add_parser("gpdb", help="Start/Stop, get state of GPDB")
+    parser_image = subparsers.add_parser("image", help="Bake a prepared node image")
+    parser_validate = subparsers.add_parser("validate", help="Check disk and network performance of a Cluster")
 
     parser_create.add_argument("--type", dest='type', action="store",
                                help="Type of cluster to be create (gpdb/hdb/vanilla", required=True)
     parser_create.add_argument("--name", dest='clustername', action="store", help="Name of Cluster to be Created",
                                required=True)
-    parser_create.add_argument("--nodes", dest='nodes', default=1, action="store", help="Number of Nodes to be Created",
-                               required=True)
+    parser_create.add_argument("--nodes", dest='nodes', default=None, action="store",
+                               help="Number of Nodes to be Created (taken from the inventory with --resume)",
+                               required=False)
+    parser_create.add_argument("--resume", dest='resume', action='store_true', required=False,
+                               help="Continue a failed create from its last completed steps")
+    parser_create.add_argument("--count", dest='count', default=None, type=int, action="store",
+                               help="Build this many identical clusters named <name>-01.. at once", required=False)
 
     parser_create.add_argument("-v", dest='verbose', action='store_true', required=False)
 
@@ -222,11 +324,20 @@ def cliParse():
     #                         help="Include Lab creation in Cluster Buildout")
 
     parser_stage.add_argument("--name", dest='clustername', action="store", help="Name of Cluster to be Staged",
-                              required=True)
-    parser_query.add_argument("--name", dest='clustername', action="store", help="Name of Cluster to be Queried",
-                              required=True)
-    parser_query.add_argument("--nodes", dest='nodes', default=1, action="store", help="Number of Nodes to be Queried",
-                               required=True)
+                              required=False)
+    parser_stage.add_argument("--type", dest='type', action="store",
+                              help="Type of cluster to prefetch release metadata for (gpdb/hdb)", required=True)
+    parser_stage.add_argument("--config", dest='config', default=str(os.getcwd())+'/configs/config.env', action="store", help="Config.env file",
+                               required=False)
+    parser_stage.add_argument("--log", dest='logfile', default=str(os.getcwd())+'/cape.log', action="store", help="Location of cape log file",
+                               required=False)
+    parser_stage.add_argument("--loglevel", dest='loglevel', default='DEBUG', action="store", help="Logging level of cape log file",
+                               required=False)
+    parser_query.add_argument("--name", dest='clustername', action="store",
+                              help="Name of Cluster to be Queried, all recorded clusters are listed without it",
+                              required=False)
+    parser_query.add_argument("--nodes", dest='nodes', default=None, action="store",
+                               help="Unused, node list comes from the cluster inventory", required=False)
     parser_query.add_argument("--config", dest='config', default=str(os.getcwd())+'/configs/config.env', action="store", help="Config.env file",
                                required=False)
     # Adding in type as an optinoal arg for now. to be used in the future
@@ -239,14 +350,45 @@ def cliParse():
     parser_gpdb.add_argument("--clustername", dest='clustername', action="store", help="Name of Cluster to be Staged",
                              required=True)
 
-    parser_gpdb.add_argument("--action", dest='action', action="store", help="start/stop/state", required=True)
+    parser_gpdb.add_argument("--action", dest='action', action="store", help="start/stop/state", required=True,
+                             choices=["start", "stop", "state"])
+    parser_gpdb.add_argument("--config", dest='config', default=str(os.getcwd())+'/configs/config.env', action="store", help="Config.env file",
+                               required=False)
+    parser_gpdb.add_argument("--log", dest='logfile', default=str(os.getcwd())+'/cape.log', action="store", help="Location of cape log file",
+                               required=False)
+    parser_gpdb.add_argument("--loglevel", dest='loglevel', default='DEBUG', action="store", help="Logging level of cape log file",
+                               required=False)
+
+    parser_image.add_argument("action", action="store", help="bake", choices=["bake"])
+    parser_image.add_argument("--name", dest='imagename', action="store", help="Name of Image to be Baked",
+                              required=True)
+    parser_image.add_argument("--config", dest='config', default=str(os.getcwd())+'/configs/config.env', action="store", help="Config.env file",
+                               required=False)
+    parser_image.add_argument("--log", dest='logfile', default=str(os.getcwd())+'/cape.log', action="store", help="Location of cape log file",
+                               required=False)
+    parser_image.add_argument("--loglevel", dest='loglevel', default='DEBUG', action="store", help="Logging level of cape log file",
+                               required=False)
+
+    parser_validate.add_argument("--name", dest='clustername', action="store", help="Name of Cluster to be Validated",
+                                 required=True)
+    parser_validate.add_argument("--network", dest='network', default=None, action="store", choices=["ring", "all"],
+                                 help="iperf3 each segment host to the next (ring) or to every other (all)",
+                                 required=False)
+    parser_validate.add_argument("--config", dest='config', default=str(os.getcwd())+'/configs/config.env', action="store", help="Config.env file",
+                                 required=False)
+    parser_validate.add_argument("--log", dest='logfile', default=str(os.getcwd())+'/cape.log', action="store", help="Location of cape log file",
+                                 required=False)
+    parser_validate.add_argument("--loglevel", dest='loglevel', default='DEBUG', action="store", help="Logging level of cape log file",
+                                 required=False)
 
-    parser_destroy.add_argument("--name", dest='clustername', action="store",help="Name of Cluster to be Deleted",required=True)
+    parser_destroy.add_argument("--name", dest='clustername', action="store",
+                               help="Name of Cluster to be Deleted, comma separated to delete several at once", required=True)
 
     parser_destroy.add_argument("--config", dest='config', default=str(os.getcwd())+'/configs/config.env', action="store", help="Config.env file",
                                required=False)
-    parser_destroy.add_argument("--nodes", dest='nodes', default=1, action="store", help="Number of Nodes to be Created",
-                               required=True)
+    parser_destroy.add_argument("--nodes", dest='nodes', default=None, action="store",
+                               help="Number of Nodes to be Deleted, only used for clusters without an inventory",
+                               required=False)
     # Adding in type as an optinoal arg for now. to be used in the future
     parser_destroy.add_argument("--type", dest='type', action="store",
                                help="Type of cluster to be create (gpdb/hdb/vanilla", required=False)
@@ -271,44 +413,29 @@ def cliParse():
             load_dotenv(args.config)
             os.environ["CONFIGS_PATH"] = os.path.dirname(args.config) + '/'
             logging.debug('CONFIGS_PATH=' + os.environ["CONFIGS_PATH"])
-        clusterDictionary["clusterName"] = args.clustername
-        clusterDictionary["nodeQty"] = args.nodes
-        clusterDictionary["clusterType"] = "pivotal-" + args.type
-        clusterDictionary["segmentDBs"] = os.environ["SEGMENTDBS"]
-        clusterDictionary["masterCount"] = 0
-        clusterDictionary["accessCount"] = 0
-        clusterDictionary["segmentCount"] = 0
         checkRequiredVars(args)
-        if (args.type == "vanilla"):
-            logging.info("Creating a base Cluster:" + clusterDictionary["clusterName"])
-            logging.debug('With Dictionary: ' + json.dumps(clusterDictionary))
-            ClusterBuilder.buildServers(clusterDictionary)
-            stopTime = datetime.datetime.today()
-            print  "Cluster " + sys.argv[1] + " Completion Time: ", stopTime
-            logging.info("Cluster " + sys.argv[1] + " Completion Time: " + str(stopTime))
-            print  "Elapsed Time: ", stopTime - startTime
-            logging.info('Elapsed Time: ' + str(stopTime - startTime))
-        elif (args.type == "gpdb"):
-            print clusterDictionary["clusterName"] + ": Creating a Greenplum Database Cluster"
-            logging.info("Creating a Greenplum Database Cluster:" + clusterDictionary["clusterName"])
+        if args.count is None:
+            clusterNames = [args.clustername]
+        else:
+            clusterNames = BatchCreate.batchNames(args.clustername, args.count)
+        clusterDictionaries = [createDictionary(args, clusterName) for clusterName in clusterNames]
+        if args.count is None:
+            clusterDictionary = clusterDictionaries[0]
             logging.debug('With Dictionary: ' + json.dumps(clusterDictionary))
-            ClusterBuilder.buildServers(clusterDictionary)
-            downloads = SoftwareDownload.downloadSoftware(clusterDictionary)
-            InstallGPDB.installGPDB(clusterDictionary, downloads)
-            stopTime = datetime.datetime.today()
-            print  "Cluster " + sys.argv[1] + " Completion Time: ", stopTime
-            logging.info("Cluster " + sys.argv[1] + " Completion Time: " + str(stopTime))
-            print  "Elapsed Time: ", stopTime - startTime
-            logging.info('Elapsed Time: ' + str(stopTime - startTime))
-        elif (args.type == "hdb"):
-            print "HDB Builder"
-            ClusterBuilder.buildServers(clusterDictionary)
-            SoftwareDownload.downloadSoftware(clusterDictionary)
-            stopTime = datetime.datetime.today()
-            print  "Cluster " + sys.argv[1] + " Completion Time: ", stopTime
-            logging.info("Cluster " + sys.argv[1] + " Completion Time: " + str(stopTime))
-            print  "Elapsed Time: ", stopTime - startTime
-            logging.info('Elapsed Time: ' + str(stopTime - startTime))
+            BatchCreate.buildCluster(clusterDictionary, args.type)
+        else:
+            failures = BatchCreate.buildClusters(clusterDictionaries, args.type)
+            for batchDictionary in clusterDictionaries:
+                Trace.write(batchDictionary["clusterName"], "create", batchDictionary["clusterName"])
+                Trace.summary(batchDictionary["clusterName"], batchDictionary["clusterName"])
+            clusterDictionary["clusterName"] = None
+            if failures:
+                print "Resume a failed cluster with: cape create --resume --name <cluster name> --type " + args.type
+        stopTime = datetime.datetime.today()
+        print  "Cluster " + sys.argv[1] + " Completion Time: ", stopTime
+        logging.info("Cluster " + sys.argv[1] + " Completion Time: " + str(stopTime))
+        print  "Elapsed Time: ", stopTime - startTime
+        logging.info('Elapsed Time: ' + str(stopTime - startTime))
     elif (args.subparser_name == "query"):
         clusterDictionary["clusterName"] = args.clustername
         clusterDictionary["nodeQty"] = args.nodes
@@ -318,8 +445,12 @@ def cliParse():
             os.environ["CONFIGS_PATH"] = os.path.dirname(args.config) + '/'
             logging.debug('CONFIGS_PATH=' + os.environ["CONFIGS_PATH"])
             checkRequiredVars(args)
-        print clusterDictionary["clusterName"] + ": Querying Nodes in a Cluster"
-        QueryCluster.checkServerState(clusterDictionary)
+        if args.clustername is None:
+            QueryCluster.listClusters()
+        else:
+            print clusterDictionary["clusterName"] + ": Querying Nodes in a Cluster"
+            with Trace.span("checkServerState"):
+                QueryCluster.checkServerState(clusterDictionary)
         stopTime = datetime.datetime.today()
         print  "Cluster " + sys.argv[1] + " Completion Time: ", stopTime
         logging.info("Cluster " + sys.argv[1] + " Completion Time: " + str(stopTime))
@@ -335,12 +466,86 @@ def cliParse():
             logging.debug('CONFIGS_PATH=' + os.environ["CONFIGS_PATH"])
             checkRequiredVars(args)
         print clusterDictionary["clusterName"] + ": Destroying Cluster"
-        ClusterDestroyer.destroyServers(clusterDictionary)
+        with Trace.span("destroyServers"):
+            ClusterDestroyer.destroyServers(clusterDictionary)
         stopTime = datetime.datetime.today()
         print  "Cluster " + sys.argv[1] + " Completion Time: ", stopTime
         logging.info("Cluster " + sys.argv[1] + " Completion Time: " + str(stopTime))
         print  "Elapsed Time: ", stopTime - startTime
         logging.info('Elapsed Time: ' + str(stopTime - startTime))
+    elif (args.subparser_name == "gpdb"):
+        if (args.config):
+            print "Loading Configuration"
+            load_dotenv(args.config)
+            os.environ["CONFIGS_PATH"] = os.path.dirname(args.config) + '/'
+            logging.debug('CONFIGS_PATH=' + os.environ["CONFIGS_PATH"])
+        clusterDictionary = ClusterInventory.loadCluster(args.clustername)
+        if clusterDictionary is None:
+            sys.exit('Failed! No inventory recorded for ' + args.clustername)
+        masterNode = GPDBState.findMaster(clusterDictionary)
+        if masterNode is None:
+            sys.exit('Failed! No master node recorded for ' + args.clustername)
+        if args.action in ["start", "stop"]:
+            print clusterDictionary["clusterName"] + ": Database " + args.action.capitalize() + " Requested"
+            return_code = GPDBState.controlDatabase(masterNode, args.action)
+            logging.info('gp' + args.action + ' returned: ' + str(return_code))
+        GPDBState.printState(clusterDictionary["clusterName"], GPDBState.queryState(masterNode))
+        stopTime = datetime.datetime.today()
+        print  "Elapsed Time: ", stopTime - startTime
+        logging.info('Elapsed Time: ' + str(stopTime - startTime))
+    elif (args.subparser_name == "validate"):
+        if (args.config):
+            print "Loading Configuration"
+            load_dotenv(args.config)
+            os.environ["CONFIGS_PATH"] = os.path.dirname(args.config) + '/'
+            logging.debug('CONFIGS_PATH=' + os.environ["CONFIGS_PATH"])
+        clusterDictionary = ClusterInventory.loadCluster(args.clustername)
+        if clusterDictionary is None:
+            sys.exit('Failed! No inventory recorded for ' + args.clustername)
+        with Trace.span("validateCluster"):
+            passed = ClusterValidate.validate(clusterDictionary, args.network)
+        Trace.write(clusterDictionary["clusterName"], args.subparser_name)
+        stopTime = datetime.datetime.today()
+        print  "Elapsed Time: ", stopTime - startTime
+        logging.info('Elapsed Time: ' + str(stopTime - startTime))
+        if not passed:
+            sys.exit('Cluster Validation Failed')
+    elif (args.subparser_name == "stage"):
+        if (args.config):
+            print "Loading Configuration"
+            load_dotenv(args.config)
+            os.environ["CONFIGS_PATH"] = os.path.dirname(args.config) + '/'
+            logging.debug('CONFIGS_PATH=' + os.environ["CONFIGS_PATH"])
+        print "pivotal-" + args.type + ": Prefetching Latest Release Metadata"
+        release = PivnetCache.prefetch("pivotal-" + args.type)
+        print "pivotal-" + args.type + ": Release " + str(release["version"]) + " Staged (" + \
+            str(release["files"]) + " Files)"
+        logging.info('Staged Release: ' + json.dumps(release))
+        stopTime = datetime.datetime.today()
+        print  "Elapsed Time: ", stopTime - startTime
+        logging.info('Elapsed Time: ' + str(stopTime - startTime))
+    elif (args.subparser_name == "image"):
+        if (args.config):
+            print "Loading Configuration"
+            load_dotenv(args.config)
+            os.environ["CONFIGS_PATH"] = os.path.dirname(args.config) + '/'
+            logging.debug('CONFIGS_PATH=' + os.environ["CONFIGS_PATH"])
+        checkRequiredVars(args)
+        with Trace.span("bakeImage"):
+            ImageBaker.bakeImage(args.imagename)
+        stopTime = datetime.datetime.today()
+        print  "Elapsed Time: ", stopTime - startTime
+        logging.info('Elapsed Time: ' + str(stopTime - startTime))
+    if args.subparser_name in ["create", "query", "destroy"] and clusterDictionary["clusterName"]:
+        for clusterName in clusterDictionary["clusterName"].split(","):
+            Trace.write(clusterName, args.subparser_name)
+        Trace.summary(clusterDictionary["clusterName"])
+    logging.debug('SSH Handshakes: ' + str(SSHSessions.handshakeCount()))
+    gceSummary = GCEDriver.summary()
+    if gceSummary:
+        print gceSummary
+        logging.info(gceSummary)
+    SSHSessions.closeAll()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,94 @@
+#!/usr/bin/env bash
+
+# Short fio runs against the blank data drives, for RAID0=auto.
+# Runs sequential read, sequential write, random read and random write once
+# against every raw drive at the same time (one job per drive, as one
+# filesystem per drive would use them) and once against a temporary RAID0
+# volume over all of them.  Both layouts get the same total queue depth,
+# QUEUE_DEPTH per drive.  Readahead and scheduler are not varied, both runs use
+# the values prepareHost.sh sets on the cluster.  The results go to
+# /tmp/diskBench.json for the controller.  Refuses to touch drives that already
+# carry data.
+
+check_args() {
+  if [ -z "$1" ]; then
+    echo "Failed! Did not get number of drives"
+    exit 1
+  fi
+}
+
+DRIVE_QTY=$1
+SECONDS_PER_RUN=${2:-10}
+QUEUE_DEPTH=32
+# Must match setupDisk in prepareHost.sh
+READAHEAD=16384
+SCHEDULER=deadline
+
+installFio(){
+    command -v fio > /dev/null && return
+    sudo yum -y install epel-release > /dev/null
+    sudo yum -y install fio > /dev/null
+}
+
+checkBlank(){
+    for d in $DRIVES; do
+        if [ -n "$(sudo blkid -p $d 2>/dev/null)" ] || ls ${d}[0-9] > /dev/null 2>&1; then
+            echo "Failed! $d is not blank, not benchmarking formatted drives"
+            exit 1
+        fi
+    done
+}
+
+tuneDevice(){
+    local dev=$(basename $1)
+    [ -f /sys/block/$dev/queue/scheduler ] && sudo sh -c "echo $SCHEDULER > /sys/block/$dev/queue/scheduler" 2> /dev/null
+    sudo /sbin/blockdev --setra $READAHEAD $1
+}
+
+# fio terse output: field 7 read KB/s, 8 read IOPS, 48 write KB/s, 49 write IOPS
+runFio(){
+    local iodepth=$1 rw=$2 bs=$3 field=$4
+    shift 4
+    local jobs=""
+    for dev in "$@"; do
+        jobs="$jobs --name=$(basename $dev) --filename=$dev"
+    done
+    sudo fio --minimal --group_reporting --direct=1 --ioengine=libaio --iodepth=$iodepth --rw=$rw --bs=$bs \
+        --runtime=$SECONDS_PER_RUN --time_based $jobs | tail -1 | cut -d';' -f$field
+}
+
+# Queue depth per job first, then the devices, one job each
+benchLayout(){
+    local iodepth=$1
+    shift
+    echo "{\"seqReadKBs\": $(runFio $iodepth read 1m 7 "$@"), \"seqWriteKBs\": $(runFio $iodepth write 1m 48 "$@")," \
+         "\"randReadIOPS\": $(runFio $iodepth randread 8k 8 "$@"), \"randWriteIOPS\": $(runFio $iodepth randwrite 8k 49 "$@")}"
+}
+
+_main() {
+    check_args $1
+    DRIVES=$(ls /dev/sd[b-z] | head -n $DRIVE_QTY)
+    checkBlank
+    installFio
+    for d in $DRIVES; do
+        tuneDevice $d
+    done
+
+    echo "Benchmarking $DRIVE_QTY drives, one job per drive"
+    JBOD=$(benchLayout $QUEUE_DEPTH $DRIVES)
+    echo "jbod: $JBOD"
+
+    echo "Benchmarking $DRIVE_QTY drives as RAID0"
+    sudo mdadm --create /dev/md9 --run --level 0 --chunk 256K --raid-devices=$DRIVE_QTY $DRIVES --force > /dev/null
+    tuneDevice /dev/md9
+    # One job against md9, as deep as the per drive jobs together
+    RAID0=$(benchLayout $((QUEUE_DEPTH * DRIVE_QTY)) /dev/md9)
+    sudo mdadm --stop /dev/md9 > /dev/null
+    sudo mdadm --zero-superblock $DRIVES
+    echo "raid0: $RAID0"
+
+    echo "{\"drives\": $DRIVE_QTY, \"seconds\": $SECONDS_PER_RUN, \"queueDepth\": $QUEUE_DEPTH, \"readahead\": $READAHEAD, \"scheduler\": \"$SCHEDULER\", \"jbod\": $JBOD, \"raid0\": $RAID0}" > /tmp/diskBench.json
+}
+
+
+_main "$@"
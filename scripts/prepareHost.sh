@@ -21,11 +21,27 @@ check_args() {
   fi
 }
 
+formatDisk(){
+    echo "MAKEFS $1 -L $2"
+    sudo fdisk $1 <<EOF
+n
+p
+1
+1
+
+w
+EOF
+    sudo mkfs.xfs -f $1 -L $2 || return 1
+    sudo sh -c "echo deadline > /sys/block/$(basename $1)/queue/scheduler"
+    sudo /sbin/blockdev --setra 16384 $1
+}
+
 setupDisk(){
 # Write fstab file
 sudo sh -c 'cat /etc/fstab >> /etc/ORIG.fstab'
 sudo sh -c 'cat /tmp/fstab.cape >> /etc/fstab'
-sudo yum -y install xfsprogs xfsdump
+# Baked images already carry the xfs tools
+rpm -q xfsprogs xfsdump > /dev/null || sudo yum -y install xfsprogs xfsdump
 
 if [ "$2" == "no" ]; then
   echo "Setup $1 Disk/s with RAID0: $2"
@@ -36,28 +52,24 @@ if [ "$2" == "no" ]; then
   do
     sudo mkdir -p /data/disk$d
   done
+  # Every drive is partitioned and formatted at the same time
   cnt=1
-  echo $1
+  PIDS=""
   for c in {b..z}
   do
-    echo $c
-    sudo fdisk /dev/sd$c <<EOF
-n
-p
-1
-1
-
-w
-EOF
-#sudo sh -c 'echo "LABEL=data$cnt /data/data$cnt xfs rw,noatime,inode64,allocsize=16m 0 0" >> /etc/fstab'
-    echo $cnt
-    echo "MAKEFS"
-    echo "/dev/sd$c -L data$cnt"
-    sudo mkfs.xfs -f /dev/sd$c -L data$cnt
-    sudo echo deadline > /sys/block/sd$c/queue/scheduler
-    sudo /sbin/blockdev --setra 16384 /dev/sd$c
+    formatDisk /dev/sd$c data$cnt > /tmp/format-sd$c.log 2>&1 &
+    PIDS="$PIDS $!"
     ((++cnt > $1)) && break
   done
+  FAILED=0
+  for pid in $PIDS; do
+    wait $pid || FAILED=1
+  done
+  cat /tmp/format-sd*.log
+  if [ "$FAILED" == "1" ]; then
+    echo "Failed! Formatting a data drive failed"
+    exit 1
+  fi
 fi
 
 if [ "$2" == "yes" ]; then
@@ -88,13 +100,24 @@ if [ "$2" == "yes" ]; then
 
   sudo mdadm --zero-superblock ${DRIVES[*]}
 
+  # The volumes are assembled and formatted at the same time
+  PIDS=""
   for VOLUME in $(seq $VOLUMES); do
     DPV=$(expr "$DRIVE_COUNT" "/" "$VOLUMES")
     DRIVE_SET=($(ls /dev/sd[b-z] | head -n $(expr "$DPV" "*" "$VOLUME") | tail -n "$DPV"))
-    sudo mdadm --create /dev/md${VOLUME} --run --level 0 --chunk 256K --raid-devices=${#DRIVE_SET[@]} ${DRIVE_SET[*]} --force
-    sudo mkfs.xfs -f /dev/md${VOLUME}
     sudo mkdir -p /data${VOLUME}
+    (sudo mdadm --create /dev/md${VOLUME} --run --level 0 --chunk 256K --raid-devices=${#DRIVE_SET[@]} ${DRIVE_SET[*]} --force &&
+      sudo mkfs.xfs -f /dev/md${VOLUME}) &
+    PIDS="$PIDS $!"
+  done
+  FAILED=0
+  for pid in $PIDS; do
+    wait $pid || FAILED=1
   done
+  if [ "$FAILED" == "1" ]; then
+    echo "Failed! Building a RAID0 volume failed"
+    exit 1
+  fi
   sudo sh -c 'mdadm --detail --scan > /etc/mdadm.conf'
   sudo mount -a
 
@@ -105,8 +128,11 @@ sudo fallocate -l 50g /swapfile
 sudo chmod 600 /swapfile
 sudo mkswap /swapfile
 sudo swapon /swapfile
-# Configure deadline scheduler to survive reboots
-sudo grubby --update-kernel=ALL --args="elevator=deadline"
+}
+
+bootSetup(){
+    # Configure deadline scheduler to survive reboots
+    sudo grubby --update-kernel=ALL --args="elevator=deadline"
 }
 
 securitySetup(){
@@ -134,8 +160,9 @@ installSoftware(){
     sudo yum -y install httpd java-1.8.0-openjdk java-1.8.0-openjdk-devel epel-release git python-argparse gcc gcc-c++
     sudo yum -y install python27 python27-python-devel python27-python-pip python27-python-setuptools python27-python-tools python27-python-virtualenv
     sudo yum -y install python-pip python-devel lapack-devel
-    sudo yum -y install sshpass git iperf3 dstat flex
+    sudo yum -y install sshpass git iperf3 dstat flex fio
     sudo yum -y install pigz
+    sudo yum -y install xfsprogs xfsdump mdadm
 
     sudo pip install pip -U
     sudo pip install sh
@@ -165,16 +192,103 @@ pip install -U crcmod
 EOF
 }
 
-_main() {
-    echo "prepareHost.sh received args: $@"
-    check_args $1 $2
+# What the reboot used to do: sysctl, transparent hugepages, the deadline
+# scheduler, the fstab mounts and the sshd config.  limits.conf needs no help,
+# every new login session reads it.
+liveTuning(){
+    echo "Applying Tuning Live"
+    sudo sysctl -p > /dev/null
+    for thp in /sys/kernel/mm/transparent_hugepage /sys/kernel/mm/redhat_transparent_hugepage; do
+        for f in enabled defrag; do
+            if [ -f $thp/$f ]; then sudo sh -c "echo never > $thp/$f"; fi
+        done
+    done
+    for s in /sys/block/sd*/queue/scheduler; do
+        grep -q deadline $s && sudo sh -c "echo deadline > $s"
+    done
+    sudo mount -a
+    grep -q /swapfile /proc/swaps || sudo swapon /swapfile
+    sudo service sshd reload
+}
+
+# Compares the running state with what was asked for and writes whatever is
+# still off (and that only a reboot can fix) to /tmp/prepareHost.reboot
+rebootCheck(){
+    REASONS=""
+    while IFS='=' read -r key value; do
+        key=$(echo $key)
+        value=$(echo $value)
+        [ -z "$key" ] || [ "${key:0:1}" == "#" ] && continue
+        # Not in this kernel, a reboot would not change that
+        [ -e /proc/sys/${key//.//} ] || continue
+        [ "$(echo $(sysctl -n $key))" == "$value" ] || REASONS="$REASONS sysctl:$key"
+    done < /tmp/sysctl.conf.cape
+    for thp in /sys/kernel/mm/transparent_hugepage /sys/kernel/mm/redhat_transparent_hugepage; do
+        if [ -f $thp/enabled ]; then
+            grep -q '\[never\]' $thp/enabled || REASONS="$REASONS thp"
+        fi
+    done
+    for s in /sys/block/sd*/queue/scheduler; do
+        grep -q deadline $s || continue
+        grep -q '\[deadline\]' $s || REASONS="$REASONS scheduler:$(echo $s | cut -d/ -f4)"
+    done
+    for mp in $(grep -v '^#' /tmp/fstab.cape | awk '$3 != "swap" {print $2}'); do
+        mountpoint -q $mp || REASONS="$REASONS mount:$mp"
+    done
+    grep -q /swapfile /proc/swaps || REASONS="$REASONS swap"
+    [ "$(getenforce 2>/dev/null)" == "Enforcing" ] && REASONS="$REASONS selinux"
+    KERNEL=$(rpm -q --last kernel | head -1 | awk '{print $1}' | sed 's/^kernel-//')
+    [ -n "$KERNEL" ] && [ "$KERNEL" != "$(uname -r)" ] && REASONS="$REASONS kernel:$KERNEL"
+    echo "Reboot needed for:${REASONS:- nothing}"
+    echo $REASONS > /tmp/prepareHost.reboot
+}
+
+# Everything that is the same on every node, baked into images by `cape image bake`
+imageSetup(){
     securitySetup
     networkSetup
-    setupDisk $1 $2
+    bootSetup
     installSoftware
     setupGsutil
     serverSetup
+}
 
+# Third argument: all (default) prepares a stock image node, image stops before
+# the data disks and marks the image, node only sets up the disks.  auto picks
+# node on a baked image and all otherwise.
+_main() {
+    echo "prepareHost.sh received args: $@"
+    check_args $1 $2
+    MODE=${3:-auto}
+    if [ "$MODE" == "auto" ]; then
+        if [ -f /etc/cape-image ]; then
+            echo "Baked image: $(cat /etc/cape-image)"
+            MODE=node
+        else
+            MODE=all
+        fi
+    fi
+    case "$MODE" in
+        all)
+            imageSetup
+            setupDisk $1 $2
+            liveTuning
+            rebootCheck
+            ;;
+        image)
+            imageSetup
+            sudo sh -c "echo 'cape image baked $(date -u +%Y-%m-%dT%H:%M:%SZ)' > /etc/cape-image"
+            ;;
+        node)
+            setupDisk $1 $2
+            liveTuning
+            rebootCheck
+            ;;
+        *)
+            echo "Failed! Unknown mode $MODE"
+            exit 1
+            ;;
+    esac
 }
 
 